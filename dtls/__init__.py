@@ -19,15 +19,23 @@
 """PyDTLS package
 
 This package exports OpenSSL's DTLS support to Python. Calling its patch
-function will add the constant PROTOCOL_DTLSv1 to the Python standard library's
-ssl module.  Subsequently passing a datagram socket to that module's
-wrap_socket function (or instantiating its SSLSocket class with a datagram
-socket) will activate this module's DTLS implementation for the returned
-SSLSocket instance.
+function will add the constants PROTOCOL_DTLSv1, PROTOCOL_DTLSv1_2, and
+PROTOCOL_DTLS to the Python standard library's ssl module. Subsequently
+passing a datagram socket to that module's wrap_socket function (or
+instantiating its SSLSocket class with a datagram socket) will activate this
+module's DTLS implementation for the returned SSLSocket instance.
 
 Instead of or in addition to invoking the patch functionality, the
 SSLConnection class can be used directly for secure communication over datagram
-sockets.
+sockets. Clients that repeatedly communicate with the same servers can obtain
+established connections from a DTLSConnectionPool. Servers can authenticate
+clients through pre-shared keys held in a PSKStore instead of certificates. A
+MessageConnection transfers messages larger than a datagram over an
+established connection, a ReliableConnection provides an ordered byte
+stream with retransmission of lost data, and a PacedConnection adapts its
+sending rate to the feedback of the receiver. A ClientMux runs many
+client-side connections over a single datagram socket. A PacketClassifier
+separates DTLS from STUN and RTP datagrams that share a socket with it.
 
 wrap_socket's parameters and their semantics have been maintained.
 """
@@ -60,4 +68,11 @@ _prep_bins()  # prepare before module imports
 
 from patch import do_patch
 from sslconnection import SSLConnection
+from pool import DTLSConnectionPool
+from psk import PSKStore
+from message import MessageConnection
+from reliable import ReliableConnection
+from pacing import PacedConnection
+from clientmux import ClientMux
 from demux import force_routing_demux, reset_default_demux
+from demux.classify import PacketClassifier
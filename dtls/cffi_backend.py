@@ -0,0 +1,216 @@
+# cffi backend: OpenSSL hot-path calls through cffi in ABI mode.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""cffi Backend
+
+This module implements the OpenSSL wrapper's hot-path calls, i.e., the library
+functions invoked for every datagram, through cffi in ABI mode. cffi converts
+arguments and return values in compiled code, and therefore at a fraction of
+the per-call cost of ctypes. No compiler is required.
+
+The openssl module selects this backend at import time if the cffi package is
+available, and falls back to its ctypes implementation otherwise. Both
+implementations present the same interface; see openssl.SSLFastPath.
+
+Importing this module raises ImportError if cffi is not installed.
+"""
+
+from datetime import timedelta
+from cffi import FFI
+from err import want_status
+try:
+    from threading import Lock
+except ImportError:
+    from dummy_threading import Lock
+
+_ffi = FFI()
+_libssl_name = _libcrypto_name = None
+_libssl = _libcrypto = None
+_bind_lock = Lock()
+_raise_ssl_error = None
+_ctrl_get_timeout = _ctrl_handle_timeout = None
+
+
+def load(libssl, libcrypto, raise_ssl_error,
+         ctrl_get_timeout, ctrl_handle_timeout):
+    """Prepare the backend for use with the given libraries
+
+    Declarations are parsed and the libraries are opened upon creation of the
+    first connection, so that importing this module remains inexpensive.
+
+    Arguments:
+    libssl -- the ctypes library object of the OpenSSL protocol library
+    libcrypto -- the ctypes library object of the OpenSSL crypto library
+    raise_ssl_error -- error reporting function of the openssl module
+    ctrl_get_timeout -- the SSL_ctrl command retrieving the DTLS timer
+    ctrl_handle_timeout -- the SSL_ctrl command handling its expiration
+    """
+
+    global _libssl_name, _libcrypto_name, _raise_ssl_error
+    global _ctrl_get_timeout, _ctrl_handle_timeout
+    _libssl_name = libssl._name
+    _libcrypto_name = libcrypto._name
+    _raise_ssl_error = raise_ssl_error
+    _ctrl_get_timeout = ctrl_get_timeout
+    _ctrl_handle_timeout = ctrl_handle_timeout
+
+def _bind():
+    global _libssl, _libcrypto
+    with _bind_lock:
+        if _libssl is not None:
+            return
+        _ffi.cdef("""
+            struct timeval { long tv_sec; long tv_usec; };
+            int SSL_read(void *ssl, char *buf, int num);
+            int SSL_write(void *ssl, const char *buf, int num);
+            int SSL_do_handshake(void *ssl);
+            int SSL_pending(void *ssl);
+            int SSL_get_error(void *ssl, int ret);
+            long SSL_ctrl(void *ssl, int cmd, long larg, void *parg);
+            int BIO_write(void *b, const char *data, int dlen);
+            size_t BIO_ctrl_pending(void *b);
+        """)
+        _libcrypto = _ffi.dlopen(_libcrypto_name)
+        _libssl = _ffi.dlopen(_libssl_name)
+
+
+class CffiFastPath(object):
+    """Per-connection hot-path calls, cffi implementation
+
+    Errors are reported through the openssl module's raise_ssl_error. The func
+    attribute of such errors is the name of the failing library function. The
+    read methods, and the feed method, pass queued datagrams to a memory BIO
+    once set_feed has been called.
+    """
+
+    def __init__(self, ssl):
+        if _libssl is None:
+            _bind()
+        self._ssl = ssl
+        self._ptr = _ffi.cast("void *", ssl.raw)
+        self._buf = _ffi.new("char[]", 1024)
+        self._buf_len = 1024
+        self._tv = _ffi.new("struct timeval *")
+        self._feed_ptr = self._feed_queue = None
+
+    def set_feed(self, bio, datagrams):
+        self._feed_ptr = _ffi.cast("void *", bio)
+        self._feed_queue = datagrams
+
+    def feed(self):
+        if self._feed_queue and \
+          not _libcrypto.BIO_ctrl_pending(self._feed_ptr):
+            datagram = self._feed_queue.popleft()
+            _libcrypto.BIO_write(self._feed_ptr, datagram, len(datagram))
+
+    def read(self, length):
+        if self._feed_queue:
+            self.feed()
+        if length > self._buf_len:
+            self._buf = _ffi.new("char[]", length)
+            self._buf_len = length
+        ret = _libssl.SSL_read(self._ptr, self._buf, length)
+        if ret > 0:
+            return _ffi.buffer(self._buf, ret)[:]
+        _raise_ssl_error(ret, "SSL_read", (self._ssl, self._buf, length),
+                         self._ssl)
+
+    def read_into(self, buffer, length):
+        if length > len(buffer):
+            raise ValueError("buffer too small")
+        if self._feed_queue:
+            self.feed()
+        ret = _libssl.SSL_read(self._ptr, _ffi.from_buffer(buffer), length)
+        if ret > 0:
+            return ret
+        _raise_ssl_error(ret, "SSL_read", (self._ssl, buffer, length),
+                         self._ssl)
+
+    def write(self, data):
+        if isinstance(data, bytearray):
+            data = _ffi.from_buffer(data)
+        elif not isinstance(data, str):
+            if hasattr(data, "tobytes") and callable(data.tobytes):
+                data = data.tobytes()
+            else:
+                data = str(data)
+        ret = _libssl.SSL_write(self._ptr, data, len(data))
+        if ret > 0:
+            return ret
+        _raise_ssl_error(ret, "SSL_write", (self._ssl, data, len(data)),
+                         self._ssl)
+
+    def try_read(self, length):
+        if self._feed_queue:
+            self.feed()
+        if length > self._buf_len:
+            self._buf = _ffi.new("char[]", length)
+            self._buf_len = length
+        ret = _libssl.SSL_read(self._ptr, self._buf, length)
+        if ret > 0:
+            return _ffi.buffer(self._buf, ret)[:]
+        status = want_status.get(_libssl.SSL_get_error(self._ptr, ret))
+        if status:
+            return status
+        _raise_ssl_error(ret, "SSL_read", (self._ssl, self._buf, length),
+                         self._ssl)
+
+    def try_write(self, data):
+        if isinstance(data, bytearray):
+            data = _ffi.from_buffer(data)
+        elif not isinstance(data, str):
+            if hasattr(data, "tobytes") and callable(data.tobytes):
+                data = data.tobytes()
+            else:
+                data = str(data)
+        ret = _libssl.SSL_write(self._ptr, data, len(data))
+        if ret > 0:
+            return ret
+        status = want_status.get(_libssl.SSL_get_error(self._ptr, ret))
+        if status:
+            return status
+        _raise_ssl_error(ret, "SSL_write", (self._ssl, data, len(data)),
+                         self._ssl)
+
+    def try_handshake(self):
+        ret = _libssl.SSL_do_handshake(self._ptr)
+        if ret > 0:
+            return
+        status = want_status.get(_libssl.SSL_get_error(self._ptr, ret))
+        if status:
+            return status
+        _raise_ssl_error(ret, "SSL_do_handshake", (self._ssl,), self._ssl)
+
+    def pending(self):
+        return _libssl.SSL_pending(self._ptr)
+
+    def get_error(self, ret):
+        return _libssl.SSL_get_error(self._ptr, ret)
+
+    def get_timeout(self):
+        if _libssl.SSL_ctrl(self._ptr, _ctrl_get_timeout, 0, self._tv) != 1:
+            return
+        return timedelta(seconds=self._tv.tv_sec,
+                         microseconds=self._tv.tv_usec)
+
+    def handle_timeout(self):
+        ret = _libssl.SSL_ctrl(self._ptr, _ctrl_handle_timeout, 0, _ffi.NULL)
+        if ret >= 0:
+            return ret == 1
+        _raise_ssl_error(ret, "SSL_ctrl",
+                         (self._ssl, _ctrl_handle_timeout, 0, None), None)
@@ -0,0 +1,333 @@
+# Cipher probe: ordering of cipher suites by measured record throughput.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cipher Probe
+
+The fastest bulk cipher depends on the host: AES-GCM is the fastest choice on
+processors with AES instructions, while ChaCha20-Poly1305 outperforms it by a
+wide margin on processors without them. This module measures the record
+throughput of the bulk ciphers of a cipher list on the local host, and orders
+the list's suites from fastest to slowest.
+
+Measurements run DTLS connections between two in-process peers, whose records
+are exchanged through memory BIOs, so that no system calls are timed. The
+peers authenticate with a pre-shared key; each bulk cipher is therefore
+measured with a PSK suite that uses the same cipher and MAC. Suites whose
+bulk cipher has no PSK counterpart in the OpenSSL library retain their
+positions in the list.
+
+Results are cached on disk, keyed by the processor's feature flags and the
+OpenSSL library version, so that each bulk cipher is measured once per host
+type. The cache file is shared among all processes of a user: its location is
+given by the PYDTLS_CIPHER_CACHE environment variable, and defaults to
+pydtls/cipherprobe.json within the user's cache directory.
+
+Functions:
+
+  measure -- measure the record throughput of a cipher list's bulk ciphers
+  order_ciphers -- order a cipher list from fastest to slowest
+"""
+
+import json
+import os
+import platform
+from hashlib import sha1
+from logging import getLogger
+from timeit import default_timer
+try:
+    from threading import Lock
+except ImportError:
+    from dummy_threading import Lock
+from err import openssl_error, raise_ssl_error, ERR_HANDSHAKE_TIMEOUT
+from openssl import *
+from util import _BIO
+from sslconnection import _CTX, _SSL, _init_library, _ssl_method
+from sslconnection import PROTOCOL_DTLS, DTLS_OPENSSL_VERSION
+
+_logger = getLogger(__name__)
+
+PROBE_DURATION = 0.05  # measurement time per bulk cipher, in seconds
+PROBE_PAYLOAD = 16384  # plaintext length of the measured records
+
+_PROBE_MTU = 1400
+_PROBE_IDENTITY = "pydtls-cipherprobe"
+_PROBE_PSK = "\x5a" * 32
+_HANDSHAKE_ROUNDS = 16
+_BATCH = 16
+
+
+def _default_cache_file():
+    cache_file = os.environ.get("PYDTLS_CIPHER_CACHE")
+    if cache_file:
+        return cache_file
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or \
+      os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "pydtls", "cipherprobe.json")
+
+CACHE_FILE = _default_cache_file()
+
+
+_cpu_flag_list = None
+
+def _cpu_flags():
+    # x86 kernels list processor features as "flags", ARM kernels as
+    # "Features"; other platforms are identified by machine type only. The
+    # processor does not change while the process runs.
+    global _cpu_flag_list
+    if _cpu_flag_list is not None:
+        return _cpu_flag_list
+    _cpu_flag_list = ""
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                name, sep, value = line.partition(":")
+                if name.strip() in ("flags", "Features"):
+                    _cpu_flag_list = " ".join(sorted(value.split()))
+                    break
+    except IOError:
+        pass
+    return _cpu_flag_list
+
+
+def _host_key():
+    # The capability masks override the library's processor detection
+    return sha1("\n".join((platform.machine(), _cpu_flags(),
+                           DTLS_OPENSSL_VERSION,
+                           os.environ.get("OPENSSL_ia32cap", ""),
+                           os.environ.get("OPENSSL_armcap", "")))).hexdigest()
+
+
+def _bulk_cipher(description):
+    # Descriptions read, e.g., "PSK-AES128-GCM-SHA256 TLSv1.2 Kx=PSK Au=PSK
+    # Enc=AESGCM(128) Mac=AEAD"
+    fields = description.split()
+    attrs = dict(field.split("=", 1) for field in fields if "=" in field)
+    return fields[0], fields[1], "%s/%s" % (attrs.get("Enc"), attrs.get("Mac"))
+
+
+_suite_lists = {}
+
+def _suites(ciphers):
+    # Expand a cipher list into (suite name, bulk cipher) pairs; expansions
+    # are memoized, and callers receive copies
+    if ciphers not in _suite_lists:
+        _suite_lists[ciphers] = _expand_suites(ciphers)
+    return list(_suite_lists[ciphers])
+
+
+def _expand_suites(ciphers):
+    _init_library()
+    ctx = _CTX(SSL_CTX_new(_ssl_method(PROTOCOL_DTLS, False)))
+    SSL_CTX_set_cipher_list(ctx.value, ciphers)
+    ssl = _SSL(SSL_new(ctx.value))
+    suites = []
+    for description in SSL_get_cipher_descriptions(ssl.value):
+        name, version, bulk = _bulk_cipher(description)
+        # TLS 1.3 suites are configured separately, and do not apply to DTLS
+        if version != "TLSv1.3":
+            suites.append((name, bulk))
+    return suites
+
+
+def _transfer(src, dst):
+    pending = BIO_ctrl_pending(src)
+    if pending:
+        BIO_write(dst, BIO_read(src, pending))
+    return pending
+
+
+def _connect_pair(suite):
+    peers = []
+    for server_side in False, True:
+        ctx = _CTX(SSL_CTX_new(_ssl_method(PROTOCOL_DTLS, server_side)))
+        SSL_CTX_set_options(ctx.value,
+                            SSL_OP_NO_QUERY_MTU | SSL_OP_NO_COMPRESSION)
+        SSL_CTX_set_cipher_list(ctx.value, suite)
+        if server_side:
+            ctx.psk_cb = SSL_CTX_set_psk_server_cb(
+                ctx.value, lambda ssl, identity: _PROBE_PSK)
+        else:
+            ctx.psk_cb = SSL_CTX_set_psk_client_cb(
+                ctx.value, lambda ssl, hint: (_PROBE_IDENTITY, _PROBE_PSK))
+        ssl = _SSL(SSL_new(ctx.value))
+        ssl.ctx = ctx
+        rbio = _BIO(BIO_new(BIO_s_mem()))
+        wbio = _BIO(BIO_new(BIO_s_mem()))
+        SSL_set_bio(ssl.value, rbio.value, wbio.value)
+        rbio.disown()
+        wbio.disown()
+        SSL_set_mtu(ssl.value, _PROBE_MTU)
+        if server_side:
+            SSL_set_accept_state(ssl.value)
+        else:
+            SSL_set_connect_state(ssl.value)
+        peers.append((ssl, rbio, wbio))
+    (client, client_rbio, client_wbio), (server, server_rbio, server_wbio) = \
+      peers
+    for _ in range(_HANDSHAKE_ROUNDS):
+        done = client.fast.try_handshake() is None
+        done = server.fast.try_handshake() is None and done
+        moved = _transfer(client_wbio.value, server_rbio.value) + \
+          _transfer(server_wbio.value, client_rbio.value)
+        if done and not moved:
+            return client, client_wbio, server, server_rbio
+    raise_ssl_error(ERR_HANDSHAKE_TIMEOUT)
+
+
+def _measure_suite(suite, duration, payload):
+    client, client_wbio, server, server_rbio = _connect_pair(suite)
+    data = os.urandom(payload)
+    write, read = client.fast.write, server.fast.read
+    record_len = payload + 2 * _PROBE_MTU
+    src, dst = client_wbio.value, server_rbio.value
+
+    def run(count):
+        for _ in xrange(count):
+            write(data)
+            BIO_write(dst, BIO_read(src, record_len))
+            read(payload)
+
+    run(_BATCH)  # warm up
+    records = 0
+    start = default_timer()
+    while True:
+        run(_BATCH)
+        records += _BATCH
+        elapsed = default_timer() - start
+        if elapsed >= duration:
+            return records * payload / elapsed
+
+
+#
+# Measurement results and cipher orders - results by bulk cipher, and orders
+#                                         by cipher list, per cache file and
+#                                         host type
+#
+_results = {}
+_orders = {}
+_results_lock = Lock()
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file) as cache:
+            return json.load(cache)
+    except (IOError, ValueError):
+        return {}
+
+
+def _store_cache(cache_file, host_key, results):
+    cache = _load_cache(cache_file)
+    cache[host_key] = {"openssl": DTLS_OPENSSL_VERSION,
+                       "machine": platform.machine(),
+                       "throughput": results}
+    # Replace the file atomically, since other processes may be reading it
+    tmp_file = "%s.%d" % (cache_file, os.getpid())
+    try:
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp_file, "w") as tmp:
+            json.dump(cache, tmp, indent=1, sort_keys=True)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError) as err:
+        _logger.warning("Failed to store cipher probe results in %s: %s",
+                        cache_file, err)
+
+
+def measure(ciphers="DEFAULT", cache_file=CACHE_FILE,
+            duration=PROBE_DURATION, payload=PROBE_PAYLOAD):
+    """Measure bulk cipher throughput
+
+    Bulk ciphers are measured only if neither earlier calls within this
+    process with the same cache file nor the cache file provide results for
+    this host type. Bulk ciphers without a PSK counterpart are not measured.
+
+    Arguments:
+    ciphers -- OpenSSL cipher list whose bulk ciphers are measured
+    cache_file -- name of the cache file; None disables the on-disk cache
+    duration -- measurement time per bulk cipher, in seconds
+    payload -- plaintext length of the measured records, at most 16384
+
+    Return value:
+    a dictionary mapping bulk ciphers to throughput in bytes per second;
+    bulk ciphers are identified by encryption and MAC algorithm, e.g.,
+    "AESGCM(128)/AEAD"
+    """
+
+    with _results_lock:
+        host_key = _host_key()
+        results = _results.get((cache_file, host_key))
+        if results is None:
+            results = _results[cache_file, host_key] = {}
+            if cache_file:
+                entry = _load_cache(cache_file).get(host_key, {})
+                for bulk, throughput in entry.get("throughput", {}).items():
+                    results[str(bulk)] = throughput
+        wanted = set(bulk for name, bulk in _suites(ciphers))
+        missing = wanted.difference(results)
+        if missing:
+            measured = False
+            for name, bulk in _suites("kPSK"):
+                if bulk not in missing:
+                    continue
+                missing.discard(bulk)
+                try:
+                    throughput = _measure_suite(name, duration, payload)
+                except openssl_error() as err:
+                    _logger.warning("Failed to measure cipher suite %s: %s",
+                                    name, err)
+                    continue
+                _logger.debug("Cipher suite %s: %.1f MB/s", name,
+                              throughput / 1e6)
+                results[bulk] = throughput
+                measured = True
+            if measured and cache_file:
+                _store_cache(cache_file, host_key, results)
+        return dict((bulk, results[bulk])
+                    for bulk in wanted if bulk in results)
+
+
+def order_ciphers(ciphers="DEFAULT", cache_file=CACHE_FILE):
+    """Order a cipher list by throughput
+
+    The suites whose bulk ciphers have been measured are sorted by
+    throughput; suites with the same bulk cipher retain their relative order,
+    and suites with unmeasured bulk ciphers retain their positions. Orders
+    are memoized for the remainder of the process.
+
+    Arguments:
+    ciphers -- OpenSSL cipher list
+    cache_file -- name of the cache file; None disables the on-disk cache
+
+    Return value:
+    colon-separated list of the cipher list's suites, fastest first
+    """
+
+    key = ciphers, cache_file, _host_key()
+    if key in _orders:
+        return _orders[key]
+    throughput = measure(ciphers, cache_file)
+    suites = _suites(ciphers)
+    measured = [i for i, (name, bulk) in enumerate(suites)
+                if bulk in throughput]
+    ordered = sorted((suites[i] for i in measured),
+                     key=lambda suite: -throughput[suite[1]])
+    for i, suite in zip(measured, ordered):
+        suites[i] = suite
+    _orders[key] = ":".join(name for name, bulk in suites)
+    return _orders[key]
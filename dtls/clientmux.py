@@ -0,0 +1,246 @@
+# Client mux: many client-side DTLS connections over one datagram socket.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client Mux
+
+Client-side SSLConnection objects ordinarily own one connected datagram
+socket each. This module runs many client-side connections over a single
+unconnected datagram socket instead: each connection sends its records to
+its peer through the shared socket, and incoming datagrams are dispatched by
+their source address to the connection associated with that peer, which
+reads them from a queue. Applications that maintain thousands of
+associations, such as load generators and gateways, thereby use one file
+descriptor and one local port. With a packet classifier, the socket also
+carries protocols such as STUN and RTP alongside DTLS.
+
+Classes:
+
+  ClientMux -- client-side connections sharing one datagram socket
+"""
+
+import errno
+import socket
+import time
+from logging import getLogger
+from select import select
+from threading import Condition
+from weakref import WeakValueDictionary
+from sslconnection import SSLConnection, _MuxedPeer, PROTOCOL_DTLS, CERT_NONE
+
+_logger = getLogger(__name__)
+
+UDP_MAX_DGRAM_LENGTH = 65527
+
+
+class ClientMux(object):
+    """Client-side connections sharing one datagram socket
+
+    Connections created by this class read and write as other client-side
+    SSLConnection objects do. They are blocking, non-blocking, or subject to
+    a timeout according to this instance's timeout attribute, rather than
+    the shared socket's, which is always non-blocking. Datagrams for any of
+    the connections are received by whichever thread reads first, and queued
+    for the connections they are addressed to.
+
+    Methods:
+
+      connect -- create a connection to a server endpoint
+      service -- dispatch received datagrams to their connections
+      fileno -- the shared socket's file descriptor
+      close -- close the shared socket
+
+    Attributes:
+
+      timeout -- timeout of the connections' operations, in seconds; None
+                 for blocking operations, zero for non-blocking ones
+      unknown_drops -- number of datagrams dropped because no connection is
+                       associated with their source address
+    """
+
+    def __init__(self, keyfile=None, certfile=None, cert_reqs=CERT_NONE,
+                 ssl_version=PROTOCOL_DTLS, ca_certs=None, ciphers=None,
+                 family=socket.AF_INET, timeout=None, psk=None,
+                 do_handshake_on_connect=True, address=None,
+                 classifier=None, srtp_profiles=None):
+        """Constructor
+
+        Arguments:
+        family -- address family of the shared socket
+        timeout -- initial value of the timeout attribute
+        address -- local address to bind the shared socket to; an
+                   ephemeral port on all interfaces if None
+        classifier -- a function called with each received datagram and its
+                      sender's address, which returns whether the datagram
+                      is DTLS; see demux.classify.PacketClassifier
+        the remaining arguments match the ones of the SSLConnection class
+        """
+
+        self._keyfile = keyfile
+        self._certfile = certfile
+        self._cert_reqs = cert_reqs
+        self._ssl_version = ssl_version
+        self._ca_certs = ca_certs
+        self._ciphers = ciphers
+        self._psk = psk
+        self._do_handshake_on_connect = do_handshake_on_connect
+        self._classifier = classifier
+        self._srtp_profiles = srtp_profiles
+        self.timeout = timeout
+        self.unknown_drops = 0
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        self._sock.bind(address or ("", 0))
+        self._sock.setblocking(False)
+        self._connections = WeakValueDictionary()
+        self._ready = set()  # peers whose connections were queued datagrams
+        self._cond = Condition()
+        self._selecting = False  # whether a thread waits for the socket
+
+    def connect(self, address):
+        """Create a connection to a server endpoint
+
+        The connection's handshake is performed if do_handshake_on_connect
+        was set during initialization. At most one connection per endpoint
+        can be held at a time; a connection is released when it is shut down
+        or no longer referenced.
+
+        Arguments:
+        address -- address tuple of the server endpoint
+
+        Return value:
+        a client-side SSLConnection
+        """
+
+        family = self._sock.family
+        address = socket.getaddrinfo(address[0], address[1], family,
+                                     socket.SOCK_DGRAM)[0][4]
+        key = address[:2]
+        with self._cond:
+            if self._connections.get(key):
+                raise ValueError("a connection to %s is held by this mux" %
+                                 (key,))
+            conn = SSLConnection(_MuxedPeer(self, self._sock, address),
+                                 self._keyfile, self._certfile, False,
+                                 self._cert_reqs, self._ssl_version,
+                                 self._ca_certs, False, True, self._ciphers,
+                                 self._psk, srtp_profiles=self._srtp_profiles)
+            self._connections[key] = conn
+        _logger.debug("New muxed connection to %s", key)
+        if self._do_handshake_on_connect:
+            conn.do_handshake()
+        return conn
+
+    def service(self, timeout=0):
+        """Dispatch received datagrams to their connections
+
+        This method is intended for applications that read from their
+        connections in a single thread, with non-blocking operations. It
+        waits for datagrams to arrive for up to the given number of seconds,
+        and dispatches all available ones.
+
+        Arguments:
+        timeout -- maximum number of seconds to wait; None to wait
+                   indefinitely
+
+        Return value:
+        list of the connections that have been queued datagrams, and have
+        not yet read them
+        """
+
+        self._receive(None, timeout)
+        with self._cond:
+            ready, self._ready = self._ready, set()
+            connections = []
+            for key in ready:
+                conn = self._connections.get(key)
+                if conn and conn._datagrams:
+                    connections.append(conn)
+            return connections
+
+    def fileno(self):
+        """The shared socket's file descriptor, for use with select"""
+
+        return self._sock.fileno()
+
+    def close(self):
+        """Close the shared socket
+
+        The connections of this instance can no longer be used.
+        """
+
+        self._sock.close()
+
+    def _remove(self, conn):
+        with self._cond:
+            if self._connections.get(conn._mux_key) is conn:
+                del self._connections[conn._mux_key]
+
+    def _receive(self, datagrams, timeout):
+        # Dispatch datagrams until the given queue, or with None any queue,
+        # holds one or the timeout expires; zero dispatches the available
+        # datagrams without blocking, and None waits indefinitely. One thread
+        # at a time waits for the socket, and the others for it.
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                dispatched = self._dispatch()
+                if datagrams is not None and datagrams or \
+                  datagrams is None and dispatched:
+                    return True
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                if self._selecting:
+                    self._cond.wait(remaining)
+                    continue
+                self._selecting = True
+                self._cond.release()
+                try:
+                    select([self._sock], [], [], remaining)
+                finally:
+                    self._cond.acquire()
+                    self._selecting = False
+                    self._cond.notify_all()
+
+    def _dispatch(self):
+        # Called with the lock held; the number of datagrams dispatched
+        count = 0
+        while True:
+            try:
+                data, address = self._sock.recvfrom(UDP_MAX_DGRAM_LENGTH)
+            except socket.error as err:
+                if err.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    break
+                if err.errno in (errno.ECONNREFUSED, errno.ECONNRESET):
+                    continue  # an unreachable peer; its connection times out
+                raise
+            if self._classifier and not self._classifier(data, address):
+                continue
+            key = address[:2]
+            conn = self._connections.get(key)
+            if not conn:
+                self.unknown_drops += 1
+                _logger.debug("Dropped datagram from unknown peer: %s", key)
+                continue
+            conn._datagrams.append(data)
+            self._ready.add(key)
+            count += 1
+        if count:
+            self._cond.notify_all()
+        return count
@@ -0,0 +1,213 @@
+# Demux socket buffers: sizing and kernel drop accounting.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Demux Socket Buffers
+
+When datagrams arrive faster than an application reads them, the kernel
+drops those that do not fit into the receiving socket's buffer, without
+notice to either peer. This module sizes the buffers of the sockets of a
+demux, and reads the kernel's count of datagrams that each socket dropped.
+
+Initial buffer sizes are given to the demux constructors, or configured
+through the PYDTLS_RCVBUF and PYDTLS_SNDBUF environment variables; if neither
+is given, the system defaults apply. When a socket's drop count has grown
+since the previous check, its receive buffer is doubled, up to a limit that
+the PYDTLS_MAX_RCVBUF environment variable overrides. Buffer sizes beyond the
+system limit (net.core.rmem_max on Linux) require the CAP_NET_ADMIN
+capability.
+
+Drop counts are read from /proc/net/udp and /proc/net/udp6, which report
+the same per-socket counter that the SO_RXQ_OVFL socket option delivers as
+ancillary data. On platforms without these files, drops are not reported.
+
+Classes:
+
+  BufferSizer -- buffer sizing and drop accounting for a set of sockets
+
+Functions:
+
+  kernel_drops -- number of datagrams a socket's receive queue dropped
+"""
+
+import os
+import socket
+import sys
+from logging import getLogger
+from timeit import default_timer
+
+_logger = getLogger(__name__)
+
+
+def _env_size(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+RCVBUF = _env_size("PYDTLS_RCVBUF")
+SNDBUF = _env_size("PYDTLS_SNDBUF")
+MAX_RCVBUF = _env_size("PYDTLS_MAX_RCVBUF") or 8 << 20
+CHECK_INTERVAL = 1.0  # seconds
+
+# Linux permits privileged processes to exceed net.core.rmem_max, and
+# reports buffer sizes doubled, to account for its bookkeeping overhead
+_LINUX = sys.platform.startswith("linux")
+_SO_RCVBUFFORCE = 33 if _LINUX else None
+_REPORTED_FACTOR = 2 if _LINUX else 1
+_PROC_TABLES = "/proc/net/udp", "/proc/net/udp6"
+
+
+def _drop_counts():
+    # Drop counts by socket inode
+    counts = {}
+    for name in _PROC_TABLES:
+        try:
+            with open(name) as table:
+                next(table)  # header line
+                for line in table:
+                    fields = line.split()
+                    counts[int(fields[9])] = int(fields[-1])
+        except (IOError, StopIteration):
+            pass
+    return counts
+
+
+def _inode(sock):
+    try:
+        return os.fstat(sock.fileno()).st_ino
+    except (socket.error, OSError):
+        return  # the socket has been closed
+
+
+def kernel_drops(sock):
+    """Datagrams dropped by a socket
+
+    Arguments:
+    sock -- datagram socket
+
+    Return value:
+    number of datagrams that the kernel dropped because the socket's receive
+    queue was full, or None if the platform does not report drops
+    """
+
+    return _drop_counts().get(_inode(sock))
+
+
+def _set_rcvbuf(sock, size):
+    if _SO_RCVBUFFORCE:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, _SO_RCVBUFFORCE, size)
+            return
+        except socket.error:
+            pass  # unprivileged: the system limit applies
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+
+class BufferSizer(object):
+    """Buffer sizing and drop accounting for a set of sockets
+
+    Methods:
+
+      configure -- apply the initial buffer sizes to a socket
+      drops -- total number of datagrams dropped by sockets
+      check -- grow the receive buffers of sockets that dropped datagrams
+    """
+
+    def __init__(self, rcvbuf=None, sndbuf=None, max_rcvbuf=None):
+        """Constructor
+
+        Arguments:
+        rcvbuf -- initial receive buffer size in bytes; None selects the
+                  configured size, or the system default
+        sndbuf -- send buffer size in bytes; None selects the configured
+                  size, or the system default
+        max_rcvbuf -- limit of receive buffer growth; None selects the
+                      configured limit
+        """
+
+        self._rcvbuf = RCVBUF if rcvbuf is None else rcvbuf
+        self._sndbuf = SNDBUF if sndbuf is None else sndbuf
+        self._max_rcvbuf = MAX_RCVBUF if max_rcvbuf is None else max_rcvbuf
+        self._last_drops = {}  # by socket inode
+        self._next_check = 0
+
+    def configure(self, sock):
+        """Apply the initial buffer sizes to a socket
+
+        Arguments:
+        sock -- datagram socket
+        """
+
+        if self._rcvbuf:
+            _set_rcvbuf(sock, self._rcvbuf)
+        if self._sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._sndbuf)
+
+    def drops(self, socks):
+        """Count dropped datagrams
+
+        Arguments:
+        socks -- iterable of datagram sockets
+
+        Return value:
+        total number of datagrams that the sockets' receive queues dropped,
+        or None if the platform does not report drops
+        """
+
+        counts = _drop_counts()
+        if not counts:
+            return
+        return sum(counts.get(_inode(sock), 0) for sock in socks)
+
+    def check(self, socks):
+        """Grow the receive buffers of sockets that dropped datagrams
+
+        Drop counts are read at most once per check interval; calls in
+        between return immediately.
+
+        Arguments:
+        socks -- iterable of datagram sockets
+        """
+
+        now = default_timer()
+        if now < self._next_check:
+            return
+        self._next_check = now + CHECK_INTERVAL
+        counts = _drop_counts()
+        last_drops = {}
+        for sock in socks:
+            inode = _inode(sock)
+            if inode not in counts:
+                continue
+            last_drops[inode] = counts[inode]
+            dropped = counts[inode] - self._last_drops.get(inode, 0)
+            if dropped > 0:
+                self._grow(sock, dropped)
+        self._last_drops = last_drops
+
+    def _grow(self, sock, dropped):
+        size = sock.getsockopt(socket.SOL_SOCKET,
+                               socket.SO_RCVBUF) // _REPORTED_FACTOR
+        target = min(2 * size, self._max_rcvbuf)
+        if target > size:
+            _set_rcvbuf(sock, target)
+            _logger.info("Receive queue of %s dropped %d datagrams; "
+                         "buffer grown from %d to %d bytes",
+                         sock.getsockname(), dropped, size, target)
+        else:
+            _logger.warning("Receive queue of %s dropped %d datagrams at "
+                            "maximum buffer size %d", sock.getsockname(),
+                            dropped, size)
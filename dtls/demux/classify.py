@@ -0,0 +1,112 @@
+# Demux packet classification: DTLS, STUN and RTP on one transport address.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Demux Packet Classification
+
+Media endpoints such as WebRTC peers multiplex DTLS, STUN, and SRTP and
+SRTCP over a single transport address. RFC 7983 distinguishes them by the
+first byte of each datagram: DTLS records begin with a content type between
+20 and 63, STUN messages with a value between 0 and 3, and RTP and RTCP
+packets with a value between 128 and 191.
+
+A classifier is given to the routing demux or to the client mux. They pass
+only DTLS datagrams on towards OpenSSL, and hand STUN and RTP datagrams to
+the application's callbacks instead; other datagrams are dropped.
+
+Classes:
+
+  PacketClassifier -- dispatches datagrams by their first byte
+
+Functions:
+
+  classify -- the protocol of a datagram
+"""
+
+from logging import getLogger
+
+_logger = getLogger(__name__)
+
+DTLS = "dtls"
+STUN = "stun"
+RTP = "rtp"  # includes RTCP
+
+_PROTOCOLS = tuple(STUN if first <= 3 else
+                   DTLS if 20 <= first <= 63 else
+                   RTP if 128 <= first <= 191 else
+                   None for first in range(256))
+
+
+def classify(datagram):
+    """The protocol of a datagram
+
+    Arguments:
+    datagram -- the datagram's payload
+
+    Return value:
+    DTLS, STUN, or RTP, or None for empty datagrams and first bytes that
+    none of these protocols use
+    """
+
+    if not datagram:
+        return
+    return _PROTOCOLS[ord(datagram[0])]
+
+
+class PacketClassifier(object):
+    """Dispatches datagrams by their first byte
+
+    Instances are called with a datagram and the address of its sender, and
+    return True if the datagram is to be processed as DTLS. Otherwise, a
+    STUN or RTP datagram is passed to the corresponding callback, if one was
+    given, and other datagrams are dropped. Exceptions raised by callbacks
+    are logged, and do not propagate into the demux.
+
+    Attributes:
+
+      drops -- number of datagrams dropped because they are neither DTLS,
+               nor STUN or RTP with a callback
+    """
+
+    def __init__(self, stun=None, rtp=None):
+        """Constructor
+
+        Arguments:
+        stun -- function called with the payload and sender address of each
+                STUN datagram
+        rtp -- function called with the payload and sender address of each
+               RTP or RTCP datagram
+        """
+
+        self.drops = 0
+        self._callbacks = {STUN: stun, RTP: rtp}
+
+    def __call__(self, datagram, peer_address):
+        protocol = classify(datagram)
+        if protocol is DTLS:
+            return True
+        callback = self._callbacks.get(protocol)
+        if not callback:
+            self.drops += 1
+            _logger.debug("Dropped unclassified datagram from peer: %s",
+                          peer_address)
+            return False
+        try:
+            callback(datagram, peer_address)
+        except Exception:
+            _logger.exception("Callback for %s datagram failed", protocol)
+        return False
@@ -28,6 +28,12 @@ connecting the destination socket to the peer endpoint.
 The OSNet demux requires operating system functionality that exists in the
 Linux kernel, but not in the Windows network stack.
 
+A root socket bound to a wildcard address serves all of the host's
+addresses, and, if it is a dual-stack AF_INET6 socket, IPv4 peers as well.
+Datagrams from new peers are then received by the demux along with the local
+addresses they were sent to, replies to them are sent from those addresses,
+and each connection's socket is bound to the address its peer sent to.
+
 Classes:
 
   UDPDemux -- a network stack configuring UDP demux
@@ -39,11 +45,18 @@ Exceptions:
 """
 
 import socket
+from collections import OrderedDict
 from logging import getLogger
+from weakref import WeakValueDictionary
 from ..err import InvalidSocketError
+from ..pktinfo import PacketInfoSocket
+from buffers import BufferSizer
 
 _logger = getLogger(__name__)
 
+MAX_LOCAL_ADDRESSES = 1024  # of peers that have not yet been connected
+_WILDCARD_ADDRESSES = "0.0.0.0", "::"
+
 
 class UDPDemux(object):
     """OS network stack configuring demux
@@ -55,15 +68,37 @@ class UDPDemux(object):
     Methods:
 
       get_connection -- create a new connection or retrieve an existing one
-      service -- this method does nothing for this type of demux
+      service -- grow the receive buffers of sockets that dropped datagrams,
+                 and with a wildcard address, receive a datagram
+      sendto -- send a datagram through the root socket
+      start_pump, stop_pump -- accepted for compatibility with the routing
+                               demux; no thread is needed
+
+    Attributes:
+
+      drops -- number of datagrams dropped by the root socket and the
+               connections' sockets, or None if not reported
+      pending -- number of datagrams held for forwarding; always zero, as
+                 the network stack delivers datagrams
+      pktinfo -- whether the root socket is bound to a wildcard address,
+                 and datagrams from new peers are received by the service
+                 method along with their local addresses
+      payload -- the datagram received by the latest service call that
+                 returned a peer address, or the empty string
     """
 
-    def __init__(self, datagram_socket):
+    def __init__(self, datagram_socket, rcvbuf=None, sndbuf=None,
+                 max_rcvbuf=None, gro=False):
         """Constructor
 
         Arguments:
         datagram_socket -- the root socket; this must be a bound, unconnected
                            datagram socket
+        rcvbuf, sndbuf, max_rcvbuf -- socket buffer sizes; see BufferSizer
+        gro -- accepted for compatibility with the routing demux: the root
+               socket is read by the library's listen function, which
+               requires single datagrams, while connections apply receive
+               offload to their own sockets
         """
 
         if datagram_socket.type != socket.SOCK_DGRAM:
@@ -82,6 +117,18 @@ class UDPDemux(object):
 
         datagram_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._datagram_socket = datagram_socket
+        self._connections = WeakValueDictionary()
+        self._sizer = BufferSizer(rcvbuf, sndbuf, max_rcvbuf)
+        self._sizer.configure(datagram_socket)
+        self._pktinfo = None
+        if datagram_socket.getsockname()[0] in _WILDCARD_ADDRESSES:
+            try:
+                self._pktinfo = PacketInfoSocket(datagram_socket)
+            except socket.error as err:
+                _logger.info("Local addresses of datagrams unavailable: %s",
+                             err)
+        self._local_addresses = OrderedDict()  # peer endpoint -> address
+        self.payload = ""
 
     def get_connection(self, address):
         """Create or retrieve a muxed connection
@@ -99,23 +146,87 @@ class UDPDemux(object):
             return self._datagram_socket
 
         # Create a new datagram socket bound to the same interface and port as
-        # the root socket, but connected to the given peer
-        conn = socket.socket(self._datagram_socket.family,
-                             self._datagram_socket.type,
-                             self._datagram_socket.proto)
+        # the root socket, or to the local address that the peer sent to, but
+        # connected to the given peer
+        root = self._datagram_socket
+        conn = socket.socket(root.family, root.type, root.proto)
         conn.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        conn.bind(self._datagram_socket.getsockname())
+        if root.family == socket.AF_INET6:
+            # IPv4-mapped addresses require dual-stack sockets
+            conn.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY,
+                            root.getsockopt(socket.IPPROTO_IPV6,
+                                            socket.IPV6_V6ONLY))
+        self._sizer.configure(conn)
+        local_address = self._local_addresses.pop(address[:2], None)
+        conn.bind(local_address or root.getsockname())
         conn.connect(address)
+        self._connections[address] = conn
         _logger.debug("Created new connection for address: %s", address)
         return conn
 
-    @staticmethod
-    def service():
+    @property
+    def drops(self):
+        return self._sizer.drops(self._sockets())
+
+    pending = 0
+
+    @property
+    def pktinfo(self):
+        return self._pktinfo is not None
+
+    def service(self):
         """Service the root socket
 
-        This type of demux performs no servicing work on the root socket,
-        and instead advises the caller to proceed to listening on the root
-        socket.
+        This type of demux performs no servicing work on a root socket bound
+        to a specific address, and instead advises the caller to proceed to
+        listening on the root socket. A root socket bound to a wildcard
+        address is read instead, following its blocking mode: its datagram
+        is held as the payload attribute, and the address of its local
+        endpoint is retained for sendto and get_connection. Periodically,
+        the receive buffers of sockets that dropped datagrams are grown.
+
+        Return value:
+        True, or with a wildcard address, the address of the peer that sent
+        the datagram
+        """
+
+        self._sizer.check(self._sockets())
+        if not self._pktinfo:
+            return True
+        self.payload = ""
+        self.payload, peer_address, local_address = self._pktinfo.recvfrom()
+        if local_address:
+            self._local_addresses.pop(peer_address[:2], None)
+            self._local_addresses[peer_address[:2]] = local_address
+            if len(self._local_addresses) > MAX_LOCAL_ADDRESSES:
+                self._local_addresses.popitem(False)
+        return peer_address
+
+    def sendto(self, data, address):
+        """Send a datagram through the root socket
+
+        With a wildcard address, the datagram is sent from the local address
+        that the peer's latest datagram was received at.
+
+        Arguments:
+        data -- the datagram's payload
+        address -- the peer's address
+        """
+
+        if not self._pktinfo:
+            return self._datagram_socket.sendto(data, address)
+        return self._pktinfo.sendto(data, address,
+                                    self._local_addresses.get(address[:2]))
+
+    def start_pump(self, batch=None):
+        """Service the root socket in a background thread
+
+        The network stack delivers datagrams to connections, and this method
+        has no effect.
         """
 
-        return True
+    def stop_pump(self):
+        """Terminate the background thread; this method has no effect"""
+
+    def _sockets(self):
+        return [self._datagram_socket] + self._connections.values()
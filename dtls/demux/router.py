@@ -27,6 +27,16 @@ the connection that is associated with the sending peer.
 
 A routing UDP demux can be used on any platform.
 
+Datagrams are forwarded only while the demux is serviced, which listening
+connections do in their listen method. Applications that read from accepted
+connections in blocking threads of their own can instead start a pump: a
+background thread that services the root socket whenever it is readable.
+
+Since every datagram passes through the root socket, a packet classifier can
+be applied to them: datagrams of other protocols that share the transport
+address, such as STUN and RTP, are then handed to the application instead of
+being forwarded.
+
 Classes:
 
   UDPDemux -- an explicitly routing UDP demux
@@ -37,14 +47,55 @@ Exceptions:
   KeyError -- raised for unknown peer addresses
 """
 
+import errno
+import os
 import socket
+from collections import deque
 from logging import getLogger
-from weakref import WeakValueDictionary
+from select import select, error as select_error
+from threading import Condition, Event, RLock, Thread, current_thread
+from weakref import WeakValueDictionary, ref
 from ..err import InvalidSocketError
+from ..gro import GROReceiver
+from buffers import BufferSizer
 
 _logger = getLogger(__name__)
 
 UDP_MAX_DGRAM_LENGTH = 65527
+MAX_PENDING = 64  # datagrams from new peers held for forwarding
+PUMP_BATCH = 64  # datagrams the pump forwards per wakeup
+PUMP_INTERVAL = 0.5  # seconds between the pump's checks for termination
+
+
+def _pump(demux_ref, stop, batch):
+    # Between wakeups, the pump holds only a weak reference to its demux,
+    # and terminates once the demux is collected
+    try:
+        while not stop.is_set():
+            demux = demux_ref()
+            if not demux:
+                return
+            sock = demux.datagram_socket
+            del demux
+            try:
+                if not select([sock], [], [], PUMP_INTERVAL)[0]:
+                    continue
+                demux = demux_ref()
+                if not demux:
+                    return
+                demux._pump_batch(batch)
+                del demux
+            except (socket.error, select_error) as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                if err.args[0] == errno.EBADF or stop.is_set():
+                    _logger.debug("Demux pump terminating: %s", err)
+                    return  # the root socket was closed
+                _logger.debug("Demux pump continuing after error: %s", err)
+    finally:
+        demux = demux_ref()
+        if demux:
+            demux._pump_terminated(stop)
 
 
 class UDPDemux(object):
@@ -59,17 +110,42 @@ class UDPDemux(object):
       remove_connection -- remove an existing connection
       service -- distribute datagrams from the root socket to connections
       forward -- forward a stored datagram to a connection
+      start_pump -- service the root socket in a background thread
+      stop_pump -- terminate the background thread
+
+    Attributes:
+
+      drops -- number of datagrams dropped by the root socket and the
+               connections' sockets, or None if not reported
+      pending -- number of datagrams from new peers held for forwarding
+      pending_drops -- number of datagrams from new peers dropped because
+                       max_pending datagrams were already held
+      payload -- the earliest held datagram, or the empty string
+      payload_peer_address -- the address of the peer that sent the
+                              earliest held datagram, or None
+      pktinfo -- always False: connections send through the root socket,
+                 whose source address the routing table selects
     """
 
     _forwarding_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     _forwarding_socket.bind(('127.0.0.1', 0))
 
-    def __init__(self, datagram_socket):
+    def __init__(self, datagram_socket, rcvbuf=None, sndbuf=None,
+                 max_rcvbuf=None, gro=False, max_pending=MAX_PENDING,
+                 classifier=None):
         """Constructor
 
         Arguments:
         datagram_socket -- the root socket; this must be a bound, unconnected
                            datagram socket
+        rcvbuf, sndbuf, max_rcvbuf -- socket buffer sizes; see BufferSizer
+        gro -- if True, the root socket receives through UDP generic receive
+               offload where available; see the gro module
+        max_pending -- maximum number of datagrams from new peers to hold
+                       until they are forwarded
+        classifier -- a function called with each received datagram and its
+                      sender's address, which returns whether the datagram
+                      is to be forwarded; see classify.PacketClassifier
         """
 
         if datagram_socket.type != socket.SOCK_DGRAM:
@@ -87,9 +163,23 @@ class UDPDemux(object):
             raise InvalidSocketError("datagram_socket is connected")
 
         self.datagram_socket = datagram_socket
-        self.payload = ""
-        self.payload_peer_address = None
+        self.pending_drops = 0
+        self._pending = deque()  # (peer address, payload, coalesced segments)
+        self._max_pending = max_pending
+        self._classifier = classifier
+        self._held = Condition(RLock())  # guards the queue and the pump
+        self._pump = None
+        self._pump_stop = None
         self.connections = WeakValueDictionary()
+        self._sizer = BufferSizer(rcvbuf, sndbuf, max_rcvbuf)
+        self._sizer.configure(datagram_socket)
+        self._gro = None
+        if gro:
+            try:
+                self._gro = GROReceiver(datagram_socket)
+            except socket.error as err:
+                _logger.info("UDP generic receive offload unavailable: %s",
+                             err)
 
     def get_connection(self, address):
         """Create or retrieve a muxed connection
@@ -109,6 +199,7 @@ class UDPDemux(object):
         conn = socket.socket(self._forwarding_socket.family,
                              self._forwarding_socket.type,
                              self._forwarding_socket.proto)
+        self._sizer.configure(conn)
         conn.bind((self._forwarding_socket.getsockname()[0], 0))
         conn.connect(self._forwarding_socket.getsockname())
         if not address:
@@ -117,6 +208,27 @@ class UDPDemux(object):
         _logger.debug("Created new connection for address: %s", address)
         return conn
 
+    @property
+    def drops(self):
+        return self._sizer.drops(self._sockets())
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    @property
+    def payload(self):
+        return self._pending[0][1] if self._pending else ""
+
+    @property
+    def payload_peer_address(self):
+        return self._pending[0][0] if self._pending else None
+
+    pktinfo = False
+
+    def _sockets(self):
+        return [self.datagram_socket] + self.connections.values()
+
     def remove_connection(self, address):
         """Remove a muxed connection
 
@@ -134,7 +246,8 @@ class UDPDemux(object):
         """Service the root socket
 
         Read from the root socket and forward one datagram to a
-        connection. The call will return without forwarding data
+        connection, or all datagrams that the kernel coalesced if receive
+        offload is in use. The call will return without forwarding data
         if any of the following occurs:
 
           * An error is encountered while reading from the root socket
@@ -146,44 +259,159 @@ class UDPDemux(object):
             the payload is held by this instance and will be forwarded when
             the forward method is called
 
+        Datagrams from new peers are held in order of arrival, up to
+        max_pending of them; further ones are dropped. While datagrams are
+        held, the root socket is read only if data is available.
+
+        While the pump is running, it alone reads from the root socket; this
+        method then waits for the pump to hold a datagram from a new peer,
+        for as long as the root socket's timeout permits, and raises
+        socket.timeout or, for a non-blocking root socket, socket.error if
+        none arrives.
+
+        Periodically, the receive buffers of sockets that dropped datagrams
+        are grown.
+
         Return:
-        if the datagram received was from a new peer, then the peer's
-        address; otherwise None
+        if a datagram from a new peer is held, then the address of the peer
+        whose datagram is held the longest; otherwise None
         """
 
-        self.payload, self.payload_peer_address = \
-          self.datagram_socket.recvfrom(UDP_MAX_DGRAM_LENGTH)
-        _logger.debug("Received datagram from peer: %s",
-                      self.payload_peer_address)
-        if not self.payload:
-            self.payload_peer_address = None
+        with self._held:
+            if self._pump:
+                self._await_held()
+            else:
+                self._sizer.check(self._sockets())
+                if not self._pending or \
+                  select([self.datagram_socket], [], [], 0)[0]:
+                    self._receive()
+            # Held datagrams of peers that have since been connected
+            while self._pending and \
+              self.connections.has_key(self._pending[0][0]):
+                self.forward()
+            return self.payload_peer_address
+
+    def _await_held(self):
+        timeout = self.datagram_socket.gettimeout()
+        if timeout is None:
+            while not self._pending and self._pump:
+                self._held.wait()
+            return  # the pump may have been stopped
+        if not self._pending and timeout:
+            self._held.wait(timeout)
+        if self._pending:
             return
-        if self.connections.has_key(self.payload_peer_address):
-            self.forward()
+        if timeout:
+            raise socket.timeout("timed out")
+        raise socket.error(errno.EWOULDBLOCK, os.strerror(errno.EWOULDBLOCK))
+
+    def _receive(self):
+        if self._gro:
+            segments, peer_address = self._gro.recvfrom()
         else:
-            return self.payload_peer_address
+            payload, peer_address = \
+              self.datagram_socket.recvfrom(UDP_MAX_DGRAM_LENGTH)
+            segments = [payload]
+        _logger.debug("Received datagram from peer: %s", peer_address)
+        if self._classifier:
+            segments = [segment for segment in segments
+                        if self._classifier(segment, peer_address)]
+            if not segments:
+                return
+        if not segments[0]:
+            return
+        if self.connections.has_key(peer_address):
+            self._send(self.connections[peer_address], segments)
+        elif len(self._pending) < self._max_pending:
+            self._pending.append((peer_address, segments[0], segments[1:]))
+        else:
+            self.pending_drops += len(segments)
+            _logger.debug("Dropped datagram from new peer: %s", peer_address)
+
+    def _send(self, conn, segments):
+        conn_address = conn.getsockname()
+        for segment in segments:
+            self._forwarding_socket.sendto(segment, conn_address)
 
     def forward(self):
         """Forward a stored datagram
 
         When the service method returns the address of a new peer, it holds
-        the datagram from that peer in this instance. In this case, this
+        the datagram from that peer, along with any datagrams coalesced with
+        it, in this instance. In this case, this
         method will perform the forwarding step. The target connection is the
         one associated with address None if get_connection has not been called
         since the service method returned the new peer's address, and the
         connection associated with the new peer's address if it has.
         """
 
-        assert self.payload
-        assert self.payload_peer_address
-        if self.connections.has_key(self.payload_peer_address):
-            conn = self.connections[self.payload_peer_address]
-            default = False
-        else:
-            conn = self.connections[None]  # propagate exception if not created
-            default = True
-        _logger.debug("Forwarding datagram from peer: %s, default: %s",
-                      self.payload_peer_address, default)
-        self._forwarding_socket.sendto(self.payload, conn.getsockname())
-        self.payload = ""
-        self.payload_peer_address = None
+        with self._held:
+            assert self._pending
+            peer_address, payload, segments = self._pending[0]
+            if self.connections.has_key(peer_address):
+                conn = self.connections[peer_address]
+                default = False
+            else:
+                conn = self.connections[None]  # propagate exception if absent
+                default = True
+            _logger.debug("Forwarding datagram from peer: %s, default: %s",
+                          peer_address, default)
+            self._pending.popleft()
+            self._send(conn, [payload] + segments)
+
+    def start_pump(self, batch=PUMP_BATCH):
+        """Service the root socket in a background thread
+
+        The thread forwards datagrams as they arrive, up to batch of them
+        per wakeup, and holds those from new peers for the service method to
+        return. It terminates when stop_pump is called, when the root socket
+        is closed, or when this instance is no longer referenced. Calling
+        this method while the pump is running has no effect.
+
+        Arguments:
+        batch -- maximum number of datagrams to read per wakeup
+        """
+
+        with self._held:
+            if self._pump:
+                return
+            self._pump_stop = Event()
+            self._pump = Thread(target=_pump, name="UDPDemux pump",
+                                args=(ref(self), self._pump_stop, batch))
+            self._pump.daemon = True
+            self._pump.start()
+
+    def stop_pump(self):
+        """Terminate the background thread
+
+        This method waits for the thread to terminate, which it does within
+        PUMP_INTERVAL seconds.
+        """
+
+        with self._held:
+            pump = self._pump
+            if not pump:
+                return
+            self._pump_stop.set()
+            self._pump = None
+            self._held.notify_all()
+        if pump is not current_thread():
+            pump.join()
+
+    def _pump_batch(self, batch):
+        with self._held:
+            self._sizer.check(self._sockets())
+            held = len(self._pending)
+            self._receive()
+            for _ in xrange(batch - 1):
+                if not select([self.datagram_socket], [], [], 0)[0]:
+                    break
+                self._receive()
+            if len(self._pending) != held:
+                self._held.notify_all()
+
+    def _pump_terminated(self, stop):
+        with self._held:
+            if self._pump_stop is stop:
+                self._pump = None
+            self._held.notify_all()
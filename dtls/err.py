@@ -25,6 +25,11 @@ Classes:
 
   SSLError -- exception raised for I/O errors
   InvalidSocketError -- exception raised for improper socket objects
+
+Status sentinels:
+
+  WANT_READ -- returned instead of raising for SSL_ERROR_WANT_READ
+  WANT_WRITE -- returned instead of raising for SSL_ERROR_WANT_WRITE
 """
 
 from socket import error as socket_error
@@ -39,6 +44,20 @@ SSL_ERROR_ZERO_RETURN = 6
 SSL_ERROR_WANT_CONNECT = 7
 SSL_ERROR_WANT_ACCEPT = 8
 
+class _WantStatus(object):
+    """Continuation status returned from exception-free non-blocking calls"""
+    def __init__(self, name, ssl_error):
+        self.name = name
+        self.ssl_error = ssl_error
+
+    def __repr__(self):
+        return self.name
+
+WANT_READ = _WantStatus("WANT_READ", SSL_ERROR_WANT_READ)
+WANT_WRITE = _WantStatus("WANT_WRITE", SSL_ERROR_WANT_WRITE)
+want_status = {SSL_ERROR_WANT_READ: WANT_READ,
+               SSL_ERROR_WANT_WRITE: WANT_WRITE}
+
 ERR_BOTH_KEY_CERT_FILES = 500
 ERR_BOTH_KEY_CERT_FILES_SVR = 298
 ERR_NO_CERTS = 331
@@ -47,6 +66,11 @@ ERR_READ_TIMEOUT = 502
 ERR_WRITE_TIMEOUT = 503
 ERR_HANDSHAKE_TIMEOUT = 504
 ERR_PORT_UNREACHABLE = 505
+ERR_POOL_EXHAUSTED = 506
+ERR_NO_CURVE = 507
+ERR_DH_PARAMS = 508
+ERR_PEER_UNRESPONSIVE = 509
+ERR_NO_SRTP_PROFILE = 510
 ERR_COOKIE_MISMATCH = 0x1408A134
 
 
@@ -111,4 +135,9 @@ _ssl_errors = {
     ERR_WRITE_TIMEOUT: "The write operation timed out",
     ERR_HANDSHAKE_TIMEOUT: "The handshake operation timed out",
     ERR_PORT_UNREACHABLE: "The peer address is not reachable",
+    ERR_POOL_EXHAUSTED: "No pooled connection to the peer became available",
+    ERR_NO_CURVE: "No elliptic curve can be selected.",
+    ERR_DH_PARAMS: "The DH parameters could not be loaded",
+    ERR_PEER_UNRESPONSIVE: "The peer stopped acknowledging data",
+    ERR_NO_SRTP_PROFILE: "No SRTP protection profile can be selected.",
     }
@@ -0,0 +1,112 @@
+# UDP generic receive offload: coalesced datagram reception.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""UDP Generic Receive Offload
+
+On Linux 5.0 and later, a datagram socket with the UDP_GRO option set may
+receive consecutive datagrams of one peer coalesced into a single buffer,
+provided they are equally long, except for the last one, which may be
+shorter. The length of the coalesced datagrams is delivered as ancillary
+data, from which the buffer is split into the original datagrams. One system
+call thereby receives up to 64 datagrams, such as those that a peer sent with
+UDP segmentation offload.
+
+Python 2 sockets do not receive ancillary data; this module receives
+through the msghdr module.
+
+Classes:
+
+  GROReceiver -- receiver of coalesced datagrams from a socket
+"""
+
+import errno
+import socket
+from ctypes import c_int
+from msghdr import RECVMSG_AVAILABLE, MessageReceiver
+
+GRO_MAX_BYTES = 65536  # coalesced buffers do not exceed the IP length limit
+
+_SOL_UDP = 17
+_UDP_GRO = 104
+_CONTROL_LENGTH = 64
+
+
+class GROReceiver(object):
+    """Receiver of coalesced datagrams from a socket
+
+    Constructing an instance sets the UDP_GRO option of its socket; it raises
+    socket.error where the platform does not support the option. Receive
+    buffers are allocated once per instance; instances are therefore not
+    safe for concurrent use by multiple threads.
+
+    Methods:
+
+      recvfrom -- receive a sequence of datagrams from one peer
+      close -- clear the socket's UDP_GRO option
+    """
+
+    def __init__(self, sock, bufsize=GRO_MAX_BYTES):
+        """Constructor
+
+        Arguments:
+        sock -- datagram socket
+        bufsize -- maximum number of bytes to receive per call
+        """
+
+        if not RECVMSG_AVAILABLE:
+            raise socket.error(errno.ENOPROTOOPT,
+                               "UDP generic receive offload unavailable")
+        sock.setsockopt(_SOL_UDP, _UDP_GRO, 1)
+        self._sock = sock
+        self._receiver = MessageReceiver(sock, bufsize, _CONTROL_LENGTH)
+
+    def recvfrom(self, wait=True):
+        """Receive a sequence of datagrams from one peer
+
+        The call follows the socket's blocking mode. A socket with a timeout
+        raises socket.timeout when no datagram arrives in time; with wait
+        set to False, such a socket instead behaves as a non-blocking one.
+
+        Arguments:
+        wait -- whether to wait out the socket's timeout
+
+        Return value:
+        pair of the list of received datagrams, in order of arrival, and the
+        peer's address
+        """
+
+        data, address = self._receiver.recvfrom(wait)
+        segment = self._segment_size()
+        length = len(data)
+        if not segment or segment >= length:
+            return [data], address
+        return [data[offset:offset + segment]
+                for offset in xrange(0, length, segment)], address
+
+    def close(self):
+        """Clear the socket's UDP_GRO option
+
+        Subsequent receive calls on the socket return single datagrams.
+        """
+
+        self._sock.setsockopt(_SOL_UDP, _UDP_GRO, 0)
+
+    def _segment_size(self):
+        for level, kind, data in self._receiver.control_messages():
+            if level == _SOL_UDP and kind == _UDP_GRO:
+                return c_int.from_address(data).value
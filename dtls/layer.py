@@ -0,0 +1,141 @@
+# Layer base: common parts of the layers over SSLConnection records.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Layer Base
+
+Layers that exchange records of their own format over an established
+SSLConnection derive from the classes of this module. This module is
+private to the package.
+
+Classes:
+
+  _RecordLayer -- base of the layers over an SSLConnection's records
+  _NonBlockingLayer -- base of the layers that run their own timers
+
+Functions:
+
+  _unwrap -- expand a 32-bit sequence number
+"""
+
+from logging import getLogger
+from select import select
+from timeit import default_timer
+from err import raise_ssl_error, WANT_READ, WANT_WRITE
+
+_logger = getLogger(__name__)
+
+_DEFAULT_PAYLOAD = 1200  # record payload until the MTU is known
+_MAX_RECORD_PAYLOAD = 16384
+_SEQ_MASK = 0xFFFFFFFF
+_WRITE_WAIT = 0.1
+
+
+def _unwrap(seq, reference):
+    # Expand a 32-bit sequence number to the value closest to the reference
+    return reference + ((seq - reference + 0x80000000) & _SEQ_MASK) - \
+      0x80000000
+
+
+class _RecordLayer(object):
+    """Base of the layers over an SSLConnection's records
+
+    Both peers must wrap their connections in instances of the same
+    subclass.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def _payload_size(self, header_size):
+        # Bytes of layer data per record that fit within the MTU
+        return (self._conn.max_payload() or _DEFAULT_PAYLOAD) - header_size
+
+
+class _NonBlockingLayer(_RecordLayer):
+    """Base of the layers that run their own timers
+
+    The wrapped connection's sockets are placed into non-blocking mode; the
+    blocking methods of subclasses wait for the timeout given to the
+    constructor instead.
+
+    Subclasses map each kind of record, given by its first byte, to the
+    minimum length of such records and the name of the method that
+    processes them in the _handlers attribute. They implement
+    _handle_timers, which takes the current time, acts on expired timers,
+    and returns the time in seconds until the next one expires, or None.
+    """
+
+    _handlers = {}
+
+    def __init__(self, conn, timeout):
+        super(_NonBlockingLayer, self).__init__(conn)
+        self._timeout = timeout
+        self._rsock = conn.get_socket(True)
+        self._wsock = conn.get_socket(False)
+        for sock in set((self._rsock, self._wsock)):
+            sock.setblocking(False)
+        self._epoch = default_timer()
+
+    def service(self):
+        """Process received records and expired timers
+
+        This method does not block.
+
+        Return value:
+        time in seconds until the next timer expires, or None if no timer
+        is running
+        """
+
+        while True:
+            record = self._conn.try_read(_MAX_RECORD_PAYLOAD)
+            if record is WANT_READ or record is WANT_WRITE:
+                break
+            self._process(record)
+        return self._handle_timers(default_timer())
+
+    def _run(self, done, timeout_error):
+        deadline = None
+        if self._timeout is not None:
+            deadline = default_timer() + self._timeout
+        while True:
+            wait = self.service()
+            if done():
+                return
+            if deadline is not None:
+                remaining = deadline - default_timer()
+                if remaining <= 0:
+                    raise_ssl_error(timeout_error)
+                wait = remaining if wait is None else min(wait, remaining)
+            select([self._rsock], [], [], wait)
+
+    def _write(self, record):
+        while True:
+            status = self._conn.try_write(record)
+            if status is not WANT_READ and status is not WANT_WRITE:
+                return
+            select([], [self._wsock], [], _WRITE_WAIT)
+
+    def _process(self, record):
+        if not record:
+            return
+        kind = ord(record[0])
+        min_length, handler = self._handlers.get(kind, (None, None))
+        if handler and len(record) >= min_length:
+            getattr(self, handler)(record)
+        else:
+            _logger.warning("Dropping record of unknown kind %d", kind)
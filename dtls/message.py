@@ -0,0 +1,205 @@
+# Message layer: transfer of large application messages over DTLS records.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Message Layer
+
+A DTLS record carries at most one datagram's worth of application data. This
+module transfers application messages of up to a configurable size over an
+established SSLConnection: the sender splits each message into fragments that
+fit within the connection's MTU, and the receiver reassembles the fragments
+and hands complete messages to the application.
+
+Every record carries a header of three unsigned 32-bit integers in network
+byte order: the message's sequence number, its total length, and the offset
+of the fragment within it. Fragments are encrypted from and decrypted into
+reusable record buffers, and reassembled in a buffer allocated once per
+message; apart from these, no copies of message contents are made.
+
+Records may be lost or reordered in transit. The receiver therefore keeps a
+bounded number of partially received messages, and discards those that do
+not complete within the reassembly timeout, or that are displaced by newer
+ones. Complete messages are delivered in the order of their completion.
+
+Classes:
+
+  MessageConnection -- message transfer over an SSLConnection
+"""
+
+from collections import OrderedDict
+from logging import getLogger
+from struct import Struct
+from timeit import default_timer
+from layer import _RecordLayer, _MAX_RECORD_PAYLOAD
+
+_logger = getLogger(__name__)
+
+MAX_MESSAGE_SIZE = 1 << 20
+MAX_PENDING = 8
+REASSEMBLY_TIMEOUT = 10.0  # seconds
+
+_HEADER = Struct("!III")
+
+
+class _Reassembly(object):
+    """Partially received message"""
+
+    def __init__(self, length, deadline):
+        self.buffer = bytearray(length)
+        self.offsets = set()
+        self.received = 0
+        self.deadline = deadline
+
+
+class MessageConnection(_RecordLayer):
+    """Message transfer over an SSLConnection
+
+    The wrapped connection's blocking and timeout behavior applies to sending
+    and receiving; if a receive operation raises an exception, it can be
+    retried without loss of the fragments received so far.
+
+    Methods:
+
+      send -- send a message
+      recv -- receive the next complete message
+
+    Attributes:
+
+      discarded -- number of partially received messages that were discarded
+    """
+
+    def __init__(self, conn, max_message_size=MAX_MESSAGE_SIZE,
+                 max_pending=MAX_PENDING,
+                 reassembly_timeout=REASSEMBLY_TIMEOUT, fragment_size=None):
+        """Constructor
+
+        Arguments:
+        conn -- SSLConnection over which messages are transferred
+        max_message_size -- length limit of sent and received messages;
+                            longer received messages are dropped
+        max_pending -- maximum number of partially received messages; when
+                       a fragment of a further message arrives, the oldest
+                       one is discarded
+        reassembly_timeout -- time in seconds after which partially
+                              received messages are discarded
+        fragment_size -- message bytes per record; if None, the largest
+                         size that fits within the connection's MTU
+        """
+
+        super(MessageConnection, self).__init__(conn)
+        self._max_message_size = max_message_size
+        self._max_pending = max_pending
+        self._reassembly_timeout = reassembly_timeout
+        self._fragment_size = fragment_size
+        self._next_id = 0
+        self._pending = OrderedDict()  # by message id, oldest first
+        self._record = bytearray(_MAX_RECORD_PAYLOAD)
+        self.discarded = 0
+
+    def send(self, message):
+        """Send a message
+
+        Arguments:
+        message -- string or other buffer containing the message
+
+        Return value:
+        number of records sent
+        """
+
+        length = len(message)
+        if length > self._max_message_size:
+            raise ValueError("message of %d bytes exceeds maximum size" %
+                             length)
+        fragment_size = self._fragment_size or \
+          self._payload_size(_HEADER.size)
+        msg_id = self._next_id
+        self._next_id = (msg_id + 1) & 0xFFFFFFFF
+        view = memoryview(message)
+        record = bytearray(_HEADER.size + min(fragment_size, length))
+        offset = records = 0
+        while True:
+            fragment_len = min(fragment_size, length - offset)
+            if _HEADER.size + fragment_len != len(record):
+                record = bytearray(_HEADER.size + fragment_len)  # last one
+            _HEADER.pack_into(record, 0, msg_id, length, offset)
+            record[_HEADER.size:] = view[offset:offset + fragment_len]
+            self._conn.write(record)
+            records += 1
+            offset += fragment_len
+            if offset >= length:
+                return records
+
+    def recv(self):
+        """Receive a message
+
+        Records are read from the connection until a message is complete.
+
+        Return value:
+        bytearray containing the message
+        """
+
+        while True:
+            message = self._reassemble(self._conn.read_into(self._record))
+            if message is not None:
+                return message
+
+    def _expire(self, now):
+        # Deadlines increase in the order of insertion
+        while self._pending:
+            msg_id, entry = next(self._pending.iteritems())
+            if entry.deadline > now:
+                break
+            _logger.debug("Message %d timed out after %d of %d bytes",
+                          msg_id, entry.received, len(entry.buffer))
+            del self._pending[msg_id]
+            self.discarded += 1
+
+    def _reassemble(self, count):
+        now = default_timer()
+        self._expire(now)
+        if count < _HEADER.size:
+            _logger.warning("Dropping record without message header")
+            return
+        msg_id, length, offset = _HEADER.unpack_from(self._record)
+        fragment_len = count - _HEADER.size
+        if length > self._max_message_size or offset + fragment_len > length:
+            _logger.warning("Dropping fragment of invalid message %d "
+                            "(offset %d, length %d)", msg_id, offset, length)
+            return
+        fragment = memoryview(self._record)[_HEADER.size:count]
+        if fragment_len == length:
+            return bytearray(fragment)
+        entry = self._pending.get(msg_id)
+        if not entry:
+            if len(self._pending) >= self._max_pending:
+                discarded_id, discarded = self._pending.popitem(last=False)
+                _logger.debug("Message %d displaced after %d of %d bytes",
+                              discarded_id, discarded.received,
+                              len(discarded.buffer))
+                self.discarded += 1
+            entry = self._pending[msg_id] = _Reassembly(
+                length, now + self._reassembly_timeout)
+        elif len(entry.buffer) != length or offset in entry.offsets:
+            _logger.warning("Dropping inconsistent fragment of message %d",
+                            msg_id)
+            return
+        entry.buffer[offset:offset + fragment_len] = fragment
+        entry.offsets.add(offset)
+        entry.received += fragment_len
+        if entry.received == length:
+            del self._pending[msg_id]
+            return entry.buffer
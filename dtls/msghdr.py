@@ -0,0 +1,288 @@
+# Message headers: datagram exchange with ancillary data through ctypes.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Message Headers
+
+Python 2 sockets neither receive nor send ancillary data. On Linux, this
+module calls the C library's recvmsg and sendmsg functions through ctypes,
+for the modules that exchange datagrams along with ancillary data, such as
+gro and pktinfo. RECVMSG_AVAILABLE and SENDMSG_AVAILABLE tell whether the
+respective function could be loaded.
+
+Classes:
+
+  iovec, msghdr, cmsghdr -- the C library's structures of these names
+  MessageReceiver -- receiver of datagrams along with their ancillary data
+
+Functions:
+
+  decode_address -- convert a socket address structure to an address tuple
+  encode_address -- convert an address tuple to a socket address structure
+  control_buffer -- build a control buffer holding one control message
+  sendmsg -- send a datagram along with ancillary data
+"""
+
+import errno
+import os
+import socket
+import sys
+from ctypes import CDLL, Structure, POINTER, pointer, sizeof, string_at
+from ctypes import addressof, cast, create_string_buffer, get_errno, memmove
+from ctypes import c_int, c_uint16, c_uint32, c_size_t, c_ssize_t, c_void_p
+from ctypes.util import find_library
+from select import select
+from struct import Struct
+
+SOCKADDR_STORAGE_LENGTH = 128
+
+_SOCKADDR_IN = Struct("!H4s")  # port, address; follows the family
+_SOCKADDR_IN6 = Struct("!HI16s")  # port, flow information, address
+_FAMILY = Struct("=H")
+_SCOPE_ID = Struct("=I")
+
+
+class iovec(Structure):
+    _fields_ = [("iov_base", c_void_p),
+                ("iov_len", c_size_t)]
+
+
+class msghdr(Structure):
+    _fields_ = [("msg_name", c_void_p),
+                ("msg_namelen", c_uint32),
+                ("msg_iov", POINTER(iovec)),
+                ("msg_iovlen", c_size_t),
+                ("msg_control", c_void_p),
+                ("msg_controllen", c_size_t),
+                ("msg_flags", c_int)]
+
+
+class cmsghdr(Structure):
+    _fields_ = [("cmsg_len", c_size_t),
+                ("cmsg_level", c_int),
+                ("cmsg_type", c_int)]
+
+CMSG_ALIGN = sizeof(c_size_t)
+CMSG_HEADER_LENGTH = (sizeof(cmsghdr) + CMSG_ALIGN - 1) & -CMSG_ALIGN
+
+
+def _libc_function(name):
+    # Load a function taking a socket, a message header, and flags
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        function = getattr(CDLL(find_library("c"), use_errno=True), name)
+    except (OSError, AttributeError):
+        return
+    function.argtypes = c_int, POINTER(msghdr), c_int
+    function.restype = c_ssize_t
+    return function
+
+_recvmsg = _libc_function("recvmsg")
+_sendmsg = _libc_function("sendmsg")
+
+RECVMSG_AVAILABLE = _recvmsg is not None
+SENDMSG_AVAILABLE = _sendmsg is not None
+
+
+def decode_address(name, length):
+    """Convert a socket address structure to an address tuple
+
+    Arguments:
+    name -- memory address of the structure
+    length -- length of the structure
+
+    Return value:
+    address tuple in the standard library's format, or None if the
+    structure is not of family AF_INET or AF_INET6
+    """
+
+    family = c_uint16.from_address(name).value
+    if family == socket.AF_INET and length >= 8:
+        port, addr = _SOCKADDR_IN.unpack(string_at(name + 2, 6))
+        return socket.inet_ntoa(addr), port
+    if family == socket.AF_INET6 and length >= 28:
+        port, flowinfo, addr = _SOCKADDR_IN6.unpack(string_at(name + 2, 22))
+        scope_id = int(c_uint32.from_address(name + 24).value)
+        return socket.inet_ntop(socket.AF_INET6, addr), port, flowinfo, \
+          scope_id
+
+
+def encode_address(family, address):
+    """Convert an address tuple to a socket address structure
+
+    Arguments:
+    family -- AF_INET or AF_INET6
+    address -- address tuple in the standard library's format
+
+    Return value:
+    string containing the structure
+    """
+
+    if family == socket.AF_INET:
+        return _FAMILY.pack(family) + \
+          _SOCKADDR_IN.pack(address[1], socket.inet_aton(address[0])) + \
+          "\0" * 8
+    flowinfo, scope_id = address[2:4] if len(address) > 2 else (0, 0)
+    return _FAMILY.pack(family) + \
+      _SOCKADDR_IN6.pack(address[1], flowinfo,
+                         socket.inet_pton(socket.AF_INET6, address[0])) + \
+      _SCOPE_ID.pack(scope_id)
+
+
+def control_buffer(level, kind, data):
+    """Build a control buffer holding one control message
+
+    Arguments:
+    level -- the message's protocol level
+    kind -- the message's type
+    data -- string containing the message's data
+
+    Return value:
+    ctypes string buffer, suitable for sendmsg's control argument
+    """
+
+    space = CMSG_HEADER_LENGTH + ((len(data) + CMSG_ALIGN - 1) & -CMSG_ALIGN)
+    control = create_string_buffer(space)
+    cmsg = cmsghdr.from_buffer(control)
+    cmsg.cmsg_len = CMSG_HEADER_LENGTH + len(data)
+    cmsg.cmsg_level = level
+    cmsg.cmsg_type = kind
+    memmove(addressof(control) + CMSG_HEADER_LENGTH, data, len(data))
+    return control
+
+
+def sendmsg(sock, data, address, control=None):
+    """Send a datagram along with ancillary data
+
+    The datagram is sent regardless of the socket's blocking mode.
+
+    Arguments:
+    sock -- datagram socket of family AF_INET or AF_INET6
+    data -- the datagram's payload
+    address -- the peer's address
+    control -- control buffer, as built by control_buffer, or None
+
+    Return value:
+    number of bytes sent
+    """
+
+    name = encode_address(sock.family, address)
+    msg = msghdr()
+    msg.msg_name = cast(name, c_void_p)
+    msg.msg_namelen = len(name)
+    iov = iovec(cast(data, c_void_p), len(data))
+    msg.msg_iov = pointer(iov)
+    msg.msg_iovlen = 1
+    if control is not None:
+        msg.msg_control = addressof(control)
+        msg.msg_controllen = sizeof(control)
+    fd = sock.fileno()
+    while True:
+        length = _sendmsg(fd, pointer(msg), 0)
+        if length >= 0:
+            return length
+        err = get_errno()
+        if err == errno.EWOULDBLOCK:
+            select([], [sock], [], None)
+        elif err != errno.EINTR:
+            raise socket.error(err, os.strerror(err))
+
+
+class MessageReceiver(object):
+    """Receiver of datagrams along with their ancillary data
+
+    Receive buffers are allocated once per instance; instances are therefore
+    not safe for concurrent use by multiple threads.
+
+    Methods:
+
+      recvfrom -- receive a datagram
+      control_messages -- iterate over the last datagram's control messages
+    """
+
+    def __init__(self, sock, bufsize, control_length):
+        """Constructor
+
+        Arguments:
+        sock -- datagram socket
+        bufsize -- maximum number of bytes to receive per call
+        control_length -- maximum number of bytes of ancillary data to
+                          receive per call
+        """
+
+        self._sock = sock
+        self._buf = create_string_buffer(bufsize)
+        self._name = create_string_buffer(SOCKADDR_STORAGE_LENGTH)
+        self._control = create_string_buffer(control_length)
+        self._iov = iovec(cast(self._buf, c_void_p), bufsize)
+        self._msg = msghdr()
+        self._msg.msg_iov = pointer(self._iov)
+        self._msg.msg_iovlen = 1
+        self._msg_ref = pointer(self._msg)
+
+    def recvfrom(self, wait=True):
+        """Receive a datagram
+
+        The call follows the socket's blocking mode. A socket with a timeout
+        raises socket.timeout when no datagram arrives in time; with wait
+        set to False, such a socket instead behaves as a non-blocking one.
+
+        Arguments:
+        wait -- whether to wait out the socket's timeout
+
+        Return value:
+        pair of the received data and the peer's address
+        """
+
+        timeout = self._sock.gettimeout()
+        if wait and timeout:
+            if not select([self._sock], [], [], timeout)[0]:
+                raise socket.timeout("timed out")
+        msg = self._msg
+        fd = self._sock.fileno()
+        while True:
+            msg.msg_name = addressof(self._name)
+            msg.msg_namelen = SOCKADDR_STORAGE_LENGTH
+            msg.msg_control = addressof(self._control)
+            msg.msg_controllen = sizeof(self._control)
+            length = _recvmsg(fd, self._msg_ref, 0)
+            if length >= 0:
+                break
+            err = get_errno()
+            if err != errno.EINTR:
+                raise socket.error(err, os.strerror(err))
+        return string_at(self._buf, length), \
+          decode_address(msg.msg_name, msg.msg_namelen)
+
+    def control_messages(self):
+        """Iterate over the last received datagram's control messages
+
+        Return value:
+        iterator over triples of each message's protocol level, type, and
+        the memory address of its data
+        """
+
+        control = addressof(self._control)
+        end = control + self._msg.msg_controllen
+        while control + CMSG_HEADER_LENGTH <= end:
+            cmsg = cmsghdr.from_address(control)
+            if cmsg.cmsg_len < CMSG_HEADER_LENGTH:
+                break
+            yield cmsg.cmsg_level, cmsg.cmsg_type, \
+              control + CMSG_HEADER_LENGTH
+            control += (cmsg.cmsg_len + CMSG_ALIGN - 1) & -CMSG_ALIGN
@@ -36,19 +36,20 @@ import sys
 import array
 import socket
 from logging import getLogger
-from os import path
+from os import path, environ
 from datetime import timedelta
 from err import openssl_error
-from err import SSL_ERROR_NONE
+from err import SSL_ERROR_NONE, SSL_ERROR_WANT_READ
+from err import want_status
 from util import _BIO
 import ctypes
 from ctypes import CDLL
 from ctypes import CFUNCTYPE
 from ctypes import c_void_p, c_int, c_long, c_uint, c_ulong, c_char_p, c_size_t
-from ctypes import c_short, c_ushort, c_ubyte, c_char
+from ctypes import c_short, c_ushort, c_ubyte, c_char, c_uint64
 from ctypes import byref, POINTER, addressof
 from ctypes import Structure, Union
-from ctypes import create_string_buffer, sizeof, memmove, cast
+from ctypes import create_string_buffer, sizeof, memmove, cast, string_at
 
 #
 # Module initialization
@@ -58,6 +59,22 @@ _logger = getLogger(__name__)
 #
 # Library loading
 #
+def _load_libraries(candidates):
+    # Load the first available pair of cryptographic and protocol libraries;
+    # the PYDTLS_OPENSSL_VERSION environment variable restricts the candidates
+    # to the given library version
+    version = environ.get("PYDTLS_OPENSSL_VERSION")
+    if version:
+        candidates = [i for i in candidates if i[0] == version]
+    for _, crypto_name, ssl_name in candidates:
+        try:
+            crypto = CDLL(crypto_name)
+            return crypto, CDLL(ssl_name)
+        except OSError:
+            _logger.debug("Failed to load %s and %s", crypto_name, ssl_name)
+    raise OSError("No supported OpenSSL library found; tried: " +
+                  ", ".join(i[2] for i in candidates))
+
 if sys.platform.startswith('win'):
     dll_path = path.abspath(path.dirname(__file__))
     debug_cryptodll_path = path.join(dll_path, "cygcrypto-1.0.0.dll")
@@ -69,13 +86,41 @@ if sys.platform.startswith('win'):
       path.exists(debug_ssldll_path):
         libcrypto = CDLL(debug_cryptodll_path)
         libssl = CDLL(debug_ssldll_path)
-    else:
-        # If these don't exist, then let the exception propagate
+    elif path.exists(release_cryptodll_path) and \
+      path.exists(release_ssldll_path):
         libcrypto = CDLL(release_cryptodll_path)
         libssl = CDLL(release_ssldll_path)
+    else:
+        arch = "-x64" if sizeof(c_void_p) == 8 else ""
+        libcrypto, libssl = _load_libraries(
+            [(ver, "libcrypto-%s%s.dll" % (sfx, arch),
+              "libssl-%s%s.dll" % (sfx, arch))
+             for ver, sfx in (("3", "3"), ("1.1", "1_1"))])
+elif sys.platform == "darwin":
+    libcrypto, libssl = _load_libraries(
+        [(ver, "libcrypto.%s.dylib" % ver, "libssl.%s.dylib" % ver)
+         for ver in ("3", "1.1", "1.0.0")])
 else:
-    libcrypto = CDLL("libcrypto.so.1.0.0")
-    libssl = CDLL("libssl.so.1.0.0")
+    libcrypto, libssl = _load_libraries(
+        [(ver, "libcrypto.so." + ver, "libssl.so." + ver)
+         for ver in ("3", "1.1", "1.0.0")])
+
+#
+# Library generation - OpenSSL 1.1.0 made the library's structures opaque,
+# replaced some functions and macros with functions under different names and
+# signatures, and performs its own locking; OpenSSL 3.0 widened the option
+# bitmasks to 64 bits
+#
+OPENSSL_1_1_API = hasattr(libssl, "OPENSSL_init_ssl")
+OPENSSL_3_API = hasattr(libcrypto, "OSSL_PROVIDER_load")
+
+def _find_symbol(lib, names):
+    # Return the first of the given alternative symbol names that the library
+    # exports, or the first name if none is exported
+    for name in names:
+        if hasattr(lib, name):
+            return name
+    return names[0]
 
 #
 # Integer constants - exported
@@ -83,7 +128,9 @@ else:
 BIO_NOCLOSE = 0x00
 BIO_CLOSE = 0x01
 SSLEAY_VERSION = 0
+SSL_OP_NO_QUERY_MTU = 0x00001000
 SSL_OP_NO_COMPRESSION = 0x00020000
+SSL_OP_CIPHER_SERVER_PREFERENCE = 0x00400000
 SSL_VERIFY_NONE = 0x00
 SSL_VERIFY_PEER = 0x01
 SSL_VERIFY_FAIL_IF_NO_PEER_CERT = 0x02
@@ -108,10 +155,25 @@ CRYPTO_LOCK = 1
 SSL_CTRL_SET_SESS_CACHE_MODE = 44
 SSL_CTRL_SET_READ_AHEAD = 41
 SSL_CTRL_OPTIONS = 32
+SSL_CTRL_GET_SESSION_REUSED = 8
+SSL_CTRL_SET_TMP_DH = 3
+SSL_CTRL_SET_TMP_ECDH = 4
+SSL_CTRL_SET_CURVES_LIST = 92
+SSL_CTRL_SET_ECDH_AUTO = 94
+SSL_CTRL_SET_DH_AUTO = 118
+SSL_CTRL_SET_MTU = 17
+NID_X9_62_prime256v1 = 415
+OPENSSL_INIT_LOAD_CRYPTO_STRINGS = 0x00000002
+OPENSSL_INIT_LOAD_SSL_STRINGS = 0x00200000
 BIO_CTRL_INFO = 3
+BIO_CTRL_PENDING = 10
 BIO_CTRL_DGRAM_SET_CONNECTED = 32
 BIO_CTRL_DGRAM_GET_PEER = 46
 BIO_CTRL_DGRAM_SET_PEER = 44
+BIO_CTRL_DGRAM_QUERY_MTU = 40
+BIO_CTRL_DGRAM_GET_MTU = 41
+BIO_CTRL_DGRAM_SET_MTU = 42
+BIO_CTRL_DGRAM_GET_FALLBACK_MTU = 47
 BIO_C_SET_NBIO = 102
 DTLS_CTRL_GET_TIMEOUT = 73
 DTLS_CTRL_HANDLE_TIMEOUT = 74
@@ -222,6 +284,21 @@ class SSL_CIPHER(FuncParam):
         super(SSL_CIPHER, self).__init__(value)
 
 
+class SSL_SESSION(FuncParam):
+    def __init__(self, value):
+        super(SSL_SESSION, self).__init__(value)
+
+
+class DH(FuncParam):
+    def __init__(self, value):
+        super(DH, self).__init__(value)
+
+
+class EC_KEY(FuncParam):
+    def __init__(self, value):
+        super(EC_KEY, self).__init__(value)
+
+
 class GENERAL_NAME_union_d(Union):
     _fields_ = [("ptr", c_char_p),
                 # entries omitted
@@ -281,6 +358,11 @@ class TIMEVAL(Structure):
                 ("tv_usec", c_long)]
 
 
+class SRTP_PROTECTION_PROFILE(Structure):
+    _fields_ = [("name", c_char_p),
+                ("id", c_ulong)]
+
+
 #
 # Socket address conversions
 #
@@ -357,11 +439,16 @@ def inet_pton(address_family, string_ip):
     return ret_packed_ip
 
 def addr_tuple_from_sockaddr_u(su):
+    if su.ss.ss_family == socket.AF_UNSPEC:
+        return  # no peer, as reported by BIOs other than datagram ones
     if su.ss.ss_family == socket.AF_INET6:
+        # Integers as in the standard library's address tuples, so that a
+        # peer's tuple compares and formats alike whichever produced it; the
+        # scope identifier is an interface index, in host byte order
         return (inet_ntop(socket.AF_INET6, su.s6.sin6_addr),
                 socket.ntohs(su.s6.sin6_port),
-                socket.ntohl(su.s6.sin6_flowinfo),
-                socket.ntohl(su.s6.sin6_scope_id))
+                int(socket.ntohl(su.s6.sin6_flowinfo)),
+                int(su.s6.sin6_scope_id))
     assert su.ss.ss_family == socket.AF_INET
     return inet_ntop(socket.AF_INET, su.s4.sin_addr), \
       socket.ntohs(su.s4.sin_port)
@@ -373,7 +460,7 @@ def sockaddr_u_from_addr_tuple(address):
         su.s6.sin6_addr[:] = inet_pton(socket.AF_INET6, address[0])
         su.s6.sin6_port = socket.htons(address[1])
         su.s6.sin6_flowinfo = socket.htonl(address[2])
-        su.s6.sin6_scope_id = socket.htonl(address[3])
+        su.s6.sin6_scope_id = address[3]
     else:
         su.ss.ss_family = socket.AF_INET
         su.s4.sin_addr[:] = inet_pton(socket.AF_INET, address[0])
@@ -383,22 +470,61 @@ def sockaddr_u_from_addr_tuple(address):
 #
 # Error handling
 #
-def raise_ssl_error(result, func, args, ssl):
-    if not ssl:
-        ssl_error = SSL_ERROR_NONE
-    else:
+class _ErrorQueue(object):
+    """Captured OpenSSL error queue
+
+    Only numeric error codes are retrieved when an error is raised. They are
+    decoded into a list of (code, string) pairs upon first access to the
+    entries of this sequence, so that errors that are handled without being
+    reported do not incur string formatting.
+    """
+
+    def __init__(self, codes):
+        self.codes = codes
+        self._entries = None
+
+    def _decode(self):
+        if self._entries is None:
+            entries = []
+            for err in self.codes:
+                buf = create_string_buffer(512)
+                _ERR_error_string_n(err, buf, sizeof(buf))
+                entries.append((err, buf.value))
+            self._entries = entries
+        return self._entries
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self._decode()[index]
+
+    def __iter__(self):
+        return iter(self._decode())
+
+    def __eq__(self, other):
+        return self._decode() == other
+
+    def __ne__(self, other):
+        return self._decode() != other
+
+    def __repr__(self):
+        return repr(self._decode())
+
+def raise_ssl_error(result, func, args, ssl, ssl_error=SSL_ERROR_NONE):
+    if ssl:
         ssl_error = _SSL_get_error(ssl, result)
-    errqueue = []
+    codes = []
     while True:
         err = _ERR_get_error()
         if not err:
             break
-        buf = create_string_buffer(512)
-        _ERR_error_string_n(err, buf, sizeof(buf))
-        errqueue.append((err, buf.value))
+        codes.append(err)
+    errqueue = _ErrorQueue(codes)
     _logger.debug("SSL error raised: ssl_error: %d, result: %d, " +
                   "errqueue: %s, func_name: %s",
-                  ssl_error, result, errqueue, func.func_name)
+                  ssl_error, result, errqueue,
+                  getattr(func, "func_name", func))
     raise openssl_error()(ssl_error, errqueue, result, func, args)
 
 def find_ssl_arg(args):
@@ -424,8 +550,58 @@ def errcheck_FuncParam(result, func, args):
 #
 # Function prototypes
 #
+class _LazyFunction(object):
+    """Library function whose symbol is bound upon first call
+
+    The first call builds the function's prototype and resolves its symbol in
+    its library. The resulting function then replaces this placeholder in the
+    namespaces of this module and of the package's other modules, e.g., those
+    that import all of this module's names, so that their calls no longer
+    pass through it. Modules outside the package that imported the
+    placeholder are forwarded.
+
+    A function that is exported under different names by different library
+    versions is specified with a tuple of names. The first name is the one
+    under which the function is made available by this module; the symbol
+    bound is the first one of the names that the library exports.
+    """
+
+    def __init__(self, glbl_name, spec):
+        self.func_name = spec[0][0] if isinstance(spec[0], tuple) else spec[0]
+        self._glbl_name = glbl_name
+        self._spec = spec
+        self._func = None
+
+    def __call__(self, *args):
+        func = self._func
+        if func is None:
+            func = self._func = _bind_function(*self._spec)
+            self._replace(func)
+        return func(*args)
+
+    def _replace(self, func):
+        name = self._glbl_name
+        for mod_name, module in sys.modules.items():
+            # Implicit relative imports leave None entries for misses
+            if module and mod_name.startswith(_package_prefix) and \
+              getattr(module, name, None) is self:
+                setattr(module, name, func)
+        globals()[name] = func
+
 def _make_function(name, lib, args, export=True, errcheck="default"):
     assert len(args)
+    py_name = name[0] if isinstance(name, tuple) else name
+    if export:
+        glbl_name = py_name
+        __all__.append(py_name)
+    else:
+        glbl_name = "_" + py_name
+    globals()[glbl_name] = _LazyFunction(glbl_name,
+                                         (name, lib, args, errcheck))
+
+def _bind_function(name, lib, args, errcheck):
+    if isinstance(name, tuple):
+        name = _find_symbol(lib, name)
 
     def type_subst(map_type):
         if _subst.has_key(map_type):
@@ -441,11 +617,6 @@ def _make_function(name, lib, args, export=True, errcheck="default"):
         pointer_return = False
     if not _sigs.has_key(sig):
         _sigs[sig] = CFUNCTYPE(*sig)
-    if export:
-        glbl_name = name
-        __all__.append(name)
-    else:
-        glbl_name = "_" + name
     func = _sigs[sig]((name, lib), tuple((i[2] if len(i) > 2 else 1,
                                           i[1],
                                           i[3] if len(i) > 3 else None)
@@ -466,13 +637,17 @@ def _make_function(name, lib, args, export=True, errcheck="default"):
             errcheck = None
     if errcheck:
         func.errcheck = errcheck
-    globals()[glbl_name] = func
+    return func
 
 _subst = {c_long_parm: c_long}
+_package_prefix = __name__.rpartition(".")[0] + "."
 _sigs = {}
-__all__ = ["BIO_NOCLOSE", "BIO_CLOSE",
+_ssl_options_t = c_uint64 if OPENSSL_3_API else c_ulong
+__all__ = ["OPENSSL_1_1_API", "OPENSSL_3_API",
+           "BIO_NOCLOSE", "BIO_CLOSE",
            "SSLEAY_VERSION",
-           "SSL_OP_NO_COMPRESSION",
+           "SSL_OP_NO_QUERY_MTU", "SSL_OP_NO_COMPRESSION",
+           "SSL_OP_CIPHER_SERVER_PREFERENCE",
            "SSL_VERIFY_NONE", "SSL_VERIFY_PEER",
            "SSL_VERIFY_FAIL_IF_NO_PEER_CERT", "SSL_VERIFY_CLIENT_ONCE",
            "SSL_SESS_CACHE_OFF", "SSL_SESS_CACHE_CLIENT",
@@ -482,35 +657,60 @@ __all__ = ["BIO_NOCLOSE", "BIO_CLOSE",
            "SSL_FILE_TYPE_PEM",
            "GEN_DIRNAME", "NID_subject_alt_name",
            "CRYPTO_LOCK",
+           "SSL_library_init", "SSL_load_error_strings",
            "CRYPTO_set_locking_callback",
            "DTLSv1_get_timeout", "DTLSv1_handle_timeout",
            "DTLSv1_listen",
-           "BIO_gets", "BIO_read", "BIO_get_mem_data",
+           "BIO_gets", "BIO_read", "BIO_write", "BIO_get_mem_data",
+           "BIO_ctrl_pending",
            "BIO_dgram_set_connected",
            "BIO_dgram_get_peer", "BIO_dgram_set_peer",
+           "BIO_dgram_get_mtu", "BIO_dgram_set_mtu",
+           "BIO_dgram_query_mtu", "BIO_dgram_get_fallback_mtu",
            "BIO_set_nbio",
            "SSL_CTX_set_session_cache_mode", "SSL_CTX_set_read_ahead",
-           "SSL_CTX_set_options",
+           "SSL_CTX_set_options", "SSL_set_options",
+           "SSL_CTX_set1_curves_list", "SSL_CTX_set_ecdh_auto",
+           "SSL_CTX_set_tmp_ecdh_p256", "SSL_CTX_set_tmp_dh",
+           "SSL_CTX_set_dh_auto",
+           "SSL_set_mtu",
            "SSL_read", "SSL_write",
+           "SSL_session_reused",
+           "SSL_get_cipher_descriptions", "SSL_CIPHER_get_description",
+           "SSLFastPath",
            "SSL_CTX_set_cookie_cb",
+           "SSL_CTX_set_psk_client_cb", "SSL_CTX_set_psk_server_cb",
+           "SSL_CTX_set_tlsext_use_srtp", "SSL_get_selected_srtp_profile",
+           "SSL_export_keying_material",
            "OBJ_obj2txt", "decode_ASN1_STRING", "ASN1_TIME_print",
-           "X509_get_notAfter",
+           "X509_get_notAfter", "X509_NAME_ENTRY_set",
            "ASN1_item_d2i", "GENERAL_NAME_print",
            "sk_value",
            "sk_pop_free",
            "i2d_X509"]  # note: the following map adds to this list
 
 map(lambda x: _make_function(*x), (
-    ("SSL_library_init", libssl, ((c_int, "ret"),)),
-    ("SSL_load_error_strings", libssl, ((None, "ret"),)),
-    ("SSLeay", libcrypto, ((c_long_parm, "ret"),)),
-    ("SSLeay_version", libcrypto, ((c_char_p, "ret"), (c_int, "t"))),
+    ("SSL_library_init", libssl, ((c_int, "ret"),), False),
+    ("SSL_load_error_strings", libssl, ((None, "ret"),), False),
+    ("OPENSSL_init_ssl", libssl,
+     ((c_int, "ret"), (c_uint64, "opts"), (c_void_p, "settings")), False),
+    (("SSLeay", "OpenSSL_version_num"), libcrypto, ((c_long_parm, "ret"),)),
+    (("SSLeay_version", "OpenSSL_version"), libcrypto,
+     ((c_char_p, "ret"), (c_int, "t"))),
     ("CRYPTO_set_locking_callback", libcrypto,
      ((None, "ret"), (c_void_p, "func")), False),
     ("CRYPTO_get_id_callback", libcrypto, ((c_void_p, "ret"),), True, None),
     ("CRYPTO_num_locks", libcrypto, ((c_int, "ret"),)),
-    ("DTLSv1_server_method", libssl, ((DTLSv1Method, "ret"),)),
-    ("DTLSv1_client_method", libssl, ((DTLSv1Method, "ret"),)),
+    (("DTLSv1_server_method", "DTLS_server_method"), libssl,
+     ((DTLSv1Method, "ret"),)),
+    (("DTLSv1_client_method", "DTLS_client_method"), libssl,
+     ((DTLSv1Method, "ret"),)),
+    ("DTLSv1_2_server_method", libssl, ((DTLSv1Method, "ret"),)),
+    ("DTLSv1_2_client_method", libssl, ((DTLSv1Method, "ret"),)),
+    (("DTLS_server_method", "DTLSv1_server_method"), libssl,
+     ((DTLSv1Method, "ret"),)),
+    (("DTLS_client_method", "DTLSv1_client_method"), libssl,
+     ((DTLSv1Method, "ret"),)),
     ("SSL_CTX_new", libssl, ((SSLCTX, "ret"), (DTLSv1Method, "meth"))),
     ("SSL_CTX_free", libssl, ((None, "ret"), (SSLCTX, "ctx"))),
     ("SSL_CTX_set_cookie_generate_cb", libssl,
@@ -522,6 +722,7 @@ map(lambda x: _make_function(*x), (
     ("SSL_free", libssl, ((None, "ret"), (SSL, "ssl"))),
     ("SSL_set_bio", libssl,
      ((None, "ret"), (SSL, "ssl"), (BIO, "rbio"), (BIO, "wbio"))),
+    ("SSL_get_wbio", libssl, ((BIO, "ret"), (SSL, "ssl"))),
     ("BIO_new", libcrypto, ((BIO, "ret"), (BIO_METHOD, "type"))),
     ("BIO_s_mem", libcrypto, ((BIO_METHOD, "ret"),)),
     ("BIO_new_file", libcrypto,
@@ -534,9 +735,17 @@ map(lambda x: _make_function(*x), (
      False),
     ("BIO_read", libcrypto,
      ((c_int, "ret"), (BIO, "b"), (c_void_p, "buf"), (c_int, "len")), False),
+    ("BIO_write", libcrypto,
+     ((c_int, "ret"), (BIO, "b"), (c_char_p, "buf"), (c_int, "len")), False),
     ("SSL_CTX_ctrl", libssl,
      ((c_long_parm, "ret"), (SSLCTX, "ctx"), (c_int, "cmd"), (c_long, "larg"),
       (c_void_p, "parg")), False),
+    ("SSL_CTX_set_options", libssl,
+     ((_ssl_options_t, "ret"), (SSLCTX, "ctx"), (_ssl_options_t, "op")),
+     False, None),
+    ("SSL_set_options", libssl,
+     ((_ssl_options_t, "ret"), (SSL, "ssl"), (_ssl_options_t, "op")),
+     False, None),
     ("BIO_ctrl", libcrypto,
      ((c_long_parm, "ret"), (BIO, "bp"), (c_int, "cmd"), (c_long, "larg"),
       (c_void_p, "parg")), False),
@@ -557,6 +766,12 @@ map(lambda x: _make_function(*x), (
      ((c_int, "ret"), (SSLCTX, "ctx"), (c_char_p, "file"))),
     ("SSL_CTX_use_PrivateKey_file", libssl,
      ((c_int, "ret"), (SSLCTX, "ctx"), (c_char_p, "file"), (c_int, "type"))),
+    ("SSL_CTX_set_psk_client_callback", libssl,
+     ((None, "ret"), (SSLCTX, "ctx"), (c_void_p, "psk_client_cb")), False),
+    ("SSL_CTX_set_psk_server_callback", libssl,
+     ((None, "ret"), (SSLCTX, "ctx"), (c_void_p, "psk_server_cb")), False),
+    ("SSL_get_psk_identity", libssl, ((c_char_p, "ret"), (SSL, "ssl")),
+     True, None),
     ("SSL_CTX_load_verify_locations", libssl,
      ((c_int, "ret"), (SSLCTX, "ctx"), (c_char_p, "CAfile"),
       (c_char_p, "CApath"))),
@@ -568,7 +783,8 @@ map(lambda x: _make_function(*x), (
     ("SSL_set_connect_state", libssl, ((None, "ret"), (SSL, "ssl"))),
     ("SSL_set_accept_state", libssl, ((None, "ret"), (SSL, "ssl"))),
     ("SSL_do_handshake", libssl, ((c_int, "ret"), (SSL, "ssl"))),
-    ("SSL_get_peer_certificate", libssl, ((X509, "ret"), (SSL, "ssl"))),
+    (("SSL_get_peer_certificate", "SSL_get1_peer_certificate"), libssl,
+     ((X509, "ret"), (SSL, "ssl"))),
     ("SSL_read", libssl,
      ((c_int, "ret"), (SSL, "ssl"), (c_void_p, "buf"), (c_int, "num")), False),
     ("SSL_write", libssl,
@@ -577,14 +793,30 @@ map(lambda x: _make_function(*x), (
     ("SSL_shutdown", libssl, ((c_int, "ret"), (SSL, "ssl"))),
     ("SSL_set_read_ahead", libssl,
      ((None, "ret"), (SSL, "ssl"), (c_int, "yes"))),
+    ("SSL_get1_session", libssl, ((SSL_SESSION, "ret"), (SSL, "ssl"))),
+    ("SSL_set_session", libssl,
+     ((c_int, "ret"), (SSL, "ssl"), (SSL_SESSION, "session"))),
+    ("SSL_SESSION_free", libssl, ((None, "ret"), (SSL_SESSION, "session"))),
+    ("SSL_session_reused", libssl, ((c_int, "ret"), (SSL, "ssl")), False, None),
+    ("DTLSv1_listen", libssl,
+     ((c_int, "ret"), (SSL, "ssl"), (c_void_p, "client")), False, None),
     ("X509_free", libcrypto, ((None, "ret"), (X509, "a"))),
     ("PEM_read_bio_X509_AUX", libcrypto,
      ((X509, "ret"), (BIO, "bp"), (c_void_p, "x", 1, None),
       (c_void_p, "cb", 1, None), (c_void_p, "u", 1, None))),
+    ("PEM_read_bio_DHparams", libcrypto,
+     ((DH, "ret"), (BIO, "bp"), (c_void_p, "x", 1, None),
+      (c_void_p, "cb", 1, None), (c_void_p, "u", 1, None))),
+    ("EC_KEY_new_by_curve_name", libcrypto, ((EC_KEY, "ret"), (c_int, "nid")),
+     False),
+    ("EC_KEY_free", libcrypto, ((None, "ret"), (EC_KEY, "key")), False),
     ("OBJ_obj2txt", libcrypto,
      ((c_int, "ret"), (POINTER(c_char), "buf"), (c_int, "buf_len"),
       (ASN1_OBJECT, "a"), (c_int, "no_name")), False),
-    ("CRYPTO_free", libcrypto, ((None, "ret"), (c_void_p, "ptr"))),
+    ("CRYPTO_free", libcrypto,
+     ((None, "ret"), (c_void_p, "ptr")) +
+     (((c_char_p, "file", 1, None), (c_int, "line", 1, 0))
+      if OPENSSL_1_1_API else ())),
     ("ASN1_STRING_to_UTF8", libcrypto,
      ((c_int, "ret"), (POINTER(POINTER(c_ubyte)), "out"), (ASN1_STRING, "in")),
      False),
@@ -597,8 +829,12 @@ map(lambda x: _make_function(*x), (
      ((ASN1_OBJECT, "ret"), (POINTER(X509_NAME_ENTRY), "ne"))),
     ("X509_NAME_ENTRY_get_data", libcrypto,
      ((ASN1_STRING, "ret"), (POINTER(X509_NAME_ENTRY), "ne"))),
+    ("X509_NAME_ENTRY_set", libcrypto,
+     ((c_int, "ret"), (POINTER(X509_NAME_ENTRY), "ne")), False, None),
     ("X509_get_subject_name", libcrypto,
      ((POINTER(X509_name_st), "ret"), (X509, "a")), True, errcheck_p),
+    ("X509_get0_notAfter", libcrypto, ((ASN1_TIME, "ret"), (X509, "x")),
+     False),
     ("ASN1_TIME_print", libcrypto,
      ((c_int, "ret"), (BIO, "fp"), (ASN1_TIME, "a")), False),
     ("X509_get_ext_by_NID", libcrypto,
@@ -607,18 +843,22 @@ map(lambda x: _make_function(*x), (
     ("X509_get_ext", libcrypto,
      ((POINTER(X509_EXTENSION), "ret"), (X509, "x"), (c_int, "loc")),
      True, errcheck_p),
+    ("X509_EXTENSION_get_data", libcrypto,
+     ((POINTER(ASN1_OCTET_STRING), "ret"), (POINTER(X509_EXTENSION), "ne")),
+     True, errcheck_p),
     ("X509V3_EXT_get", libcrypto,
      ((POINTER(X509V3_EXT_METHOD), "ret"), (POINTER(X509_EXTENSION), "ext")),
      True, errcheck_p),
     ("ASN1_item_d2i", libcrypto,
      ((c_void_p, "ret"), (c_void_p, "val"), (POINTER(POINTER(c_ubyte)), "in"),
       (c_long, "len"), (c_void_p, "it")), False, None),
-    ("sk_num", libcrypto, ((c_int, "ret"), (STACK, "stack")), True, None),
-    ("sk_value", libcrypto,
+    (("sk_num", "OPENSSL_sk_num"), libcrypto,
+     ((c_int, "ret"), (STACK, "stack")), True, None),
+    (("sk_value", "OPENSSL_sk_value"), libcrypto,
      ((c_void_p, "ret"), (STACK, "stack"), (c_int, "loc")), False),
     ("GENERAL_NAME_print", libcrypto,
      ((c_int, "ret"), (BIO, "out"), (POINTER(GENERAL_NAME), "gen")), False),
-    ("sk_pop_free", libcrypto,
+    (("sk_pop_free", "OPENSSL_sk_pop_free"), libcrypto,
      ((None, "ret"), (STACK, "st"), (c_void_p, "func")), False),
     ("i2d_X509_bio", libcrypto, ((c_int, "ret"), (BIO, "bp"), (X509, "x")),
      False),
@@ -630,11 +870,45 @@ map(lambda x: _make_function(*x), (
     ("SSL_CIPHER_get_bits", libssl,
      ((c_int, "ret"), (SSL_CIPHER, "cipher"),
       (POINTER(c_int), "alg_bits", 1, None)), True, None),
+    ("SSL_get_ciphers", libssl, ((STACK, "ret"), (SSL, "ssl")), False),
+    ("DTLS_get_data_mtu", libssl, ((c_size_t, "ret"), (SSL, "ssl")),
+     True, None),
+    ("SSL_CIPHER_description", libssl,
+     ((c_char_p, "ret"), (c_void_p, "cipher"), (c_char_p, "buf"),
+      (c_int, "size")), False),
+    ("SSL_set0_wbio", libssl, ((None, "ret"), (SSL, "ssl"), (BIO, "wbio")),
+     True, None),
+    ("SSL_set0_rbio", libssl, ((None, "ret"), (SSL, "ssl"), (BIO, "rbio")),
+     True, None),
+    ("SSL_is_init_finished", libssl, ((c_int, "ret"), (SSL, "ssl")),
+     True, None),
+    ("BIO_up_ref", libcrypto, ((c_int, "ret"), (BIO, "bio"))),
+    ("SSL_CTX_set_tlsext_use_srtp", libssl,
+     ((c_int, "ret"), (SSLCTX, "ctx"), (c_char_p, "profiles")), False, None),
+    ("SSL_get_selected_srtp_profile", libssl,
+     ((POINTER(SRTP_PROTECTION_PROFILE), "ret"), (SSL, "ssl")), False, None),
+    ("SSL_export_keying_material", libssl,
+     ((c_int, "ret"), (SSL, "ssl"), (c_void_p, "out"), (c_size_t, "olen"),
+      (c_char_p, "label"), (c_size_t, "llen"), (c_char_p, "context"),
+      (c_size_t, "contextlen"), (c_int, "use_context")), False),
     ))
 
 #
 # Wrappers - functions generally equivalent to OpenSSL library macros
 #
+def SSL_library_init():
+    if OPENSSL_1_1_API:
+        _OPENSSL_init_ssl(0, None)
+    else:
+        _SSL_library_init()
+
+def SSL_load_error_strings():
+    if OPENSSL_1_1_API:
+        _OPENSSL_init_ssl(OPENSSL_INIT_LOAD_SSL_STRINGS |
+                          OPENSSL_INIT_LOAD_CRYPTO_STRINGS, None)
+    else:
+        _SSL_load_error_strings()
+
 _rvoid_int_int_charp_int = CFUNCTYPE(None, c_int, c_int, c_char_p, c_int)
 
 def CRYPTO_set_locking_callback(locking_function):
@@ -658,7 +932,96 @@ def SSL_CTX_set_read_ahead(ctx, m):
 
 def SSL_CTX_set_options(ctx, options):
     # Returns the new option bitmaks after adding the given options
-    _SSL_CTX_ctrl(ctx, SSL_CTRL_OPTIONS, options, None)
+    if OPENSSL_1_1_API:
+        _SSL_CTX_set_options(ctx, options)
+    else:
+        _SSL_CTX_ctrl(ctx, SSL_CTRL_OPTIONS, options, None)
+
+def SSL_set_options(ssl, options):
+    if OPENSSL_1_1_API:
+        _SSL_set_options(ssl, options)
+    else:
+        _SSL_ctrl(ssl, SSL_CTRL_OPTIONS, options, None)
+
+def _SSL_CTX_ctrl_checked(ctx, cmd, larg, parg):
+    ret = _SSL_CTX_ctrl(ctx, cmd, larg, parg)
+    if ret <= 0:
+        raise_ssl_error(ret, _SSL_CTX_ctrl, (ctx, cmd, larg, parg), None)
+    return ret
+
+def SSL_CTX_set1_curves_list(ctx, curves):
+    # Available as of OpenSSL 1.0.2; also sets the groups list as of 1.1.1
+    _SSL_CTX_ctrl_checked(ctx, SSL_CTRL_SET_CURVES_LIST, 0, curves)
+
+def SSL_CTX_set_ecdh_auto(ctx, onoff):
+    # OpenSSL 1.0.2 only; later versions always select curves automatically
+    if not OPENSSL_1_1_API:
+        _SSL_CTX_ctrl_checked(ctx, SSL_CTRL_SET_ECDH_AUTO, onoff, None)
+
+def SSL_CTX_set_tmp_ecdh_p256(ctx):
+    # For versions prior to OpenSSL 1.0.2, which can use a single fixed curve
+    # only; the library copies the key
+    ec_key = _EC_KEY_new_by_curve_name(NID_X9_62_prime256v1)
+    try:
+        _SSL_CTX_ctrl_checked(ctx, SSL_CTRL_SET_TMP_ECDH, 0, ec_key.raw)
+    finally:
+        _EC_KEY_free(ec_key)
+
+def SSL_CTX_set_tmp_dh(ctx, dh):
+    # The library copies or references the parameters
+    _SSL_CTX_ctrl_checked(ctx, SSL_CTRL_SET_TMP_DH, 0, dh.raw)
+
+def SSL_CTX_set_dh_auto(ctx, onoff):
+    # Built-in parameters matching the certificate's strength, available as
+    # of OpenSSL 1.1.0
+    _SSL_CTX_ctrl_checked(ctx, SSL_CTRL_SET_DH_AUTO, onoff, None)
+
+def SSL_set_mtu(ssl, mtu):
+    # Takes effect for BIOs that cannot be queried, or with
+    # SSL_OP_NO_QUERY_MTU
+    ret = _SSL_ctrl(ssl, SSL_CTRL_SET_MTU, mtu, None)
+    if ret <= 0:
+        raise_ssl_error(ret, _SSL_ctrl, (ssl, SSL_CTRL_SET_MTU, mtu, None),
+                        None)
+
+def SSL_CIPHER_get_description(cipher):
+    buf = create_string_buffer(256)
+    _SSL_CIPHER_description(cipher.raw, buf, sizeof(buf))
+    return buf.value.strip()
+
+def SSL_CTX_set_tlsext_use_srtp(ctx, profiles):
+    # Unlike most library functions, this one returns zero upon success
+    ret = _SSL_CTX_set_tlsext_use_srtp(ctx, profiles)
+    if ret:
+        raise_ssl_error(ret, _SSL_CTX_set_tlsext_use_srtp, (ctx, profiles),
+                        None)
+
+def SSL_get_selected_srtp_profile(ssl):
+    # The negotiated profile's name, or None
+    profile = _SSL_get_selected_srtp_profile(ssl)
+    if profile:
+        return profile.contents.name
+
+def SSL_export_keying_material(ssl, label, length, context):
+    # A context of None is distinct from an empty one (RFC 5705)
+    buf = create_string_buffer(length)
+    if context is None:
+        _SSL_export_keying_material(ssl, buf, length, label, len(label),
+                                    None, 0, 0)
+    else:
+        _SSL_export_keying_material(ssl, buf, length, label, len(label),
+                                    context, len(context), 1)
+    return buf.raw
+
+def SSL_get_cipher_descriptions(ssl):
+    # One line per enabled cipher suite, in order of preference
+    descriptions = []
+    stack = _SSL_get_ciphers(ssl)
+    buf = create_string_buffer(256)
+    for i in xrange(sk_num(stack)):
+        _SSL_CIPHER_description(_sk_value(stack, i), buf, sizeof(buf))
+        descriptions.append(buf.value.strip())
+    return descriptions
 
 _rint_voidp_ubytep_uintp = CFUNCTYPE(c_int, c_void_p, POINTER(c_ubyte),
                                      POINTER(c_uint))
@@ -691,6 +1054,51 @@ def SSL_CTX_set_cookie_cb(ctx, generate, verify):
     _SSL_CTX_set_cookie_verify_cb(ctx, ver_cb)
     return gen_cb, ver_cb
 
+_ruint_voidp_charp_voidp_uint_ubytep_uint = CFUNCTYPE(
+    c_uint, c_void_p, c_char_p, c_void_p, c_uint, POINTER(c_ubyte), c_uint)
+_ruint_voidp_charp_ubytep_uint = CFUNCTYPE(c_uint, c_void_p, c_char_p,
+                                           POINTER(c_ubyte), c_uint)
+
+def SSL_CTX_set_psk_client_cb(ctx, client):
+    def py_psk_client_cb(ssl, hint, identity, max_identity_len,
+                         psk, max_psk_len):
+        try:
+            ret_identity, ret_psk = client(SSL(ssl), hint)
+        except:
+            _logger.exception("PSK selection failed")
+            return 0
+        if len(ret_identity) >= max_identity_len or \
+          len(ret_psk) > max_psk_len:
+            _logger.error("PSK identity or key exceeds library limit")
+            return 0
+        memmove(identity, ret_identity + "\0", len(ret_identity) + 1)
+        memmove(psk, ret_psk, len(ret_psk))
+        return len(ret_psk)
+
+    client_cb = _ruint_voidp_charp_voidp_uint_ubytep_uint(py_psk_client_cb)
+    _SSL_CTX_set_psk_client_callback(ctx, client_cb)
+    return client_cb
+
+def SSL_CTX_set_psk_server_cb(ctx, server):
+    def py_psk_server_cb(ssl, identity, psk, max_psk_len):
+        try:
+            ret_psk = server(SSL(ssl), identity)
+        except:
+            _logger.exception("PSK lookup failed")
+            return 0
+        if not ret_psk:
+            _logger.debug("Unknown PSK identity: %s", identity)
+            return 0
+        if len(ret_psk) > max_psk_len:
+            _logger.error("PSK exceeds library limit")
+            return 0
+        memmove(psk, ret_psk, len(ret_psk))
+        return len(ret_psk)
+
+    server_cb = _ruint_voidp_charp_ubytep_uint(py_psk_server_cb)
+    _SSL_CTX_set_psk_server_callback(ctx, server_cb)
+    return server_cb
+
 def BIO_dgram_set_connected(bio, peer_address):
     su = sockaddr_u_from_addr_tuple(peer_address)
     _BIO_ctrl(bio, BIO_CTRL_DGRAM_SET_CONNECTED, 0, byref(su))
@@ -704,6 +1112,19 @@ def BIO_dgram_set_peer(bio, peer_address):
     su = sockaddr_u_from_addr_tuple(peer_address)
     _BIO_ctrl(bio, BIO_CTRL_DGRAM_SET_PEER, 0, byref(su))
 
+def BIO_dgram_get_mtu(bio):
+    return _BIO_ctrl(bio, BIO_CTRL_DGRAM_GET_MTU, 0, None)
+
+def BIO_dgram_set_mtu(bio, mtu):
+    _BIO_ctrl(bio, BIO_CTRL_DGRAM_SET_MTU, mtu, None)
+
+def BIO_dgram_query_mtu(bio):
+    # Zero if the socket is not connected
+    return _BIO_ctrl(bio, BIO_CTRL_DGRAM_QUERY_MTU, 0, None)
+
+def BIO_dgram_get_fallback_mtu(bio):
+    return _BIO_ctrl(bio, BIO_CTRL_DGRAM_GET_FALLBACK_MTU, 0, None)
+
 def BIO_set_nbio(bio, n):
     _BIO_ctrl(bio, BIO_C_SET_NBIO, 1 if n else 0, None)
 
@@ -731,10 +1152,25 @@ def DTLSv1_handle_timeout(ssl):
 
 def DTLSv1_listen(ssl):
     su = sockaddr_u()
-    ret = _SSL_ctrl(ssl, DTLS_CTRL_LISTEN, 0, byref(su))
-    errcheck_ord(ret, _SSL_ctrl, (ssl, DTLS_CTRL_LISTEN, 0, byref(su)))
+    if not OPENSSL_1_1_API:
+        ret = _SSL_ctrl(ssl, DTLS_CTRL_LISTEN, 0, byref(su))
+        errcheck_ord(ret, _SSL_ctrl, (ssl, DTLS_CTRL_LISTEN, 0, byref(su)))
+        return addr_tuple_from_sockaddr_u(su)
+    # The socket address union serves as the BIO_ADDR, which it encloses
+    ret = _DTLSv1_listen(ssl, byref(su))
+    if ret == 0:
+        # No ClientHello with a valid cookie has arrived yet; report this in
+        # the manner of earlier library versions, so that listen is resumed
+        raise_ssl_error(ret, _DTLSv1_listen, (ssl, byref(su)), None,
+                        SSL_ERROR_WANT_READ)
+    errcheck_ord(ret, _DTLSv1_listen, (ssl, byref(su)))
     return addr_tuple_from_sockaddr_u(su)
 
+def SSL_session_reused(ssl):
+    if OPENSSL_1_1_API:
+        return _SSL_session_reused(ssl) == 1
+    return _SSL_ctrl(ssl, SSL_CTRL_GET_SESSION_REUSED, 0, None) == 1
+
 def SSL_read(ssl, length):
     buf = create_string_buffer(length)
     res_len = _SSL_read(ssl, buf, sizeof(buf))
@@ -764,11 +1200,18 @@ def decode_ASN1_STRING(asn1_string):
         CRYPTO_free(utf8_buf_ptr)
 
 def X509_get_notAfter(x509):
+    if OPENSSL_1_1_API:
+        return _X509_get0_notAfter(x509)
     x509_raw = X509.from_param(x509)
     x509_ptr = cast(x509_raw, POINTER(X509_st))
     notAfter = x509_ptr.contents.cert_info.contents.validity.contents.notAfter
     return ASN1_TIME(notAfter)
 
+def X509_NAME_ENTRY_set(name_entry_ptr):
+    if OPENSSL_1_1_API:
+        return _X509_NAME_ENTRY_set(name_entry_ptr)
+    return name_entry_ptr.contents.set
+
 def BIO_gets(bio):
     buf = create_string_buffer(GETS_MAXLEN)
     res_len = _BIO_gets(bio, buf, sizeof(buf) - 1)
@@ -779,6 +1222,12 @@ def BIO_read(bio, length):
     res_len = _BIO_read(bio, buf, sizeof(buf))
     return buf.raw[:res_len]
 
+def BIO_write(bio, data):
+    return _BIO_write(bio, data, len(data))
+
+def BIO_ctrl_pending(bio):
+    return _BIO_ctrl(bio, BIO_CTRL_PENDING, 0, None)
+
 def BIO_get_mem_data(bio):
     buf = POINTER(c_ubyte)()
     res_len = _BIO_ctrl(bio, BIO_CTRL_INFO, 0, byref(buf))
@@ -792,7 +1241,9 @@ def ASN1_TIME_print(asn1_time):
 _rvoidp = CFUNCTYPE(c_void_p)
 
 def _ASN1_ITEM_ptr(item):
-    if sys.platform.startswith('win'):
+    # Item references are functions returning the item on Windows, and on all
+    # platforms as of OpenSSL 3.0
+    if sys.platform.startswith('win') or OPENSSL_3_API:
         func_ptr = _rvoidp(item)
         return func_ptr()
     return item
@@ -818,12 +1269,208 @@ def GENERAL_NAME_print(general_name):
     _GENERAL_NAME_print(bio.value, general_name)
     return BIO_gets(bio.value)
 
-_free_func = addressof(c_void_p.in_dll(libcrypto, "sk_free"))
-
 def sk_pop_free(stack):
-    _sk_pop_free(stack, _free_func)
+    sk_free = _find_symbol(libcrypto, ("sk_free", "OPENSSL_sk_free"))
+    _sk_pop_free(stack, addressof(c_void_p.in_dll(libcrypto, sk_free)))
 
 def i2d_X509(x509):
     bio = _BIO(BIO_new(BIO_s_mem()))
     _i2d_X509_bio(bio.value, x509)
     return BIO_get_mem_data(bio.value)
+
+#
+# Hot-path calls - per-datagram functions bound with raw pointer arguments and
+#                  without Python-level error checking upon success
+#
+def _make_fast_function(name, lib, *sig):
+    func = CFUNCTYPE(*sig)((name, lib))
+    func.func_name = name
+    globals()["_fast_" + name] = func
+
+_fast_functions = (
+    ("SSL_read", libssl, c_int, c_void_p, c_void_p, c_int),
+    ("SSL_write", libssl, c_int, c_void_p, c_char_p, c_int),
+    ("SSL_do_handshake", libssl, c_int, c_void_p),
+    ("SSL_pending", libssl, c_int, c_void_p),
+    ("SSL_get_error", libssl, c_int, c_void_p, c_int),
+    ("SSL_ctrl", libssl, c_long, c_void_p, c_int, c_long, c_void_p),
+    ("BIO_write", libcrypto, c_int, c_void_p, c_char_p, c_int),
+    ("BIO_ctrl_pending", libcrypto, c_size_t, c_void_p),
+    )
+_fast_functions_bound = False
+
+def _bind_fast_functions():
+    global _fast_functions_bound
+    map(lambda x: _make_fast_function(*x), _fast_functions)
+    _fast_functions_bound = True
+
+READ_BUFFER_SIZE = 1024
+
+
+class _CtypesFastPath(object):
+    """Per-connection hot-path calls, ctypes implementation
+
+    An instance of this class performs the library calls that occur for every
+    datagram on behalf of a single SSL object. The SSL pointer is unwrapped
+    once at construction, and the read buffer and timer structure are
+    allocated once and reused for every call. Errors are reported the same
+    way as by the general bindings.
+
+    The read_into method decrypts into a caller-supplied bytearray, and the
+    write methods encrypt from bytearrays in place; neither creates an
+    intermediate string.
+
+    The try_ methods do not raise exceptions for continuation requests:
+    instead of SSL_ERROR_WANT_READ and SSL_ERROR_WANT_WRITE, they return the
+    status sentinels WANT_READ and WANT_WRITE, without retrieving the error
+    queue. Other errors are raised as usual.
+
+    Once set_feed has been called, the read methods pass datagrams that were
+    received elsewhere to a memory BIO that serves as the read BIO, one at a
+    time: before reading, they move the next queued datagram into the BIO,
+    provided the library has consumed the previous one. The feed method does
+    the same ahead of other library calls that read.
+    """
+
+    def __init__(self, ssl):
+        if not _fast_functions_bound:
+            _bind_fast_functions()
+        self._ssl = ssl
+        self._raw = ssl.raw
+        self._buf = create_string_buffer(READ_BUFFER_SIZE)
+        self._buf_len = READ_BUFFER_SIZE
+        self._tv = TIMEVAL()
+        self._tv_ref = byref(self._tv)
+        self._feed_bio = self._feed_queue = None
+
+    def set_feed(self, bio, datagrams):
+        self._feed_bio = bio
+        self._feed_queue = datagrams
+
+    def feed(self):
+        if self._feed_queue and not _fast_BIO_ctrl_pending(self._feed_bio):
+            datagram = self._feed_queue.popleft()
+            _fast_BIO_write(self._feed_bio, datagram, len(datagram))
+
+    def read(self, length):
+        if self._feed_queue:
+            self.feed()
+        if length > self._buf_len:
+            self._buf = create_string_buffer(length)
+            self._buf_len = length
+        ret = _fast_SSL_read(self._raw, self._buf, length)
+        if ret > 0:
+            return string_at(self._buf, ret)
+        raise_ssl_error(ret, _fast_SSL_read, (self._ssl, self._buf, length),
+                        self._ssl)
+
+    def read_into(self, buffer, length):
+        if self._feed_queue:
+            self.feed()
+        ret = _fast_SSL_read(self._raw,
+                             (c_char * length).from_buffer(buffer), length)
+        if ret > 0:
+            return ret
+        raise_ssl_error(ret, _fast_SSL_read, (self._ssl, buffer, length),
+                        self._ssl)
+
+    def write(self, data):
+        if isinstance(data, bytearray):
+            data = (c_char * len(data)).from_buffer(data)
+        elif not isinstance(data, str):
+            if hasattr(data, "tobytes") and callable(data.tobytes):
+                data = data.tobytes()
+            else:
+                data = str(data)
+        ret = _fast_SSL_write(self._raw, data, len(data))
+        if ret > 0:
+            return ret
+        raise_ssl_error(ret, _fast_SSL_write, (self._ssl, data, len(data)),
+                        self._ssl)
+
+    def try_read(self, length):
+        if self._feed_queue:
+            self.feed()
+        if length > self._buf_len:
+            self._buf = create_string_buffer(length)
+            self._buf_len = length
+        ret = _fast_SSL_read(self._raw, self._buf, length)
+        if ret > 0:
+            return string_at(self._buf, ret)
+        status = want_status.get(_fast_SSL_get_error(self._raw, ret))
+        if status:
+            return status
+        raise_ssl_error(ret, _fast_SSL_read, (self._ssl, self._buf, length),
+                        self._ssl)
+
+    def try_write(self, data):
+        if isinstance(data, bytearray):
+            data = (c_char * len(data)).from_buffer(data)
+        elif not isinstance(data, str):
+            if hasattr(data, "tobytes") and callable(data.tobytes):
+                data = data.tobytes()
+            else:
+                data = str(data)
+        ret = _fast_SSL_write(self._raw, data, len(data))
+        if ret > 0:
+            return ret
+        status = want_status.get(_fast_SSL_get_error(self._raw, ret))
+        if status:
+            return status
+        raise_ssl_error(ret, _fast_SSL_write, (self._ssl, data, len(data)),
+                        self._ssl)
+
+    def try_handshake(self):
+        ret = _fast_SSL_do_handshake(self._raw)
+        if ret > 0:
+            return
+        status = want_status.get(_fast_SSL_get_error(self._raw, ret))
+        if status:
+            return status
+        raise_ssl_error(ret, _fast_SSL_do_handshake, (self._ssl,), self._ssl)
+
+    def pending(self):
+        return _fast_SSL_pending(self._raw)
+
+    def get_error(self, ret):
+        return _fast_SSL_get_error(self._raw, ret)
+
+    def get_timeout(self):
+        if _fast_SSL_ctrl(self._raw, DTLS_CTRL_GET_TIMEOUT, 0,
+                          self._tv_ref) != 1:
+            return
+        return timedelta(seconds=self._tv.tv_sec,
+                         microseconds=self._tv.tv_usec)
+
+    def handle_timeout(self):
+        ret = _fast_SSL_ctrl(self._raw, DTLS_CTRL_HANDLE_TIMEOUT, 0, None)
+        if ret >= 0:
+            # Zero: no timer had yet expired; one: buffered messages were
+            # retransmitted
+            return ret == 1
+        # Too many timeouts have occurred or a retransmission failed
+        raise_ssl_error(ret, _fast_SSL_ctrl,
+                        (self._ssl, DTLS_CTRL_HANDLE_TIMEOUT, 0, None), None)
+
+
+#
+# Backend selection - the hot-path calls are made through cffi where it is
+#                     available, unless the PYDTLS_BACKEND environment variable
+#                     requests ctypes; ctypes is used otherwise
+#
+def _load_cffi_backend():
+    # Raises ImportError if cffi is not installed
+    import cffi_backend
+    cffi_backend.load(libssl, libcrypto, raise_ssl_error,
+                      DTLS_CTRL_GET_TIMEOUT, DTLS_CTRL_HANDLE_TIMEOUT)
+    return cffi_backend.CffiFastPath
+
+SSLFastPath = _CtypesFastPath
+BACKEND = "ctypes"
+if environ.get("PYDTLS_BACKEND", "cffi") == "cffi":
+    try:
+        SSLFastPath = _load_cffi_backend()
+    except ImportError:
+        _logger.debug("cffi is not available; using ctypes backend")
+    else:
+        BACKEND = "cffi"
@@ -0,0 +1,337 @@
+# Paced sender: rate-controlled datagram transfer over DTLS records.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Paced Sender
+
+A sender that writes datagrams as fast as its socket accepts them overruns
+slower receivers: datagrams that arrive while the receiver's socket buffer is
+full are dropped. This module spaces the datagrams written to an established
+SSLConnection at a sending rate that adapts to the feedback of the receiver.
+
+Datagrams pass a token bucket that fills at the sending rate and holds a
+burst of a few datagrams. The receiver reports, at a fixed interval while
+datagrams arrive, the highest sequence number and the counts of datagrams
+and bytes it received; the sender derives the loss fraction, the achieved
+rate, and the round-trip time from consecutive reports. The rate doubles per
+round trip until the first loss, and subsequently grows by one datagram per
+round trip per round trip; it is halved at most once per round trip when a
+report reveals loss, and when reports cease to arrive while datagrams are
+being sent. The rate never exceeds twice the achieved rate, so that senders
+that have been idle do not burst.
+
+Records of the two kinds start with the following headers, with integers in
+network byte order:
+
+  data: type (0), flags, sequence number, timestamp in microseconds
+  feedback: type (1), flags, highest sequence number, datagrams received,
+            bytes received, echoed timestamp, microseconds between the
+            receipt of the datagram with that timestamp and the report
+
+The layer does not retransmit lost datagrams. SSLConnection's start_pacing
+method passes the connection's own reads and writes through an instance of
+this module's class.
+
+Classes:
+
+  PacedConnection -- rate-controlled datagram transfer over an SSLConnection
+"""
+
+from collections import deque
+from logging import getLogger
+from select import select
+from struct import Struct
+from timeit import default_timer
+from err import ERR_READ_TIMEOUT, WANT_READ, WANT_WRITE
+from layer import _NonBlockingLayer, _SEQ_MASK, _unwrap
+
+_logger = getLogger(__name__)
+
+INITIAL_RATE = 1 << 20  # bytes per second
+MIN_RATE = 16 << 10
+MAX_RATE = 1 << 30
+FEEDBACK_INTERVAL = 0.01  # seconds
+BURST = 4  # datagrams
+
+_DATA = 0
+_FEEDBACK = 1
+_DATA_HEADER = Struct("!BBII")
+_FEEDBACK_RECORD = Struct("!BBIIIII")
+_BETA = 0.5  # multiplicative decrease
+_GAIN = 0.125  # weight of new samples in smoothed values
+_NO_FEEDBACK_INTERVALS = 4
+_MIN_RTT = 0.0001
+
+
+class PacedConnection(_NonBlockingLayer):
+    """Rate-controlled datagram transfer over an SSLConnection
+
+    Each send writes one datagram once the pacing rate permits; received
+    feedback is processed while senders wait. Datagrams that arrive while
+    sending are queued for recv.
+
+    Methods:
+
+      send -- send a datagram
+      recv -- receive a datagram
+      try_send -- send a datagram if the sending rate admits it
+      try_recv -- receive a datagram if one has arrived
+      service -- process received records and send due feedback
+
+    Attributes:
+
+      rate -- current sending rate in bytes per second
+      achieved_rate -- smoothed rate in bytes per second at which the peer
+                       receives this side's datagrams
+      loss -- smoothed fraction of this side's datagrams that the peer
+              reported lost
+      srtt -- smoothed round-trip time in seconds, or None without samples
+      datagrams_sent -- number of datagrams sent
+      datagrams_lost -- number of datagrams the peer reported lost
+    """
+
+    _handlers = {_DATA: (_DATA_HEADER.size, "_process_data"),
+                 _FEEDBACK: (_FEEDBACK_RECORD.size, "_process_feedback")}
+
+    def __init__(self, conn, initial_rate=INITIAL_RATE, min_rate=MIN_RATE,
+                 max_rate=MAX_RATE, feedback_interval=FEEDBACK_INTERVAL,
+                 timeout=None):
+        """Constructor
+
+        Arguments:
+        conn -- SSLConnection whose handshake has completed
+        initial_rate -- sending rate in bytes per second before feedback
+        min_rate, max_rate -- bounds of the sending rate
+        feedback_interval -- time in seconds between reports to the peer
+        timeout -- time in seconds that recv waits for a datagram, or None
+                   to wait indefinitely
+        """
+
+        super(PacedConnection, self).__init__(conn, timeout)
+        self._initial_rate = self.rate = float(initial_rate)
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._feedback_interval = feedback_interval
+        # Sender state
+        self._seq = 0
+        self._tokens = 0.0
+        self._fill_time = self._epoch
+        self._slow_start = True
+        self._last_decrease = self._epoch
+        self._feedback_time = None  # last feedback, or first send
+        self._report = None  # (highest, datagrams, bytes) of the last report
+        self.achieved_rate = None
+        self.loss = 0.0
+        self.srtt = None
+        self.datagrams_sent = self.datagrams_lost = 0
+        # Receiver state
+        self._inbox = deque()
+        self._rx_highest = None
+        self._rx_datagrams = self._rx_bytes = 0
+        self._rx_ts = self._rx_time = None
+        self._feedback_due = None
+
+    def send(self, data):
+        """Send a datagram
+
+        This method blocks until the sending rate admits the datagram.
+
+        Arguments:
+        data -- string containing the datagram's payload
+
+        Return value:
+        number of bytes sent, which is the length of data
+        """
+
+        while True:
+            wait = self._admit(data)
+            if wait is None:
+                break
+            select([self._rsock], [], [], wait)
+        self._send_data(data)
+        return len(data)
+
+    def recv(self, bufsize):
+        """Receive a datagram
+
+        Arguments:
+        bufsize -- maximum number of bytes to return; the remainder of a
+                   longer datagram is discarded
+
+        Return value:
+        string containing the datagram's payload
+        """
+
+        self._run(lambda: self._inbox, ERR_READ_TIMEOUT)
+        return self._inbox.popleft()[:bufsize]
+
+    def try_send(self, data):
+        """Send a datagram if the sending rate admits it
+
+        This method does not block.
+
+        Arguments:
+        data -- string containing the datagram's payload
+
+        Return value:
+        number of bytes sent, which is the length of data, or WANT_WRITE if
+        the sending rate does not yet admit the datagram
+        """
+
+        if self._admit(data) is not None:
+            return WANT_WRITE
+        self._send_data(data)
+        return len(data)
+
+    def try_recv(self, bufsize):
+        """Receive a datagram if one has arrived
+
+        This method does not block.
+
+        Arguments:
+        bufsize -- maximum number of bytes to return; the remainder of a
+                   longer datagram is discarded
+
+        Return value:
+        string containing the datagram's payload, or WANT_READ if no
+        datagram has arrived
+        """
+
+        self.service()
+        if not self._inbox:
+            return WANT_READ
+        return self._inbox.popleft()[:bufsize]
+
+    def _handle_timers(self, now):
+        if self._feedback_due is not None and self._feedback_due <= now:
+            self._send_feedback(now)
+        self._check_feedback(now)
+        if self._feedback_due is not None:
+            return max(self._feedback_due - now, 0)
+
+    def _ts(self, now):
+        return int((now - self._epoch) * 1e6) & _SEQ_MASK
+
+    #
+    # Receiver
+    #
+    def _process_data(self, record):
+        kind, flags, seq, ts = _DATA_HEADER.unpack_from(record)
+        now = default_timer()
+        if self._rx_highest is None:
+            self._rx_highest = seq
+        else:
+            self._rx_highest = max(self._rx_highest,
+                                   _unwrap(seq, self._rx_highest))
+        self._rx_datagrams += 1
+        self._rx_bytes += len(record)
+        self._rx_ts = ts
+        self._rx_time = now
+        self._inbox.append(record[_DATA_HEADER.size:])
+        if self._feedback_due is None:
+            self._feedback_due = now + self._feedback_interval
+
+    def _send_feedback(self, now):
+        self._write(_FEEDBACK_RECORD.pack(
+            _FEEDBACK, 0, self._rx_highest & _SEQ_MASK,
+            self._rx_datagrams & _SEQ_MASK, self._rx_bytes & _SEQ_MASK,
+            self._rx_ts, int((now - self._rx_time) * 1e6) & _SEQ_MASK))
+        self._feedback_due = None
+
+    #
+    # Sender
+    #
+    def _admit(self, data):
+        # Take the datagram's size from the token bucket, or return the time
+        # in seconds until the bucket holds it
+        size = _DATA_HEADER.size + len(data)
+        self.service()
+        now = default_timer()
+        self._tokens = min(self._tokens + (now - self._fill_time) * self.rate,
+                           BURST * size)
+        self._fill_time = now
+        if self._tokens < size:
+            return (size - self._tokens) / self.rate
+        self._tokens -= size
+        if self._feedback_time is None:
+            self._feedback_time = now
+
+    def _send_data(self, data):
+        self._write(_DATA_HEADER.pack(_DATA, 0, self._seq & _SEQ_MASK,
+                                      self._ts(self._fill_time)) + data)
+        self._seq += 1
+        self.datagrams_sent += 1
+
+    def _process_feedback(self, record):
+        kind, flags, highest, datagrams, nbytes, echo, delay = \
+          _FEEDBACK_RECORD.unpack_from(record)
+        now = default_timer()
+        if self._report:
+            prev_highest, prev_datagrams, prev_bytes = self._report
+        else:
+            prev_highest, prev_datagrams, prev_bytes = -1, 0, 0
+        highest = _unwrap(highest, max(prev_highest, 0))
+        expected = highest - prev_highest
+        if expected <= 0 or highest >= self._seq:
+            return  # stale or invalid report
+        received = (datagrams - prev_datagrams) & _SEQ_MASK
+        delivered = (nbytes - prev_bytes) & _SEQ_MASK
+        self._report = highest, datagrams, nbytes
+        rtt = max(((self._ts(now) - echo) & _SEQ_MASK) / 1e6 - delay / 1e6,
+                  _MIN_RTT)
+        self.srtt = rtt if self.srtt is None else \
+          self.srtt + _GAIN * (rtt - self.srtt)
+        elapsed = max(now - self._feedback_time, _MIN_RTT)
+        self._feedback_time = now
+        achieved = delivered / elapsed
+        self.achieved_rate = achieved if self.achieved_rate is None else \
+          self.achieved_rate + _GAIN * (achieved - self.achieved_rate)
+        lost = max(expected - received, 0)
+        self.datagrams_lost += lost
+        self.loss += _GAIN * (float(lost) / expected - self.loss)
+        self._adjust(now, lost, elapsed, delivered / max(received, 1))
+
+    def _adjust(self, now, lost, elapsed, size):
+        if lost:
+            if now - self._last_decrease >= self.srtt:
+                self._decrease(now)
+        elif self._slow_start:
+            self.rate *= 2 ** min(elapsed / self.srtt, 1)
+        else:
+            self.rate += size * elapsed / self.srtt ** 2
+        # Do not exceed twice the rate that reaches the receiver
+        self.rate = max(min(self.rate, self._max_rate,
+                            max(2 * self.achieved_rate, self._initial_rate)),
+                        self._min_rate)
+
+    def _decrease(self, now):
+        self.rate = max(self.rate * _BETA, self._min_rate)
+        self._last_decrease = now
+        self._slow_start = False
+        _logger.debug("Sending rate decreased to %d bytes/s", self.rate)
+
+    def _check_feedback(self, now):
+        # Reports that stop arriving while datagrams are in flight indicate
+        # that the path is congested, or that the receiver is overloaded
+        if self._feedback_time is None:
+            return
+        timeout = max(_NO_FEEDBACK_INTERVALS * (self.srtt or 0),
+                      2 * self._feedback_interval) + self._feedback_interval
+        if now - self._feedback_time > timeout and \
+          (self._report or (-1,))[0] + 1 < self._seq:
+            self._decrease(now)
+            self._feedback_time = now
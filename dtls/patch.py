@@ -22,8 +22,10 @@
 This module is used to patch the Python standard library's ssl module. Patching
 has the following effects:
 
-    * The constant PROTOCOL_DTLSv1 is added at ssl module level
-    * DTLSv1's protocol name is added to the ssl module's id-to-name dictionary
+    * The constants PROTOCOL_DTLSv1, PROTOCOL_DTLSv1_2, and PROTOCOL_DTLS are
+      added at ssl module level
+    * The DTLS protocol names are added to the ssl module's id-to-name
+      dictionary
     * The constants DTLS_OPENSSL_VERSION* are added at the ssl module level
     * Instantiation of ssl.SSLSocket with sock.type == socket.SOCK_DGRAM is
       supported and leads to substitution of this module's DTLS code paths for
@@ -31,12 +33,14 @@ has the following effects:
     * Direct instantiation of SSLSocket as well as instantiation through
       ssl.wrap_socket are supported
     * Invocation of the function get_server_certificate with a value of
-      PROTOCOL_DTLSv1 for the parameter ssl_version is supported
+      one of the DTLS protocol constants for the parameter ssl_version is
+      supported
 """
 
 from socket import SOCK_DGRAM, socket, _delegate_methods, error as socket_error
 from socket import AF_INET, SOCK_DGRAM, getaddrinfo
-from sslconnection import SSLConnection, PROTOCOL_DTLSv1, CERT_NONE
+from sslconnection import SSLConnection, CERT_NONE
+from sslconnection import PROTOCOL_DTLSv1, PROTOCOL_DTLSv1_2, PROTOCOL_DTLS
 from sslconnection import DTLS_OPENSSL_VERSION_NUMBER, DTLS_OPENSSL_VERSION
 from sslconnection import DTLS_OPENSSL_VERSION_INFO
 from err import raise_as_ssl_module_error
@@ -53,6 +57,10 @@ def do_patch():
         return
     ssl.PROTOCOL_DTLSv1 = PROTOCOL_DTLSv1
     ssl._PROTOCOL_NAMES[PROTOCOL_DTLSv1] = "DTLSv1"
+    ssl.PROTOCOL_DTLSv1_2 = PROTOCOL_DTLSv1_2
+    ssl._PROTOCOL_NAMES[PROTOCOL_DTLSv1_2] = "DTLSv1.2"
+    ssl.PROTOCOL_DTLS = PROTOCOL_DTLS
+    ssl._PROTOCOL_NAMES[PROTOCOL_DTLS] = "DTLS"
     ssl.DTLS_OPENSSL_VERSION_NUMBER = DTLS_OPENSSL_VERSION_NUMBER
     ssl.DTLS_OPENSSL_VERSION = DTLS_OPENSSL_VERSION
     ssl.DTLS_OPENSSL_VERSION_INFO = DTLS_OPENSSL_VERSION_INFO
@@ -74,7 +82,7 @@ def _get_server_certificate(addr, ssl_version=PROTOCOL_SSLv3, ca_certs=None):
     If 'ssl_version' is specified, use it in the connection attempt.
     """
 
-    if ssl_version != PROTOCOL_DTLSv1:
+    if ssl_version not in (PROTOCOL_DTLSv1, PROTOCOL_DTLSv1_2, PROTOCOL_DTLS):
         return _orig_get_server_certificate(addr, ssl_version, ca_certs)
 
     if (ca_certs is not None):
@@ -0,0 +1,155 @@
+# Packet information: datagrams' local addresses on wildcard sockets.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Packet Information
+
+A datagram socket bound to a wildcard address receives datagrams sent to any
+of the host's addresses, and an AF_INET6 socket whose IPV6_V6ONLY option is
+cleared receives IPv4 datagrams as well, with IPv4-mapped peer addresses.
+Datagrams sent through such a socket carry the source address that the
+routing table selects for their destination, which on a multi-homed host
+need not be the address that the peer sent to; a peer with a connected
+socket discards them.
+
+With the IP_PKTINFO or IPV6_RECVPKTINFO option set, the kernel reports each
+received datagram's local address as ancillary data, and the same kind of
+ancillary data selects the source address of a datagram being sent. Python 2
+sockets neither receive nor send ancillary data; this module exchanges
+datagrams through the msghdr module, as does the gro module.
+
+Classes:
+
+  PacketInfoSocket -- datagram exchange with local addresses
+"""
+
+import errno
+import socket
+from ctypes import string_at
+from struct import Struct
+from msghdr import RECVMSG_AVAILABLE, SENDMSG_AVAILABLE
+from msghdr import MessageReceiver, control_buffer, sendmsg
+
+PKTINFO_MAX_BYTES = 65536
+
+_SOL_IP = 0
+_IP_PKTINFO = 8
+_SOL_IPV6 = 41
+_IPV6_RECVPKTINFO = 49
+_IPV6_PKTINFO = 50
+_CONTROL_LENGTH = 128
+_IN_PKTINFO = Struct("=i4s4s")  # interface index, local address, destination
+_IN6_PKTINFO = Struct("=16sI")  # destination, interface index
+
+
+class PacketInfoSocket(object):
+    """Datagram exchange with local addresses
+
+    Constructing an instance sets the packet information options of its
+    socket, which must be of family AF_INET or AF_INET6; it raises
+    socket.error where the platform does not support them. Receive buffers
+    are allocated once per instance; instances are therefore not safe for
+    concurrent use by multiple threads.
+
+    Local addresses are address tuples in the format of the socket's family,
+    whose port is the socket's own; those of AF_INET6 sockets carry the
+    receiving interface's index as their scope identifier.
+
+    Methods:
+
+      recvfrom -- receive a datagram along with its local address
+      sendto -- send a datagram from a given local address
+    """
+
+    def __init__(self, sock, bufsize=PKTINFO_MAX_BYTES):
+        """Constructor
+
+        Arguments:
+        sock -- datagram socket
+        bufsize -- maximum number of bytes to receive per call
+        """
+
+        if not RECVMSG_AVAILABLE or not SENDMSG_AVAILABLE:
+            raise socket.error(errno.ENOPROTOOPT,
+                               "Packet information unavailable")
+        if sock.family == socket.AF_INET6:
+            sock.setsockopt(_SOL_IPV6, _IPV6_RECVPKTINFO, 1)
+        else:
+            sock.setsockopt(_SOL_IP, _IP_PKTINFO, 1)
+        self._sock = sock
+        self._port = sock.getsockname()[1]
+        self._receiver = MessageReceiver(sock, bufsize, _CONTROL_LENGTH)
+
+    def recvfrom(self, wait=True):
+        """Receive a datagram along with its local address
+
+        The call follows the socket's blocking mode, as does the one of the
+        msghdr module's MessageReceiver.
+
+        Arguments:
+        wait -- whether to wait out the socket's timeout
+
+        Return value:
+        tuple of the datagram, the peer's address, and the local address
+        that the datagram was sent to, or None if that was not reported
+        """
+
+        data, address = self._receiver.recvfrom(wait)
+        return data, address, self._local_address()
+
+    def sendto(self, data, address, local_address=None):
+        """Send a datagram from a given local address
+
+        The datagram is sent regardless of the socket's blocking mode.
+
+        Arguments:
+        data -- the datagram's payload
+        address -- the peer's address
+        local_address -- the source address, as returned by recvfrom; the
+                         routing table selects one if None
+
+        Return value:
+        number of bytes sent
+        """
+
+        control = None
+        if local_address:
+            family = self._sock.family
+            addr = socket.inet_pton(family, local_address[0])
+            if family == socket.AF_INET6:
+                control = control_buffer(
+                    _SOL_IPV6, _IPV6_PKTINFO,
+                    _IN6_PKTINFO.pack(addr, local_address[3]))
+            else:
+                control = control_buffer(
+                    _SOL_IP, _IP_PKTINFO,
+                    _IN_PKTINFO.pack(0, addr, "\0" * 4))
+        return sendmsg(self._sock, data, address, control)
+
+    def _local_address(self):
+        for level, kind, data in self._receiver.control_messages():
+            if level == _SOL_IP and kind == _IP_PKTINFO:
+                # The local address, rather than the destination, which
+                # differs for broadcast and multicast datagrams
+                index, local, dest = _IN_PKTINFO.unpack(
+                    string_at(data, _IN_PKTINFO.size))
+                return socket.inet_ntoa(local), self._port
+            if level == _SOL_IPV6 and kind == _IPV6_PKTINFO:
+                dest, index = _IN6_PKTINFO.unpack(
+                    string_at(data, _IN6_PKTINFO.size))
+                return socket.inet_ntop(socket.AF_INET6, dest), self._port, \
+                  0, index
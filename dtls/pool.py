@@ -0,0 +1,269 @@
+# Connection pool: reuse of established client-side DTLS connections.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Connection Pool
+
+This module provides a pool of established client-side DTLS connections, keyed
+by server endpoint. Applications that perform many short exchanges with the
+same servers can check connections out of the pool and return them afterwards,
+instead of paying for a connect and full handshake per exchange.
+
+A connection that has been idle in the pool for longer than the pool's idle
+timeout is considered stale, since the server may have discarded its state for
+the association in the meantime. Stale connections are retired when they are
+encountered, and are replaced with new connections that offer the endpoint's
+most recently established session for resumption, so that the server can
+abbreviate the handshake.
+
+Classes:
+
+  DTLSConnectionPool -- pool of client-side DTLS connections
+"""
+
+import socket
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Condition
+from err import raise_ssl_error, ERR_POOL_EXHAUSTED
+from sslconnection import SSLConnection, PROTOCOL_DTLS, CERT_NONE
+
+_logger = getLogger(__name__)
+
+
+class _Endpoint(object):
+    """Pooling state of a single server endpoint"""
+    def __init__(self):
+        self.idle = []  # (connection, release time) pairs, most recent last
+        self.count = 0  # connections, idle as well as checked out
+        self.session = None  # most recently established session
+
+
+class DTLSConnectionPool(object):
+    """Pool of client-side DTLS connections
+
+    This class hands out established SSLConnection objects connected to
+    server endpoints, and takes them back for reuse. Pool methods may be
+    called concurrently from multiple threads; a connection, however, is only
+    ever checked out to one caller at a time.
+
+    Methods:
+
+      acquire -- check out a connection to a server endpoint
+      release -- return a checked-out connection to the pool
+      connection -- context manager pairing acquire and release
+      prune -- retire idle connections that have become stale
+      close -- retire all idle connections and stop pooling
+    """
+
+    def __init__(self, max_per_endpoint=4, idle_timeout=30.0,
+                 keyfile=None, certfile=None, cert_reqs=CERT_NONE,
+                 ssl_version=PROTOCOL_DTLS, ca_certs=None, ciphers=None,
+                 family=socket.AF_INET, timeout=None, psk=None):
+        """Constructor
+
+        Arguments:
+        max_per_endpoint -- maximum number of connections, idle as well as
+                            checked out, to any one server endpoint
+        idle_timeout -- number of seconds after which an idle connection is
+                        considered stale
+        family -- address family of sockets created for new connections
+        timeout -- socket timeout of new connections, in seconds; None for
+                   blocking sockets
+        the remaining arguments match the ones of the SSLConnection class
+        """
+
+        if max_per_endpoint < 1:
+            raise ValueError("max_per_endpoint must be at least 1")
+        self._max_per_endpoint = max_per_endpoint
+        self._idle_timeout = idle_timeout
+        self._keyfile = keyfile
+        self._certfile = certfile
+        self._cert_reqs = cert_reqs
+        self._ssl_version = ssl_version
+        self._ca_certs = ca_certs
+        self._ciphers = ciphers
+        self._family = family
+        self._timeout = timeout
+        self._psk = psk
+        self._cond = Condition()
+        self._endpoints = {}
+        self._checked_out = {}
+        self._closed = False
+
+    def _connect(self, address, session):
+        sock = socket.socket(self._family, socket.SOCK_DGRAM)
+        sock.settimeout(self._timeout)
+        try:
+            conn = SSLConnection(sock, self._keyfile, self._certfile, False,
+                                 self._cert_reqs, self._ssl_version,
+                                 self._ca_certs, False, True, self._ciphers,
+                                 self._psk)
+            if session:
+                conn.set_session(session)
+            conn.connect(address)
+            conn.do_handshake()
+        except:
+            sock.close()
+            raise
+        _logger.debug("New pooled connection to %s, session reused: %s",
+                      address, conn.session_reused())
+        return conn
+
+    def _retire(self, endpoint, conn):
+        # Retired connections are not shut down: the peer is either gone or
+        # will time out the association on its own
+        endpoint.count -= 1
+        conn.get_socket(False).close()
+        self._cond.notify_all()
+
+    def _checkout_idle(self, endpoint):
+        now = time.time()
+        while endpoint.idle:
+            conn, released = endpoint.idle.pop()
+            if now - released <= self._idle_timeout:
+                return conn
+            _logger.debug("Retiring stale pooled connection")
+            self._retire(endpoint, conn)
+
+    def acquire(self, address, timeout=None):
+        """Check out a connection
+
+        Return an idle connection to the given server endpoint if one is
+        available. Otherwise establish a new connection, unless the endpoint
+        is at capacity, in which case wait for another caller to release a
+        connection to it.
+
+        Arguments:
+        address -- address tuple of the server endpoint
+        timeout -- number of seconds to wait for an endpoint at capacity; None
+                   to wait indefinitely
+
+        Return value:
+        an SSLConnection whose handshake has completed
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            if self._closed:
+                raise ValueError("acquire called on closed connection pool")
+            endpoint = self._endpoints.get(address)
+            if not endpoint:
+                endpoint = self._endpoints[address] = _Endpoint()
+            while True:
+                conn = self._checkout_idle(endpoint)
+                if conn:
+                    self._checked_out[conn] = address
+                    return conn
+                if endpoint.count < self._max_per_endpoint:
+                    endpoint.count += 1
+                    session = endpoint.session
+                    break
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise_ssl_error(ERR_POOL_EXHAUSTED)
+                self._cond.wait(remaining)
+
+        # Handshake without holding the lock, so that other endpoints are
+        # not held up
+        try:
+            conn = self._connect(address, session)
+        except:
+            with self._cond:
+                endpoint.count -= 1
+                self._cond.notify_all()
+            raise
+        new_session = conn.get_session()
+        with self._cond:
+            if new_session:
+                endpoint.session = new_session
+            self._checked_out[conn] = address
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a checked-out connection
+
+        Arguments:
+        conn -- a connection previously returned from acquire
+        discard -- if True, the connection is retired instead of being made
+                   available for reuse; this should be done whenever an error
+                   occurred on the connection
+        """
+
+        with self._cond:
+            address = self._checked_out.pop(conn)
+            endpoint = self._endpoints[address]
+            if discard or self._closed:
+                self._retire(endpoint, conn)
+                return
+            endpoint.idle.append((conn, time.time()))
+            self._cond.notify_all()
+
+    @contextmanager
+    def connection(self, address, timeout=None):
+        """Check out a connection for the duration of a with-block
+
+        The connection is released when the block is left. It is discarded
+        if the block raises an exception.
+
+        Arguments:
+        these arguments match the ones of the acquire method
+        """
+
+        conn = self.acquire(address, timeout)
+        try:
+            yield conn
+        except:
+            self.release(conn, True)
+            raise
+        self.release(conn)
+
+    def prune(self):
+        """Retire stale idle connections
+
+        Stale connections are retired lazily upon checkout. This method can
+        be called periodically in order to also release the resources of
+        stale connections to endpoints that are no longer being used.
+        """
+
+        with self._cond:
+            now = time.time()
+            for endpoint in self._endpoints.itervalues():
+                fresh = []
+                for conn, released in endpoint.idle:
+                    if now - released <= self._idle_timeout:
+                        fresh.append((conn, released))
+                    else:
+                        self._retire(endpoint, conn)
+                endpoint.idle = fresh
+
+    def close(self):
+        """Close the pool
+
+        Retire all idle connections. Connections that are checked out at the
+        time of this call are retired when they are released.
+        """
+
+        with self._cond:
+            self._closed = True
+            for endpoint in self._endpoints.itervalues():
+                while endpoint.idle:
+                    self._retire(endpoint, endpoint.idle.pop()[0])
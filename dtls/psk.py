@@ -0,0 +1,136 @@
+# Pre-shared keys: identity-to-key store for PSK cipher suites.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-Shared Keys
+
+This module provides the server-side key store for pre-shared key (PSK) cipher
+suites. PSK handshakes perform no public-key operations: peers authenticate
+each other through possession of a shared symmetric key, which the client
+selects by sending its identity.
+
+The server looks up the key of a client identity during every handshake. The
+store therefore keeps all keys in an in-memory hash index, so that lookups do
+not depend on the number of provisioned identities. The index is populated
+from a key file, in which each non-empty line that does not start with "#"
+holds an identity and its hexadecimal key, separated by a colon:
+
+  # identity:key
+  sensor-0017:5f2b9d0c4e1a7384a6c2f0e9d8b7a615
+
+Classes:
+
+  PSKStore -- identity-to-key store
+"""
+
+from binascii import unhexlify
+from logging import getLogger
+
+_logger = getLogger(__name__)
+
+
+class PSKStore(object):
+    """Identity-to-key store
+
+    Instances can be passed as the psk argument of server-side SSLConnection
+    objects. Lookups may occur concurrently with reloading: a key file is
+    read into a new index, which then replaces the current one as a whole.
+
+    Methods:
+
+      load -- replace the stored keys with the contents of a key file
+      add -- store the key of an identity
+      remove -- remove the key of an identity
+      get -- look up the key of an identity
+    """
+
+    def __init__(self, filename=None):
+        """Constructor
+
+        Arguments:
+        filename -- name of a key file to load; None for an empty store
+        """
+
+        self._keys = {}
+        if filename:
+            self.load(filename)
+
+    def load(self, filename):
+        """Load a key file
+
+        The file's contents replace all previously stored keys. If the file
+        is malformed, the store remains unchanged.
+
+        Arguments:
+        filename -- name of the key file
+        """
+
+        keys = {}
+        with open(filename) as key_file:
+            for line_number, line in enumerate(key_file, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                identity, sep, key = line.rpartition(":")
+                try:
+                    key = unhexlify(key)
+                except TypeError:
+                    key = None
+                if not identity or not key:
+                    raise ValueError("%s, line %d: invalid PSK entry" %
+                                     (filename, line_number))
+                keys[identity] = key
+        self._keys = keys
+        _logger.debug("Loaded %d pre-shared keys from %s", len(keys), filename)
+
+    def add(self, identity, key):
+        """Store a key
+
+        Arguments:
+        identity -- client identity string
+        key -- the identity's key, a binary string
+        """
+
+        self._keys[identity] = key
+
+    def remove(self, identity):
+        """Remove a key
+
+        Arguments:
+        identity -- client identity string
+        """
+
+        del self._keys[identity]
+
+    def get(self, identity, default=None):
+        """Look up a key
+
+        Arguments:
+        identity -- client identity string
+        default -- value returned for unknown identities
+
+        Return value:
+        the identity's key
+        """
+
+        return self._keys.get(identity, default)
+
+    def __contains__(self, identity):
+        return identity in self._keys
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,433 @@
+# Reliable channel: ordered, acknowledged byte stream over DTLS records.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reliable Channel
+
+DTLS, like the datagram transport beneath it, neither retransmits lost
+records nor delivers records in order. This module provides a byte stream
+with the delivery guarantees of a stream socket over an established
+SSLConnection: the sender splits the stream into numbered segments, each of
+which fits into a single record, and retransmits segments until the receiver
+acknowledges them; the receiver delivers segments to the application in
+order.
+
+The sender keeps up to a window of segments in flight. Acknowledgements carry
+the number of the next segment the receiver expects, the receiver's available
+buffer space, and up to eight blocks of segments that it received beyond a
+gap (selective acknowledgements, after RFC 2018). A segment is retransmitted
+when three segments sent after it have been selectively acknowledged, or when
+its retransmission timer expires; the timeout is derived from round-trip time
+samples as in RFC 6298, and doubles with each expiration. Segments carry a
+timestamp, which acknowledgements echo, so that retransmitted segments also
+yield valid samples.
+
+Receivers acknowledge every second segment, segments that arrive out of
+order, and otherwise after a short delay. Neither peer sends while it is not
+called: applications that wait for other events while data is in flight must
+call the service method when the timeout reported by it expires.
+
+Records of the two kinds of segments start with the following headers, with
+integers in network byte order:
+
+  data: type (0), flags, segment number, timestamp in milliseconds
+  acknowledgement: type (1), flags, next expected segment number, window in
+                   segments, echoed timestamp, number of blocks, and for each
+                   block the numbers of its first and one past its last segment
+
+Classes:
+
+  ReliableConnection -- reliable byte stream over an SSLConnection
+"""
+
+import errno
+import socket
+from collections import deque, OrderedDict
+from logging import getLogger
+from struct import Struct
+from timeit import default_timer
+from err import raise_ssl_error
+from err import ERR_READ_TIMEOUT, ERR_WRITE_TIMEOUT, ERR_PEER_UNRESPONSIVE
+from layer import _NonBlockingLayer, _SEQ_MASK, _unwrap
+
+_logger = getLogger(__name__)
+
+WINDOW = 128  # segments
+INITIAL_RTO = 1.0  # seconds
+MIN_RTO = 0.2
+MAX_RTO = 60.0
+MAX_RETRIES = 10
+ACK_DELAY = 0.005
+
+_DATA = 0
+_ACK = 1
+_FLAG_FIN = 0x01
+_FLAG_TIMESTAMP = 0x02  # the acknowledgement echoes a timestamp
+
+_DATA_HEADER = Struct("!BBII")
+_ACK_HEADER = Struct("!BBIIIB")
+_SACK_BLOCK = Struct("!II")
+_MAX_SACK_BLOCKS = 8
+_DUP_THRESHOLD = 3
+_CLOCK_GRANULARITY = 0.001
+
+
+class _Segment(object):
+    """Segment queued for transmission or awaiting acknowledgement"""
+
+    def __init__(self, seq, data, fin):
+        self.seq = seq
+        self.data = data
+        self.fin = fin
+        self.sent = 0
+        self.transmissions = 0
+        self.sacked = False
+        self.fast_retransmitted = False
+
+
+class ReliableConnection(_NonBlockingLayer):
+    """Reliable byte stream over an SSLConnection
+
+    Blocking methods send and receive while they wait, and raise an
+    SSLError once the timeout given to the constructor passes without their
+    completion.
+
+    Methods:
+
+      send -- send data
+      recv -- receive data
+      flush -- wait until the peer has acknowledged all sent data
+      close -- end the stream and wait for acknowledgement
+      service -- process received records and expired timers
+
+    Attributes:
+
+      segments_sent -- number of data segments transmitted
+      segments_received -- number of data segments received
+      retransmits -- number of data segments retransmitted
+      srtt -- smoothed round-trip time in seconds, or None without samples
+      rto -- current retransmission timeout in seconds
+    """
+
+    _handlers = {_DATA: (_DATA_HEADER.size, "_process_data"),
+                 _ACK: (_ACK_HEADER.size, "_process_ack")}
+
+    def __init__(self, conn, window=WINDOW, segment_size=None, timeout=None):
+        """Constructor
+
+        Arguments:
+        conn -- SSLConnection whose handshake has completed
+        window -- maximum number of unacknowledged segments in flight, and
+                  number of segments the receive buffer holds; this bounds
+                  throughput at window * segment_size bytes per round trip
+        segment_size -- stream bytes per record; if None, the largest size
+                        that fits within the connection's MTU
+        timeout -- time in seconds that blocking methods wait for progress,
+                   or None to wait indefinitely
+        """
+
+        super(ReliableConnection, self).__init__(conn, timeout)
+        self._window = window
+        self._segment_size = segment_size or \
+          self._payload_size(_DATA_HEADER.size)
+        # Sender state
+        self._snd_una = 0  # oldest unacknowledged segment
+        self._snd_nxt = 0  # number of the next queued segment
+        self._unsent = deque()
+        self._unacked = OrderedDict()  # by segment number
+        self._peer_window = window
+        self._probe_time = self._epoch
+        self._retries = 0
+        self._closed = False
+        self._srtt = self._rttvar = None
+        self.rto = INITIAL_RTO
+        # Receiver state
+        self._rcv_nxt = 0  # next expected segment
+        self._out_of_order = {}  # by segment number
+        self._received = deque()  # in-order segment payloads
+        self._received_offset = 0  # consumed bytes of the first payload
+        self._eof = False
+        self._ts_recent = None
+        self._ack_count = 0
+        self._ack_deadline = None
+        self._advertised = window
+        self.segments_sent = self.segments_received = self.retransmits = 0
+
+    @property
+    def srtt(self):
+        return self._srtt
+
+    def send(self, data):
+        """Send data
+
+        The data are queued for transmission; this method blocks while the
+        queue holds more than a window of segments beyond those in flight.
+
+        Arguments:
+        data -- string containing the data to send
+
+        Return value:
+        number of bytes queued, which is the length of data
+        """
+
+        if self._closed:
+            raise socket.error(errno.EPIPE, "Reliable stream was closed")
+        for offset in xrange(0, len(data), self._segment_size):
+            self._queue(data[offset:offset + self._segment_size], False)
+        self._send_window()
+        self._run(lambda: len(self._unsent) <= self._window, ERR_WRITE_TIMEOUT)
+        return len(data)
+
+    def recv(self, bufsize):
+        """Receive data
+
+        This method blocks until data are available, or the peer has closed
+        the stream.
+
+        Arguments:
+        bufsize -- maximum number of bytes to return
+
+        Return value:
+        string containing received data, or the empty string if the peer
+        closed the stream
+        """
+
+        self._run(lambda: self._received or self._eof, ERR_READ_TIMEOUT)
+        chunks = []
+        length = 0
+        while self._received and length < bufsize:
+            payload = self._received[0]
+            start = self._received_offset
+            chunk = payload[start:start + bufsize - length]
+            chunks.append(chunk)
+            length += len(chunk)
+            if start + len(chunk) < len(payload):
+                self._received_offset += len(chunk)
+            else:
+                self._received.popleft()
+                self._received_offset = 0
+        # Reopen a window that the application's reading has relieved
+        half = self._window // 2
+        if self._advertised <= half < self._window - len(self._received):
+            self._send_ack()
+        return "".join(chunks)
+
+    def flush(self):
+        """Wait until the peer has acknowledged all sent data"""
+
+        self._run(lambda: not self._unsent and not self._unacked,
+                  ERR_WRITE_TIMEOUT)
+
+    def close(self):
+        """Close the stream
+
+        The peer's recv method returns the empty string once it has received
+        all data sent before this method was called. This method blocks until
+        the peer has acknowledged all data. The wrapped connection remains
+        open, and can continue to receive the peer's data.
+        """
+
+        if not self._closed:
+            self._closed = True
+            self._queue("", True)
+            self._send_window()
+        self.flush()
+
+    def _ts(self, now):
+        return int((now - self._epoch) * 1000) & _SEQ_MASK
+
+    def _handle_timers(self, now):
+        self._expire(now)
+        return self._next_timer(now)
+
+    #
+    # Sender
+    #
+    def _queue(self, data, fin):
+        self._unsent.append(_Segment(self._snd_nxt, data, fin))
+        self._snd_nxt += 1
+
+    def _transmit(self, segment):
+        now = default_timer()
+        self._write(_DATA_HEADER.pack(_DATA, _FLAG_FIN if segment.fin else 0,
+                                      segment.seq & _SEQ_MASK, self._ts(now)) +
+                    segment.data)
+        segment.sent = now
+        segment.transmissions += 1
+        self.segments_sent += 1
+        if segment.transmissions > 1:
+            self.retransmits += 1
+
+    def _send_window(self):
+        limit = self._snd_una + min(self._window, self._peer_window)
+        while self._unsent and self._unsent[0].seq < limit:
+            segment = self._unsent.popleft()
+            self._unacked[segment.seq] = segment
+            self._transmit(segment)
+
+    def _process_ack(self, record):
+        kind, flags, ack, window, echo, blocks = \
+          _ACK_HEADER.unpack_from(record)
+        ack = _unwrap(ack, self._snd_una)
+        if ack > self._snd_nxt - len(self._unsent):
+            _logger.warning("Dropping acknowledgement of unsent segment %d",
+                            ack)
+            return
+        progress = False
+        if ack > self._snd_una:
+            for seq in xrange(self._snd_una, ack):
+                del self._unacked[seq]
+            self._snd_una = ack
+            progress = True
+        offset = _ACK_HEADER.size
+        for _ in xrange(min(blocks, (len(record) - offset) // _SACK_BLOCK.size)):
+            start, end = _SACK_BLOCK.unpack_from(record, offset)
+            offset += _SACK_BLOCK.size
+            start = max(_unwrap(start, self._snd_una), self._snd_una)
+            end = min(_unwrap(end, self._snd_una), self._snd_una + self._window)
+            for seq in xrange(start, end):
+                segment = self._unacked.get(seq)
+                if segment and not segment.sacked:
+                    segment.sacked = progress = True
+        now = default_timer()
+        self._peer_window = window
+        self._probe_time = now
+        if progress:
+            self._retries = 0
+            if flags & _FLAG_TIMESTAMP:
+                self._sample_rtt(((self._ts(now) - echo) & _SEQ_MASK) / 1000.0)
+            if blocks:
+                self._fast_retransmit()
+        self._send_window()
+
+    def _sample_rtt(self, rtt):
+        # RFC 6298, section 2
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+        self.rto = min(max(self._srtt + max(_CLOCK_GRANULARITY,
+                                            4 * self._rttvar), MIN_RTO),
+                       MAX_RTO)
+
+    def _fast_retransmit(self):
+        sacked_above = 0
+        for segment in reversed(self._unacked.values()):
+            if segment.sacked:
+                sacked_above += 1
+            elif sacked_above >= _DUP_THRESHOLD and \
+              not segment.fast_retransmitted:
+                segment.fast_retransmitted = True
+                self._transmit(segment)
+
+    def _expire(self, now):
+        if self._ack_deadline is not None and self._ack_deadline <= now:
+            self._send_ack()
+        expired = [segment for segment in self._unacked.itervalues()
+                   if not segment.sacked and segment.sent + self.rto <= now]
+        if not expired and not self._unacked and self._unsent and \
+          self._probe_time + self.rto <= now:
+            # Probe a window that the peer has closed
+            segment = self._unsent.popleft()
+            self._unacked[segment.seq] = segment
+            expired = [segment]
+        if not expired:
+            return
+        self._retries += 1
+        if self._retries > MAX_RETRIES:
+            raise_ssl_error(ERR_PEER_UNRESPONSIVE)
+        _logger.debug("Retransmission timeout: resending %d segments",
+                      len(expired))
+        for segment in expired:
+            segment.fast_retransmitted = False
+            self._transmit(segment)
+        self.rto = min(self.rto * 2, MAX_RTO)
+        self._probe_time = now
+
+    def _next_timer(self, now):
+        deadlines = [segment.sent + self.rto
+                     for segment in self._unacked.itervalues()
+                     if not segment.sacked]
+        if not self._unacked and self._unsent:
+            deadlines.append(self._probe_time + self.rto)
+        if self._ack_deadline is not None:
+            deadlines.append(self._ack_deadline)
+        if deadlines:
+            return max(min(deadlines) - now, 0)
+
+    #
+    # Receiver
+    #
+    def _process_data(self, record):
+        kind, flags, seq, ts = _DATA_HEADER.unpack_from(record)
+        seq = _unwrap(seq, self._rcv_nxt)
+        self.segments_received += 1
+        self._ts_recent = ts
+        fin = flags & _FLAG_FIN
+        payload = record[_DATA_HEADER.size:]
+        if seq < self._rcv_nxt or \
+          seq >= self._rcv_nxt + self._window - len(self._received):
+            # Duplicate, or beyond the receive buffer: tell the sender
+            self._send_ack()
+            return
+        if seq > self._rcv_nxt:
+            self._out_of_order.setdefault(seq, (payload, fin))
+            self._send_ack()
+            return
+        filled = bool(self._out_of_order)
+        self._deliver(payload, fin)
+        while self._rcv_nxt in self._out_of_order:
+            self._deliver(*self._out_of_order.pop(self._rcv_nxt))
+        self._ack_count += 1
+        if filled or fin or self._ack_count >= 2:
+            self._send_ack()
+        elif self._ack_deadline is None:
+            self._ack_deadline = default_timer() + ACK_DELAY
+
+    def _deliver(self, payload, fin):
+        if payload:
+            self._received.append(payload)
+        if fin:
+            self._eof = True
+        self._rcv_nxt += 1
+
+    def _sack_blocks(self):
+        blocks = []
+        for seq in sorted(self._out_of_order):
+            if blocks and blocks[-1][1] == seq:
+                blocks[-1][1] = seq + 1
+            elif len(blocks) < _MAX_SACK_BLOCKS:
+                blocks.append([seq, seq + 1])
+            else:
+                break
+        return blocks
+
+    def _send_ack(self):
+        blocks = self._sack_blocks()
+        window = max(self._window - len(self._received), 0)
+        flags = 0 if self._ts_recent is None else _FLAG_TIMESTAMP
+        self._write(_ACK_HEADER.pack(_ACK, flags, self._rcv_nxt & _SEQ_MASK,
+                                     window, self._ts_recent or 0,
+                                     len(blocks)) +
+                    "".join(_SACK_BLOCK.pack(start & _SEQ_MASK,
+                                             end & _SEQ_MASK)
+                            for start, end in blocks))
+        self._advertised = window
+        self._ack_count = 0
+        self._ack_deadline = None
@@ -31,6 +31,19 @@ Classes:
 Integer constants:
 
   PROTOCOL_DTLSv1
+  PROTOCOL_DTLSv1_2
+  PROTOCOL_DTLS
+
+PROTOCOL_DTLS selects the highest protocol version supported by both peers. It
+negotiates DTLS 1.2, and with it the AEAD cipher suites (AES-GCM and
+ChaCha20-Poly1305), whenever the library and the peer support it, and falls
+back to DTLS 1.0 otherwise. The other two constants restrict connections to a
+single protocol version.
+
+Status sentinels, returned from the try_ methods of SSLConnection:
+
+  WANT_READ
+  WANT_WRITE
 
 The cert group must coincide in meaning and value with the one of the standard
 library's ssl module, since its values can be passed to this module.
@@ -42,37 +55,72 @@ library's ssl module, since its values can be passed to this module.
 
 import errno
 import socket
+import sys
 import hmac
 import datetime
 from logging import getLogger
 from os import urandom
+from collections import deque
 from select import select
 from weakref import proxy
+try:
+    from threading import Lock
+except ImportError:
+    from dummy_threading import Lock
 from err import openssl_error, InvalidSocketError
 from err import raise_ssl_error
 from err import SSL_ERROR_WANT_READ, SSL_ERROR_SYSCALL
+from err import WANT_READ, WANT_WRITE
 from err import ERR_COOKIE_MISMATCH, ERR_NO_CERTS
 from err import ERR_NO_CIPHER, ERR_HANDSHAKE_TIMEOUT, ERR_PORT_UNREACHABLE
 from err import ERR_READ_TIMEOUT, ERR_WRITE_TIMEOUT
 from err import ERR_BOTH_KEY_CERT_FILES_SVR
+from err import ERR_NO_CURVE, ERR_DH_PARAMS, ERR_NO_SRTP_PROFILE
 from x509 import _X509, decode_cert
 from tlock import tlock_init
+from gro import GROReceiver
+from pacing import PacedConnection
 from openssl import *
 from util import _Rsrc, _BIO
 
 _logger = getLogger(__name__)
 
 PROTOCOL_DTLSv1 = 256
+PROTOCOL_DTLSv1_2 = 258
+PROTOCOL_DTLS = 259
 CERT_NONE = 0
 CERT_OPTIONAL = 1
 CERT_REQUIRED = 2
 
 #
-# One-time global OpenSSL library initialization
+# One-time global OpenSSL library initialization, deferred until the first
+# context is created
 #
-SSL_library_init()
-SSL_load_error_strings()
-tlock_init()
+_library_initialized = False
+_library_init_lock = Lock()
+
+def _init_library():
+    global _library_initialized
+    with _library_init_lock:
+        if _library_initialized:
+            return
+        SSL_library_init()
+        SSL_load_error_strings()
+        tlock_init()
+        _library_initialized = True
+
+def _ssl_method(ssl_version, server_side):
+    # Values other than the fixed-version constants, including the stream
+    # protocol constants the ssl module passes by default, select the
+    # version-flexible method
+    if ssl_version == PROTOCOL_DTLSv1:
+        return DTLSv1_server_method() if server_side else \
+          DTLSv1_client_method()
+    if ssl_version == PROTOCOL_DTLSv1_2:
+        return DTLSv1_2_server_method() if server_side else \
+          DTLSv1_2_client_method()
+    return DTLS_server_method() if server_side else DTLS_client_method()
+
 DTLS_OPENSSL_VERSION_NUMBER = SSLeay()
 DTLS_OPENSSL_VERSION = SSLeay_version(SSLEAY_VERSION)
 DTLS_OPENSSL_VERSION_INFO = (
@@ -98,6 +146,7 @@ class _SSL(_Rsrc):
     """SSL structure wrapper"""
     def __init__(self, value):
         super(_SSL, self).__init__(value)
+        self.fast = SSLFastPath(value)
 
     def __del__(self):
         _logger.debug("Freeing SSL: %d", self.raw)
@@ -105,6 +154,158 @@ class _SSL(_Rsrc):
         self._value = None
 
 
+class _SESSION(_Rsrc):
+    """SSL_SESSION wrapper"""
+    def __init__(self, value):
+        super(_SESSION, self).__init__(value)
+
+    def __del__(self):
+        _logger.debug("Freeing SSL SESSION: %d", self.raw)
+        SSL_SESSION_free(self._value)
+        self._value = None
+
+
+#
+# DH parameters by file name; parsed once, shared among all contexts, and
+# retained for the lifetime of the process
+#
+_dh_params = {}
+_dh_params_lock = Lock()
+
+def _load_dh_params(filename):
+    with _dh_params_lock:
+        dh = _dh_params.get(filename)
+        if not dh:
+            dh_file = _BIO(BIO_new_file(filename, "rb"))
+            dh = _dh_params[filename] = PEM_read_bio_DHparams(dh_file.value)
+        return dh
+
+
+#
+# Path MTU discovery: with the don't-fragment bit set on outgoing datagrams,
+# the kernel maintains a path MTU estimate per destination, which it lowers
+# upon ICMP fragmentation-needed and packet-too-big messages. The socket
+# options are Linux-specific; elsewhere the library's MTU handling applies.
+#
+_PMTU_DISCOVERY = sys.platform.startswith("linux")
+_IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+_IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+_IP_MTU = getattr(socket, "IP_MTU", 14)
+_IPV6_MTU_DISCOVER = getattr(socket, "IPV6_MTU_DISCOVER", 23)
+_IPV6_PMTUDISC_DO = getattr(socket, "IPV6_PMTUDISC_DO", 2)
+_IPV6_MTU = getattr(socket, "IPV6_MTU", 24)
+_UDP_IP_HEADER_LENGTH = {socket.AF_INET: 28, socket.AF_INET6: 48}
+DTLS1_RT_HEADER_LENGTH = 13
+SSL3_RT_MAX_PLAIN_LENGTH = 16384
+
+def _set_dont_fragment(sock):
+    if sock.family == socket.AF_INET6:
+        sock.setsockopt(socket.IPPROTO_IPV6, _IPV6_MTU_DISCOVER,
+                        _IPV6_PMTUDISC_DO)
+        try:
+            # IPv4-mapped peers of dual-stack sockets
+            sock.setsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER,
+                            _IP_PMTUDISC_DO)
+        except socket.error:
+            pass
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER, _IP_PMTUDISC_DO)
+
+def _path_mtu(sock, peer_address):
+    if sock.family == socket.AF_INET6:
+        level, optname = socket.IPPROTO_IPV6, _IPV6_MTU
+    else:
+        level, optname = socket.IPPROTO_IP, _IP_MTU
+    try:
+        return sock.getsockopt(level, optname)
+    except socket.error:
+        pass
+    # The option is available on connected sockets only; the estimate for
+    # the peer of an unconnected socket is read through a probe socket
+    probe = socket.socket(sock.family, socket.SOCK_DGRAM)
+    try:
+        probe.connect(peer_address)
+        return probe.getsockopt(level, optname)
+    except socket.error as err:
+        _logger.debug("Path MTU to %s unavailable: %s", peer_address, err)
+    finally:
+        probe.close()
+
+#
+# UDP generic segmentation offload (Linux 4.18 and later): the kernel splits a
+# buffer into datagrams of a given size, of which only the last may be
+# shorter. Encrypting records into a buffer requires replacing the write BIO
+# of an established connection, which OpenSSL supports from version 1.1.0.
+#
+_UDP_GSO = sys.platform.startswith("linux") and \
+  DTLS_OPENSSL_VERSION_NUMBER >= 0x10100000
+_SOL_UDP = 17
+_UDP_SEGMENT = 103
+_GSO_MAX_SEGMENTS = 64
+_GSO_MAX_BYTES = 65000
+_GSO_RECORD_OVERHEAD = 64  # upper bound of a record's expansion
+_GSO_UNSUPPORTED = errno.ENOPROTOOPT, errno.EINVAL, errno.EIO, errno.EOPNOTSUPP
+
+#
+# UDP generic receive offload (Linux 5.0 and later): the kernel coalesces
+# datagrams of a peer into one buffer, which is split into datagrams again on
+# receipt. Passing them to the library one at a time requires replacing the
+# read BIO of an established connection, which OpenSSL supports from version
+# 1.1.0.
+#
+_UDP_GRO = _UDP_GSO
+
+def _gso_batches(datagrams):
+    # Group datagrams into runs of equal length, each of which may end with
+    # one shorter datagram, and whose records fit into one offload buffer
+    batch = []
+    for datagram in datagrams:
+        length = len(datagram)
+        if batch:
+            if length > size or len(batch) == limit:
+                yield batch
+                batch = []
+            elif length < size:
+                batch.append(datagram)
+                yield batch
+                batch = []
+                continue
+            else:
+                batch.append(datagram)
+                continue
+        batch.append(datagram)
+        size = length
+        limit = min(_GSO_MAX_SEGMENTS,
+                    _GSO_MAX_BYTES // (size + _GSO_RECORD_OVERHEAD))
+    if batch:
+        yield batch
+
+_AEAD_OVERHEAD = {"AESCCM8": 16, "CHACHA20/POLY1305": 16}  # others: 24
+_MAC_LENGTH = {"MD5": 16, "SHA1": 20, "SHA256": 32, "SHA384": 48}
+_BLOCK_LENGTH = {"3DES": 8, "DES": 8, "IDEA": 8, "RC2": 8}  # others: 16
+
+def _record_payload(mtu, description):
+    # Maximum plaintext length of a record that fits within the MTU, given
+    # the description of its cipher suite; for libraries that do not compute
+    # it themselves
+    attrs = dict(field.split("=", 1)
+                 for field in description.split() if "=" in field)
+    enc = attrs.get("Enc", "").partition("(")[0]
+    mac = attrs.get("Mac")
+    room = mtu - DTLS1_RT_HEADER_LENGTH
+    if mac == "AEAD":
+        return room - _AEAD_OVERHEAD.get(enc, 24)
+    mac_len = _MAC_LENGTH.get(mac, 48)
+    if enc == "None":
+        return room - mac_len
+    # An explicit IV precedes the CBC-encrypted data, which is padded with at
+    # least one byte; the MAC is encrypted along with the data, unless
+    # encrypt-then-MAC has been negotiated
+    block = _BLOCK_LENGTH.get(enc, 16)
+    return min((room - block) // block * block - mac_len - 1,
+               (room - block - mac_len) // block * block - 1)
+
+
 class _CallbackProxy(object):
     """Callback gateway to an SSLConnection object
 
@@ -130,6 +331,8 @@ class SSLConnection(object):
     """
 
     _rnd_key = urandom(16)
+    _gso = None  # segmentation offload usability, determined on first use
+    _paced = None  # the pacing layer, once start_pacing has been called
 
     def _init_server(self, peer_address):
         if self._sock.type != socket.SOCK_DGRAM:
@@ -141,15 +344,25 @@ class SSLConnection(object):
             rsock = self._sock
             BIO_dgram_set_connected(self._wbio.value, peer_address)
         else:
-            from demux import UDPDemux
-            self._udp_demux = UDPDemux(self._sock)
+            if self._classifier:
+                # Datagrams are classified as they pass through the root
+                # socket, which only a routing demux reads all of
+                from demux.router import UDPDemux
+                self._udp_demux = UDPDemux(self._sock, gro=self._gro,
+                                           classifier=self._classifier)
+            else:
+                from demux import UDPDemux
+                self._udp_demux = UDPDemux(self._sock, gro=self._gro)
             rsock = self._udp_demux.get_connection(None)
         if rsock is self._sock:
             self._rbio = self._wbio
         else:
             self._rsock = rsock
             self._rbio = _BIO(BIO_new_dgram(self._rsock.fileno(), BIO_NOCLOSE))
-        self._ctx = _CTX(SSL_CTX_new(DTLSv1_server_method()))
+        if not peer_address and self._udp_demux.pktinfo:
+            self._rbio, self._wbio = self._pktinfo_bios()
+        _init_library()
+        self._ctx = _CTX(SSL_CTX_new(_ssl_method(self._ssl_version, True)))
         SSL_CTX_set_session_cache_mode(self._ctx.value, SSL_SESS_CACHE_OFF)
         if self._cert_reqs == CERT_NONE:
             verify_mode = SSL_VERIFY_NONE
@@ -159,17 +372,27 @@ class SSLConnection(object):
             verify_mode = SSL_VERIFY_PEER | SSL_VERIFY_CLIENT_ONCE | \
               SSL_VERIFY_FAIL_IF_NO_PEER_CERT
         self._config_ssl_ctx(verify_mode)
+        self._config_key_exchange()
+        if self._psk:
+            psk_store = self._psk
+            self._ctx.psk_cb = SSL_CTX_set_psk_server_cb(
+                self._ctx.value,
+                lambda ssl, identity: psk_store.get(identity))
         if not peer_address:
             # Configure UDP listening socket
             self._listening = False
             self._listening_peer_address = None
             self._pending_peer_address = None
+            self._pending_ssl = None
+            self._verified_peers = deque()
             self._cb_keepalive = SSL_CTX_set_cookie_cb(
                 self._ctx.value,
                 _CallbackProxy(self._generate_cookie_cb),
                 _CallbackProxy(self._verify_cookie_cb))
         self._ssl = _SSL(SSL_new(self._ctx.value))
         SSL_set_accept_state(self._ssl.value)
+        if peer_address and self._pmtu_discovery:
+            self._discover_pmtu()
         if peer_address and self._do_handshake_on_connect:
             return lambda: self.do_handshake()
 
@@ -179,17 +402,46 @@ class SSLConnection(object):
 
         self._wbio = _BIO(BIO_new_dgram(self._sock.fileno(), BIO_NOCLOSE))
         self._rbio = self._wbio
-        self._ctx = _CTX(SSL_CTX_new(DTLSv1_client_method()))
+        _init_library()
+        self._ctx = _CTX(SSL_CTX_new(_ssl_method(self._ssl_version, False)))
         if self._cert_reqs == CERT_NONE:
             verify_mode = SSL_VERIFY_NONE
         else:
             verify_mode = SSL_VERIFY_PEER
         self._config_ssl_ctx(verify_mode)
+        if self._psk:
+            psk = self._psk
+            self._ctx.psk_cb = SSL_CTX_set_psk_client_cb(
+                self._ctx.value, lambda ssl, hint: psk)
         self._ssl = _SSL(SSL_new(self._ctx.value))
         SSL_set_connect_state(self._ssl.value)
         if peer_address:
             return lambda: self.connect(peer_address)
 
+    def _init_muxed(self, peer):
+        # Records are sent to the peer through the mux's shared socket, and
+        # read from the datagrams that the mux dispatches to this connection
+        self._sock = peer.sock
+        self._mux = peer.mux
+        self._mux_key = peer.address[:2]
+        self._gro = False
+        self._init_client(None)
+        self._rbio = _BIO(BIO_new(BIO_s_mem()))
+        BIO_dgram_set_peer(self._wbio.value, peer.address)
+        self._ssl.fast.set_feed(self._rbio.raw, self._datagrams)
+        if self._pmtu_discovery:
+            self._discover_pmtu()
+        else:
+            # The library cannot query the MTU through the unconnected shared
+            # socket, and would fall back to its minimum, fragmenting even
+            # the ClientHello; the kernel's estimate is applied once instead
+            self._update_mtu()
+            if self._pmtu:
+                SSL_set_options(self._ssl.value, SSL_OP_NO_QUERY_MTU)
+                self._pmtu = None  # not tracked without discovery
+        if self._do_handshake_on_connect:
+            return lambda: self.do_handshake()
+
     def _config_ssl_ctx(self, verify_mode):
         SSL_CTX_set_verify(self._ctx.value, verify_mode)
         SSL_CTX_set_read_ahead(self._ctx.value, 1)
@@ -208,39 +460,110 @@ class SSLConnection(object):
                 SSL_CTX_set_cipher_list(self._ctx.value, self._ciphers)
             except openssl_error() as err:
                 raise_ssl_error(ERR_NO_CIPHER, err)
+        if self._cipher_probe:
+            self._order_ciphers()
+        if self._curves:
+            try:
+                SSL_CTX_set1_curves_list(self._ctx.value, self._curves)
+            except openssl_error() as err:
+                raise_ssl_error(ERR_NO_CURVE, err)
+        if self._srtp_profiles:
+            try:
+                SSL_CTX_set_tlsext_use_srtp(self._ctx.value,
+                                            self._srtp_profiles)
+            except openssl_error() as err:
+                raise_ssl_error(ERR_NO_SRTP_PROFILE, err)
+
+    def _order_ciphers(self):
+        # The configured list has been validated above; if probing fails, it
+        # remains in effect in its given order
+        from cipherprobe import order_ciphers, CACHE_FILE
+        cache_file = self._cipher_probe
+        if not isinstance(cache_file, basestring):
+            cache_file = CACHE_FILE
+        try:
+            ciphers = order_ciphers(self._ciphers, cache_file)
+        except (openssl_error(), EnvironmentError) as err:
+            _logger.warning("Cipher probe failed: %s", err)
+            return
+        _logger.debug("Ordered cipher list: %s", ciphers)
+        SSL_CTX_set_cipher_list(self._ctx.value, ciphers)
+        # Servers select from the ordered list rather than the client's
+        SSL_CTX_set_options(self._ctx.value, SSL_OP_CIPHER_SERVER_PREFERENCE)
+
+    def _config_key_exchange(self):
+        # Enable ECDHE: OpenSSL 1.1.0 and later do so by default, 1.0.2
+        # requires automatic curve selection to be turned on, and earlier
+        # versions support a single fixed curve
+        if DTLS_OPENSSL_VERSION_NUMBER >= 0x10002000:
+            SSL_CTX_set_ecdh_auto(self._ctx.value, 1)
+        else:
+            SSL_CTX_set_tmp_ecdh_p256(self._ctx.value)
+        if not self._dh_params:
+            return
+        # DHE is enabled only if parameters are configured
+        try:
+            if self._dh_params == "auto":
+                SSL_CTX_set_dh_auto(self._ctx.value, 1)
+            else:
+                SSL_CTX_set_tmp_dh(self._ctx.value,
+                                   _load_dh_params(self._dh_params))
+        except openssl_error() as err:
+            raise_ssl_error(ERR_DH_PARAMS, err)
 
     def _copy_server(self):
         source = self._sock
         self._udp_demux = source._udp_demux
         rsock = self._udp_demux.get_connection(source._pending_peer_address)
         self._ctx = source._ctx
-        self._ssl = source._ssl
-        new_source_wbio = _BIO(BIO_new_dgram(source._sock.fileno(),
-                                             BIO_NOCLOSE))
+        queued_ssl = source._pending_ssl
+        self._ssl = queued_ssl or source._ssl
         if hasattr(source, "_rsock"):
             self._sock = source._sock
             self._rsock = rsock
             self._wbio = _BIO(BIO_new_dgram(self._sock.fileno(), BIO_NOCLOSE))
             self._rbio = _BIO(BIO_new_dgram(rsock.fileno(), BIO_NOCLOSE))
-            new_source_rbio = _BIO(BIO_new_dgram(source._rsock.fileno(),
-                                                 BIO_NOCLOSE))
             BIO_dgram_set_peer(self._wbio.value, source._pending_peer_address)
         else:
             self._sock = rsock
             self._wbio = _BIO(BIO_new_dgram(self._sock.fileno(), BIO_NOCLOSE))
             self._rbio = self._wbio
-            new_source_rbio = new_source_wbio
             BIO_dgram_set_connected(self._wbio.value,
                                     source._pending_peer_address)
-        source._ssl = _SSL(SSL_new(self._ctx.value))
-        SSL_set_accept_state(source._ssl.value)
-        source._rbio = new_source_rbio
-        source._wbio = new_source_wbio
-        SSL_set_bio(source._ssl.value,
-                    new_source_rbio.value,
-                    new_source_wbio.value)
-        new_source_rbio.disown()
-        new_source_wbio.disown()
+        if queued_ssl:
+            source._pending_ssl = None
+        else:
+            source._renew_listening_ssl()
+        if self._pmtu_discovery:
+            self._discover_pmtu()
+
+    def _renew_listening_ssl(self):
+        # The listening SSL object's state now belongs to a verified peer;
+        # continue listening with a fresh one
+        if self._udp_demux.pktinfo:
+            new_rbio, new_wbio = self._pktinfo_bios()
+        else:
+            new_wbio = _BIO(BIO_new_dgram(self._sock.fileno(), BIO_NOCLOSE))
+            if hasattr(self, "_rsock"):
+                new_rbio = _BIO(BIO_new_dgram(self._rsock.fileno(),
+                                              BIO_NOCLOSE))
+            else:
+                new_rbio = new_wbio
+        self._ssl = _SSL(SSL_new(self._ctx.value))
+        SSL_set_accept_state(self._ssl.value)
+        self._rbio = new_rbio
+        self._wbio = new_wbio
+        self._wbio_nb = self._rbio_nb = False
+        SSL_set_bio(self._ssl.value, new_rbio.value, new_wbio.value)
+        new_rbio.disown()
+        new_wbio.disown()
+
+    def _pktinfo_bios(self):
+        # With a demux that receives datagrams along with their local
+        # addresses, the listening SSL object is passed each datagram from a
+        # new peer through a memory BIO, and its replies are sent by the
+        # demux from the local address that the datagram was sent to
+        return _BIO(BIO_new(BIO_s_mem())), _BIO(BIO_new(BIO_s_mem()))
 
     def _reconnect_unwrapped(self):
         source = self._sock
@@ -253,15 +576,40 @@ class SSLConnection(object):
         BIO_dgram_set_peer(self._wbio.value, source._peer_address)
         self._ssl = _SSL(SSL_new(self._ctx.value))
         SSL_set_accept_state(self._ssl.value)
+        if self._pmtu_discovery:
+            self._discover_pmtu()
         if self._do_handshake_on_connect:
             return lambda: self.do_handshake()
 
+    def _discover_pmtu(self):
+        if not _PMTU_DISCOVERY:
+            return
+        try:
+            _set_dont_fragment(self._sock)
+        except socket.error as err:
+            _logger.debug("Path MTU discovery unavailable: %s", err)
+            return
+        # The library must neither query nor reset the MTU on its own
+        SSL_set_options(self._ssl.value, SSL_OP_NO_QUERY_MTU)
+        self._pmtu = None
+        self._update_mtu()
+
+    def _update_mtu(self):
+        pmtu = _path_mtu(self._sock, BIO_dgram_get_peer(self._wbio.value))
+        if not pmtu or pmtu == self._pmtu:
+            return
+        mtu = pmtu - _UDP_IP_HEADER_LENGTH.get(self._sock.family, 48)
+        _logger.debug("Applying path MTU %d (DTLS MTU %d)", pmtu, mtu)
+        BIO_dgram_set_mtu(self._wbio.value, mtu)
+        SSL_set_mtu(self._ssl.value, mtu)
+        self._pmtu = pmtu
+
     def _check_nbio(self):
         timeout = self._sock.gettimeout()
         if self._wbio_nb != timeout is not None:
             BIO_set_nbio(self._wbio.value, timeout is not None)
             self._wbio_nb = timeout is not None
-        if self._wbio is not self._rbio:
+        if self._wbio is not self._rbio and hasattr(self, "_rsock"):
             timeout = self._rsock.gettimeout()
             if self._rbio_nb != timeout is not None:
                 BIO_set_nbio(self._rbio.value, timeout is not None)
@@ -269,6 +617,8 @@ class SSLConnection(object):
         return timeout  # read channel timeout
 
     def _wrap_socket_library_call(self, call, timeout_error):
+        if self._mux:
+            return self._wrap_muxed_call(call, timeout_error)
         timeout_sec_start = timeout_sec = self._check_nbio()
         # Pass the call if the socket is blocking or non-blocking
         if not timeout_sec:  # None (blocking) or zero (non-blocking)
@@ -291,12 +641,43 @@ class SSLConnection(object):
                 raise
         raise_ssl_error(timeout_error)
 
+    def _wrap_muxed_call(self, call, timeout_error):
+        # The shared socket is non-blocking, and the mux's timeout applies;
+        # while waiting, the library's retransmission timer is serviced,
+        # since no datagram BIO read times out on the library's behalf
+        self._check_nbio()
+        timeout = self._mux.timeout
+        if timeout is not None:
+            deadline = datetime.datetime.now() + \
+              datetime.timedelta(seconds=timeout)
+        while True:
+            try:
+                return call()
+            except openssl_error() as err:
+                if err.ssl_error != SSL_ERROR_WANT_READ or timeout == 0:
+                    raise
+            wait = self._ssl.fast.get_timeout()
+            if timeout is not None:
+                remaining = deadline - datetime.datetime.now()
+                if remaining <= datetime.timedelta(0):
+                    raise_ssl_error(timeout_error)
+                wait = min(wait, remaining) if wait is not None else remaining
+            if wait is not None:
+                wait = wait.total_seconds()
+            if not self._mux._receive(self._datagrams, wait):
+                self._ssl.fast.handle_timeout()
+
     def _get_cookie(self, ssl):
-        assert self._listening
-        assert self._ssl.raw == ssl.raw
-        if self._listening_peer_address:
+        if self._ssl.raw != ssl.raw:
+            # As of OpenSSL 1.1.1, DTLSv1_listen buffers the ClientHello that
+            # carried a valid cookie, and its cookie is verified again when an
+            # accepted connection processes it. That connection's write BIO
+            # is pointed at its peer.
+            peer_address = BIO_dgram_get_peer(SSL_get_wbio(ssl))
+        elif self._listening_peer_address:
             peer_address = self._listening_peer_address
         else:
+            assert self._listening
             peer_address = BIO_dgram_get_peer(self._rbio.value)
         cookie_hmac = hmac.new(self._rnd_key, str(peer_address))
         return cookie_hmac.digest()
@@ -310,34 +691,98 @@ class SSLConnection(object):
 
     def __init__(self, sock, keyfile=None, certfile=None,
                  server_side=False, cert_reqs=CERT_NONE,
-                 ssl_version=PROTOCOL_DTLSv1, ca_certs=None,
+                 ssl_version=PROTOCOL_DTLS, ca_certs=None,
                  do_handshake_on_connect=True,
-                 suppress_ragged_eofs=True, ciphers=None):
+                 suppress_ragged_eofs=True, ciphers=None, psk=None,
+                 curves=None, dh_params=None, cipher_probe=False,
+                 pmtu_discovery=False, gro=False, classifier=None,
+                 srtp_profiles=None):
         """Constructor
 
         Arguments:
-        these arguments match the ones of the SSLSocket class in the
+        psk -- pre-shared key configuration: for clients, a pair of identity
+               string and binary key; for servers, a psk.PSKStore or another
+               object whose get method maps client identities to keys. A
+               server configured with pre-shared keys does not require a
+               certificate, and unless ciphers is given, connections without
+               certificates are restricted to plain PSK key exchange, which
+               performs no public-key operations
+        curves -- colon-separated list of elliptic curves for ECDHE key
+                  exchange in order of preference, e.g., "X25519:P-256";
+                  requires OpenSSL 1.0.2 or later. If None, the library's
+                  default curves are used; X25519 is among them as of
+                  OpenSSL 1.1.0
+        dh_params -- server-side only: name of a file containing
+                     PEM-encoded DH parameters, which are parsed once and
+                     then shared among all connections, or "auto" for the
+                     library's built-in parameters (OpenSSL 1.1.0 and
+                     later). DHE key exchange is disabled if None
+        cipher_probe -- if True, the cipher list is ordered by the record
+                        throughput that its bulk ciphers achieve on this host,
+                        fastest first, and servers select suites by this
+                        order instead of the client's; see cipherprobe. A
+                        string instead names the file that caches the
+                        measurements
+        pmtu_discovery -- if True, datagrams are sent with the
+                          don't-fragment bit set, and the DTLS MTU follows
+                          the kernel's path MTU estimate for the peer
+                          (Linux only); see max_payload
+        gro -- if True, connected sockets receive through UDP generic
+               receive offload once the handshake has completed, and so does
+               the root socket of a routing demux (Linux 5.0 and OpenSSL
+               1.1.0 or later): one system call receives the datagrams that
+               the kernel coalesced, which are passed to the library one at a
+               time; see the gro module
+        classifier -- listening server-side only: a function called with
+                      each datagram that arrives at the listening socket and
+                      its sender's address, which returns whether the
+                      datagram is DTLS; see demux.classify.PacketClassifier.
+                      A routing demux is used, so that datagrams of other
+                      protocols never reach the library
+        srtp_profiles -- colon-separated list of DTLS-SRTP protection
+                         profiles to negotiate (RFC 5764) in order of
+                         preference, e.g., "SRTP_AES128_CM_SHA1_80"; see
+                         srtp_profile and export_keying_material
+        the remaining arguments match the ones of the SSLSocket class in the
         standard library's ssl module
         """
 
         if keyfile and not certfile or certfile and not keyfile:
             raise_ssl_error(ERR_BOTH_KEY_CERT_FILES)
-        if server_side and not keyfile:
+        if server_side and not keyfile and not psk:
             raise_ssl_error(ERR_BOTH_KEY_CERT_FILES_SVR)
         if cert_reqs != CERT_NONE and not ca_certs:
             raise_ssl_error(ERR_NO_CERTS)
 
         if not ciphers:
-            ciphers = "DEFAULT"
+            if not psk:
+                ciphers = "DEFAULT"
+            elif certfile:
+                ciphers = "DEFAULT:kPSK"
+            else:
+                ciphers = "kPSK"
 
         self._sock = sock
         self._keyfile = keyfile
         self._certfile = certfile
         self._cert_reqs = cert_reqs
+        self._ssl_version = ssl_version
         self._ca_certs = ca_certs
         self._do_handshake_on_connect = do_handshake_on_connect
         self._suppress_ragged_eofs = suppress_ragged_eofs
         self._ciphers = ciphers
+        self._psk = psk
+        self._curves = curves
+        self._dh_params = dh_params
+        self._cipher_probe = cipher_probe
+        self._pmtu_discovery = pmtu_discovery
+        self._pmtu = None
+        self._gro = gro
+        self._gro_receiver = None
+        self._classifier = classifier
+        self._srtp_profiles = srtp_profiles
+        self._datagrams = deque()  # fed to the library through a memory BIO
+        self._mux = None
         self._handshake_done = False
         self._wbio_nb = self._rbio_nb = False
 
@@ -345,6 +790,8 @@ class SSLConnection(object):
             post_init = self._copy_server()
         elif isinstance(sock, _UnwrappedSocket):
             post_init = self._reconnect_unwrapped()
+        elif isinstance(sock, _MuxedPeer):
+            post_init = self._init_muxed(sock)
         else:
             try:
                 peer_address = sock.getpeername()
@@ -376,6 +823,47 @@ class SSLConnection(object):
             return self._rsock
         return self._sock
 
+    def get_drops(self):
+        """Retrieve the number of datagrams dropped on receipt
+
+        Server-side connections report the datagrams that the kernel dropped
+        from the receive queues of all sockets of their demux, because these
+        queues were full; client-side connections report the drops of their
+        own socket.
+
+        Return value:
+        number of dropped datagrams, or None if the platform does not report
+        drops
+        """
+
+        if hasattr(self, "_udp_demux"):
+            return self._udp_demux.drops
+        from demux.buffers import kernel_drops
+        return kernel_drops(self.get_socket(True))
+
+    def start_pump(self):
+        """Forward datagrams to accepted connections in the background
+
+        With a routing demux, datagrams reach accepted connections only while
+        the demux is serviced, which the listen method does. This method
+        starts a thread that services the demux continuously, such that
+        accepted connections can be read in blocking mode without concurrent
+        calls to listen, which continues to return new peers. The thread
+        terminates when stop_pump is called or the socket is closed. Where
+        the network stack demultiplexes, this method has no effect.
+        """
+
+        if not hasattr(self, "_listening"):
+            raise InvalidSocketError("start_pump called on non-listening " +
+                                     "socket")
+        self._udp_demux.start_pump()
+
+    def stop_pump(self):
+        """Terminate the thread started by start_pump"""
+
+        if hasattr(self, "_listening"):
+            self._udp_demux.stop_pump()
+
     def listen(self):
         """Server-side cookie exchange
 
@@ -397,6 +885,68 @@ class SSLConnection(object):
         if not hasattr(self, "_listening"):
             raise InvalidSocketError("listen called on non-listening socket")
 
+        self._check_nbio()
+        return self._listen()
+
+    def listen_many(self, max=None):
+        """Server-side cookie exchange with all waiting peers
+
+        This method reads datagrams from the socket until none remain, either
+        on the socket or held by the demux, or max new peers have concluded
+        the cookie exchange. Datagrams for known peers are forwarded as by the
+        listen method. The socket is read without blocking, regardless of its
+        configured timeout. Each verified peer's handshake state is retained,
+        and subsequent calls to the accept method return connections to these
+        peers in the order of their verification, before listening for further
+        peers. A peer that is verified again while its state is retained, as
+        happens when it retransmits its ClientHello, is not returned a second
+        time.
+
+        Arguments:
+        max -- maximum number of new peers to verify, or None for no limit
+
+        Return value:
+        list of the addresses of newly verified peers
+        """
+
+        if not hasattr(self, "_listening"):
+            raise InvalidSocketError("listen called on non-listening socket")
+
+        peers = []
+        root = self._sock
+        rsock = self.get_socket(True)
+        timeouts = root.gettimeout(), rsock.gettimeout()
+        root.setblocking(False)
+        rsock.setblocking(False)
+        try:
+            self._check_nbio()
+            while max is None or len(peers) < max:
+                if not self._udp_demux.pending and \
+                  not select([root], [], [], 0)[0]:
+                    break
+                peer_address = self._listen()
+                if not peer_address:
+                    continue
+                verified = peer_address, self._ssl
+                self._pending_peer_address = None
+                self._renew_listening_ssl()
+                self._check_nbio()
+                for index, queued in enumerate(self._verified_peers):
+                    if queued[0] == peer_address:
+                        # A retransmission of the ClientHello that carried
+                        # the cookie: the newer state supersedes the queued
+                        self._verified_peers[index] = verified
+                        break
+                else:
+                    self._verified_peers.append(verified)
+                    peers.append(peer_address)
+        finally:
+            root.settimeout(timeouts[0])
+            rsock.settimeout(timeouts[1])
+        _logger.debug("Verified %d new peers", len(peers))
+        return peers
+
+    def _listen(self):
         self._pending_peer_address = None
         try:
             peer_address = self._udp_demux.service()
@@ -413,13 +963,24 @@ class SSLConnection(object):
             return
 
         # The demux advises that a datagram from a new peer may have arrived
-        if type(peer_address) is tuple:
+        pktinfo = self._udp_demux.pktinfo
+        if pktinfo:
+            # The demux has received the datagram
+            pending = BIO_ctrl_pending(self._rbio.value)
+            if pending:
+                BIO_read(self._rbio.value, pending)  # an unprocessed remnant
+            BIO_write(self._rbio.value, self._udp_demux.payload)
+            self._listening_peer_address = peer_address
+        elif type(peer_address) is tuple:
             # For this type of demux, the write BIO must be pointed at the peer
             BIO_dgram_set_peer(self._wbio.value, peer_address)
+            if OPENSSL_1_1_API:
+                # DTLSv1_listen points the write BIO at the read BIO's peer;
+                # without this, that would be the demux's forwarding socket
+                BIO_dgram_set_connected(self._rbio.value, peer_address)
             self._udp_demux.forward()
             self._listening_peer_address = peer_address
 
-        self._check_nbio()
         self._listening = True
         try:
             _logger.debug("Invoking DTLSv1_listen for ssl: %d",
@@ -430,7 +991,8 @@ class SSLConnection(object):
                 # This method must be called again to forward the next datagram
                 _logger.debug("DTLSv1_listen must be resumed")
                 return
-            elif err.errqueue and err.errqueue[0][0] == ERR_COOKIE_MISMATCH:
+            elif err.errqueue and \
+              err.errqueue.codes[0] == ERR_COOKIE_MISMATCH:
                 _logger.debug("Mismatching cookie received; aborting handshake")
                 return
             _logger.exception("Unexpected error in DTLSv1_listen")
@@ -438,6 +1000,10 @@ class SSLConnection(object):
         finally:
             self._listening = False
             self._listening_peer_address = None
+            pending = pktinfo and BIO_ctrl_pending(self._wbio.value)
+            if pending:
+                self._udp_demux.sendto(BIO_read(self._wbio.value, pending),
+                                       peer_address)
         if type(peer_address) is tuple:
             _logger.debug("New local peer: %s", dtls_peer_address)
             self._pending_peer_address = peer_address
@@ -451,28 +1017,36 @@ class SSLConnection(object):
 
         This method returns a server-side SSLConnection object, connected to
         that peer most recently returned from the listen method and not yet
-        connected. If there is no such peer, then the listen method is invoked.
+        connected, or else to the peer verified earliest by the listen_many
+        method and not yet connected. If there is no such peer, then the
+        listen method is invoked.
 
         Return value: SSLConnection connected to a new peer, None if packet
         forwarding only to an existing peer occurred.
         """
 
+        if not self._pending_peer_address and self._verified_peers:
+            self._pending_peer_address, self._pending_ssl = \
+              self._verified_peers.popleft()
         if not self._pending_peer_address:
             if not self.listen():
                 _logger.debug("Accept returning without connection")
                 return
         new_conn = SSLConnection(self, self._keyfile, self._certfile, True,
-                                 self._cert_reqs, PROTOCOL_DTLSv1,
+                                 self._cert_reqs, self._ssl_version,
                                  self._ca_certs, self._do_handshake_on_connect,
-                                 self._suppress_ragged_eofs, self._ciphers)
+                                 self._suppress_ragged_eofs, self._ciphers,
+                                 self._psk, self._curves, self._dh_params,
+                                 self._cipher_probe, self._pmtu_discovery,
+                                 self._gro)
         new_peer = self._pending_peer_address
         self._pending_peer_address = None
         if self._do_handshake_on_connect:
             # Note that since that connection's socket was just created in its
             # constructor, the following operation must be blocking; hence
             # handshake-on-connect can only be used with a routing demux if
-            # listen is serviced by a separate application thread, or else we
-            # will hang in this call
+            # listen is serviced by a separate application thread or the
+            # demux pump is running, or else we will hang in this call
             new_conn.do_handshake()
         _logger.debug("Accept returning new connection for new peer")
         return new_conn, new_peer
@@ -492,6 +1066,8 @@ class SSLConnection(object):
         peer_address = self._sock.getpeername()  # substituted host addrinfo
         BIO_dgram_set_connected(self._wbio.value, peer_address)
         assert self._wbio is self._rbio
+        if self._pmtu_discovery:
+            self._discover_pmtu()
         if self._do_handshake_on_connect:
             self.do_handshake()
 
@@ -505,7 +1081,7 @@ class SSLConnection(object):
         _logger.debug("Initiating handshake...")
         try:
             self._wrap_socket_library_call(
-                lambda: SSL_do_handshake(self._ssl.value),
+                self._reader(lambda: SSL_do_handshake(self._ssl.value), False),
                 ERR_HANDSHAKE_TIMEOUT)
         except openssl_error() as err:
             if err.ssl_error == SSL_ERROR_SYSCALL and err.result == -1:
@@ -525,13 +1101,40 @@ class SSLConnection(object):
         string containing read bytes
         """
 
+        if self._paced:
+            return self._paced.recv(len)
+        return self._wrap_socket_library_call(
+            self._reader(lambda: self._ssl.fast.read(len)), ERR_READ_TIMEOUT)
+
+    def read_into(self, buffer, len=None):
+        """Read data from connection into a buffer
+
+        Read up to len bytes into the given buffer, without creating an
+        intermediate string.
+
+        Arguments:
+        buffer -- bytearray receiving the data
+        len -- maximum number of bytes to read; the buffer's length if None
+
+        Return value:
+        number of bytes read
+        """
+
+        if len is None:
+            len = buffer.__len__()
+        if self._paced:
+            data = self._paced.recv(len)
+            buffer[:data.__len__()] = data
+            return data.__len__()
         return self._wrap_socket_library_call(
-            lambda: SSL_read(self._ssl.value, len), ERR_READ_TIMEOUT)
+            self._reader(lambda: self._ssl.fast.read_into(buffer, len)),
+            ERR_READ_TIMEOUT)
 
     def write(self, data):
         """Write data to connection
 
-        Write data as string of bytes.
+        Write data as string of bytes. The contents of a bytearray are
+        encrypted in place, without an intermediate copy.
 
         Arguments:
         data -- buffer containing data to be written
@@ -540,8 +1143,297 @@ class SSLConnection(object):
         number of bytes actually transmitted
         """
 
+        if self._paced:
+            return self._paced.send(data)
         return self._wrap_socket_library_call(
-            lambda: SSL_write(self._ssl.value, data), ERR_WRITE_TIMEOUT)
+            lambda: self._ssl.fast.write(data), ERR_WRITE_TIMEOUT)
+
+    def start_pacing(self, **kwargs):
+        """Pace written datagrams at a rate adapted to the peer's feedback
+
+        Both peers must call this method to enter the paced sending mode. In
+        this mode, write sends its data as one datagram once the pacing rate
+        permits, and read and read_into return the datagrams that the peer
+        writes; feedback records are exchanged while they wait. The sockets
+        are placed into non-blocking mode. try_read and try_write return
+        WANT_READ while no datagram has arrived and WANT_WRITE while the
+        pacing rate does not yet admit the datagram, respectively, and
+        write_batch writes each datagram as write does.
+
+        Arguments:
+        kwargs -- arguments of dtls.PacedConnection's constructor, such as
+                  initial_rate, max_rate and timeout
+
+        Return value:
+        the PacedConnection through which the connection now sends and
+        receives; its attributes report the sending rate, the achieved rate
+        and the loss
+        """
+
+        if not self._paced:
+            self._paced = PacedConnection(_UnpacedRecords(self), **kwargs)
+        return self._paced
+
+    def enable_gro(self):
+        """Receive through UDP generic receive offload
+
+        This method has the effect of the constructor's gro argument on
+        connected sockets, for connections whose constructor was not given
+        it, such as those created through the patched ssl module. It must be
+        called before the first read after the handshake. Connections that a
+        listening connection accepts afterwards inherit the setting; its
+        routing demux's root socket does not receive through the offload.
+        """
+
+        if not self._gro_receiver:
+            self._gro = True
+
+    def write_batch(self, datagrams):
+        """Write a sequence of datagrams
+
+        Each string is written as one record, as with write. On Linux, with
+        OpenSSL 1.1.0 or later, runs of equally long strings written through
+        a connected socket are encrypted into a single buffer, which the
+        kernel splits into datagrams through UDP segmentation offload: one
+        system call sends up to 64 records. Where the offload is unavailable,
+        records are sent one at a time.
+
+        Arguments:
+        datagrams -- iterable of non-empty strings, each of which fits into
+                     a record (see max_payload)
+
+        Return value:
+        number of records written
+        """
+
+        if self._gso is None:
+            try:
+                self._sock.getpeername()
+            except socket.error:
+                self._gso = False  # a routing demux's shared root socket
+            else:
+                self._gso = _UDP_GSO
+        count = 0
+        for batch in _gso_batches(datagrams):
+            if len(batch) > 1 and self._gso and not self._paced:
+                self._send_records(*self._encrypt_records(batch))
+            else:
+                for datagram in batch:
+                    self.write(datagram)
+            count += len(batch)
+        return count
+
+    def _encrypt_records(self, datagrams):
+        # Direct the records into a memory BIO in place of the datagram BIO
+        ssl = self._ssl.value
+        wbio = SSL_get_wbio(ssl)
+        BIO_up_ref(wbio)
+        SSL_set0_wbio(ssl, BIO_new(BIO_s_mem()))
+        try:
+            mem = SSL_get_wbio(ssl)
+            write = self._ssl.fast.write
+            # Records of equally long plaintexts are equally long
+            write(datagrams[0])
+            segment = BIO_ctrl_pending(mem)
+            for datagram in datagrams[1:-1]:
+                write(datagram)
+            runs = BIO_ctrl_pending(mem)
+            write(datagrams[-1])
+            total = BIO_ctrl_pending(mem)
+            if runs != segment * (len(datagrams) - 1) or \
+              total - runs > segment:
+                segment = None  # records cannot be segmented uniformly
+            return BIO_read(mem, total), segment
+        finally:
+            SSL_set0_wbio(ssl, wbio)
+
+    def _send_records(self, buf, segment):
+        if self._gso and segment:
+            try:
+                self._sock.setsockopt(_SOL_UDP, _UDP_SEGMENT, segment)
+                try:
+                    self._send_datagram(buf)
+                    return
+                finally:
+                    self._sock.setsockopt(_SOL_UDP, _UDP_SEGMENT, 0)
+            except socket.error as err:
+                if err.errno not in _GSO_UNSUPPORTED:
+                    raise
+                _logger.info("UDP segmentation offload unavailable: %s", err)
+                self._gso = False
+        offset = 0
+        while offset < len(buf):
+            # DTLS record length field, following the 11 header bytes of
+            # type, version, epoch and sequence number
+            size = DTLS1_RT_HEADER_LENGTH + \
+              (ord(buf[offset + 11]) << 8 | ord(buf[offset + 12]))
+            self._send_datagram(buf[offset:offset + size])
+            offset += size
+
+    def _send_datagram(self, datagram):
+        # The records have been encrypted, and must be sent regardless of
+        # the socket's blocking mode
+        while True:
+            try:
+                return self._sock.send(datagram)
+            except socket.error as err:
+                if err.errno != errno.EWOULDBLOCK:
+                    raise
+                select([], [self._sock], [], None)
+
+    def _gro_active(self):
+        # Receive offload starts with the first read after the handshake,
+        # which reads may also have performed implicitly
+        if not self._gro_receiver:
+            if _UDP_GRO and not SSL_is_init_finished(self._ssl.value):
+                return False
+            self._start_gro()
+        return self._gro
+
+    def _start_gro(self):
+        self._gro = False
+        if not _UDP_GRO:
+            return
+        rsock = self.get_socket(True)
+        try:
+            rsock.getpeername()  # the socket must receive from the peer only
+            receiver = GROReceiver(rsock)
+        except socket.error as err:
+            _logger.info("UDP generic receive offload unavailable: %s", err)
+            return
+        # Records are read from a memory BIO; the datagram BIO is retained,
+        # since the socket's blocking mode is applied to it
+        BIO_up_ref(self._rbio.value)
+        self._rbio.owned = True
+        rbio = BIO_new(BIO_s_mem())
+        SSL_set0_rbio(self._ssl.value, rbio)
+        self._ssl.fast.set_feed(rbio.raw, self._datagrams)
+        self._gro_receiver = receiver
+        self._gro = True
+
+    def _fed_receiver(self):
+        # The function that receives datagrams for the memory BIO, if records
+        # are read from one; it returns False if none are available without
+        # blocking
+        if self._mux:
+            return lambda: self._mux._receive(self._datagrams, 0)
+        if self._gro and self._gro_active():
+            return self._receive_gro
+
+    def _reader(self, call, feeds=True):
+        # Wrap a library call that reads, such that it receives datagrams for
+        # the memory BIO when the library has consumed the received ones; the
+        # fast path's read methods pass them to the library, and the fast
+        # path's feed method does so for other calls
+        receive = self._fed_receiver()
+        if not receive:
+            return call
+        def fed_call():
+            while True:
+                if not feeds:
+                    self._ssl.fast.feed()
+                try:
+                    return call()
+                except openssl_error() as err:
+                    if err.ssl_error != SSL_ERROR_WANT_READ or not receive():
+                        raise
+        return fed_call
+
+    def _receive_gro(self):
+        # False if no datagram is available without blocking
+        try:
+            segments, address = self._gro_receiver.recvfrom(False)
+        except socket.error as err:
+            if err.errno == errno.EWOULDBLOCK:
+                return False
+            if err.errno == errno.ECONNREFUSED:
+                raise_ssl_error(ERR_PORT_UNREACHABLE, err)
+            raise
+        self._datagrams.extend(segments)
+        return True
+
+    def try_handshake(self):
+        """Perform a non-blocking handshake step without raising
+
+        This method is intended for non-blocking sockets. It advances the
+        handshake as far as the available datagrams allow. Where do_handshake
+        would raise an exception with SSL_ERROR_WANT_READ or
+        SSL_ERROR_WANT_WRITE, this method instead returns the corresponding
+        status sentinel, without retrieving OpenSSL's error queue. Other
+        errors are raised as with do_handshake.
+
+        Return value:
+        None if the handshake has completed, WANT_READ or WANT_WRITE if it
+        must be resumed
+        """
+
+        self._check_nbio()
+        receive = self._fed_receiver()
+        try:
+            while True:
+                if receive:
+                    self._ssl.fast.feed()
+                status = self._ssl.fast.try_handshake()
+                if status is not WANT_READ or not receive or not receive():
+                    break
+        except openssl_error() as err:
+            if err.ssl_error == SSL_ERROR_SYSCALL and err.result == -1:
+                raise_ssl_error(ERR_PORT_UNREACHABLE, err)
+            raise
+        if not status:
+            self._handshake_done = True
+            _logger.debug("...completed handshake")
+        return status
+
+    def try_read(self, len=1024):
+        """Read data from connection without raising continuation requests
+
+        This method is intended for non-blocking sockets. It behaves like
+        read, except that it returns WANT_READ or WANT_WRITE where read would
+        raise an exception for either of these conditions.
+
+        Arguments:
+        len -- maximum number of bytes to read
+
+        Return value:
+        string containing read bytes, or WANT_READ or WANT_WRITE
+        """
+
+        if self._paced:
+            return self._paced.try_recv(len)
+        return self._try_read(len)
+
+    def _try_read(self, len):
+        self._check_nbio()
+        receive = self._fed_receiver()
+        if not receive:
+            return self._ssl.fast.try_read(len)
+        while True:
+            data = self._ssl.fast.try_read(len)
+            if data is not WANT_READ or not receive():
+                return data
+
+    def try_write(self, data):
+        """Write data to connection without raising continuation requests
+
+        This method is intended for non-blocking sockets. It behaves like
+        write, except that it returns WANT_READ or WANT_WRITE where write
+        would raise an exception for either of these conditions.
+
+        Arguments:
+        data -- buffer containing data to be written
+
+        Return value:
+        number of bytes actually transmitted, or WANT_READ or WANT_WRITE
+        """
+
+        if self._paced:
+            return self._paced.try_send(data)
+        return self._try_write(data)
+
+    def _try_write(self, data):
+        self._check_nbio()
+        return self._ssl.fast.try_write(data)
 
     def shutdown(self):
         """Shut down the DTLS connection
@@ -557,7 +1449,8 @@ class SSLConnection(object):
 
         try:
             self._wrap_socket_library_call(
-                lambda: SSL_shutdown(self._ssl.value), ERR_READ_TIMEOUT)
+                self._reader(lambda: SSL_shutdown(self._ssl.value), False),
+                ERR_READ_TIMEOUT)
         except openssl_error() as err:
             if err.result == 0:
                 # close-notify alert was just sent; wait for same from peer
@@ -566,9 +1459,20 @@ class SSLConnection(object):
                 # failure (ret: -1, SSL_ERROR_SYSCALL) on the DTLS shutdown
                 # initiator side. And test_starttls does pass.
                 self._wrap_socket_library_call(
-                    lambda: SSL_shutdown(self._ssl.value), ERR_READ_TIMEOUT)
+                    self._reader(lambda: SSL_shutdown(self._ssl.value),
+                                 False),
+                    ERR_READ_TIMEOUT)
             else:
                 raise
+        if self._gro_receiver:
+            # Subsequent readers of the socket expect single datagrams
+            self._gro_receiver.close()
+            self._gro_receiver = None
+            self._gro = False
+        if self._mux:
+            # The mux's socket remains shared with its other connections
+            self._mux._remove(self)
+            return
         if hasattr(self, "_rsock"):
             # Return wrapped connected server socket (non-listening)
             return _UnwrappedSocket(self._sock, self._rsock, self._udp_demux,
@@ -622,6 +1526,125 @@ class SSLConnection(object):
         cipher_bits = SSL_CIPHER_get_bits(current_cipher)
         return cipher_name, cipher_version, cipher_bits
 
+    def max_payload(self):
+        """Retrieve the maximum length of a write
+
+        Return the largest number of bytes that a single write can send in a
+        record that fits within the MTU, and therefore in a datagram that
+        does not undergo IP fragmentation. With path MTU discovery, the
+        kernel's current estimate is applied first; a write that fails
+        because the estimate has been lowered in the meantime can be retried
+        with the then smaller length. Return None if handshaking has not
+        been completed, or if the MTU cannot be determined.
+        """
+
+        if not self._handshake_done:
+            return
+
+        if self._pmtu is not None:
+            self._update_mtu()
+        if DTLS_OPENSSL_VERSION_NUMBER >= 0x10101000:
+            payload = DTLS_get_data_mtu(self._ssl.value)
+        else:
+            # Connections that were accepted after the library determined
+            # the MTU through the listening BIO have not stored it in theirs
+            mtu = BIO_dgram_get_mtu(self._wbio.value) or \
+              BIO_dgram_query_mtu(self._wbio.value) or \
+              BIO_dgram_get_fallback_mtu(self._wbio.value)
+            payload = _record_payload(
+                mtu, SSL_CIPHER_get_description(
+                    SSL_get_current_cipher(self._ssl.value)))
+        if payload > 0:
+            return min(payload, SSL3_RT_MAX_PLAIN_LENGTH)
+
+    def psk_identity(self):
+        """Retrieve the pre-shared key identity
+
+        Return the identity string the client presented for a pre-shared key
+        cipher suite. Return None if handshaking has not been completed, or if
+        the negotiated cipher suite does not use a pre-shared key.
+        """
+
+        if not self._handshake_done:
+            return
+
+        return SSL_get_psk_identity(self._ssl.value)
+
+    def srtp_profile(self):
+        """Retrieve the negotiated DTLS-SRTP protection profile
+
+        Return the name of the profile that the peers agreed upon for
+        protecting media with SRTP, e.g., "SRTP_AES128_CM_SHA1_80". Return
+        None if handshaking has not been completed, or if no profile was
+        negotiated.
+        """
+
+        if not self._handshake_done:
+            return
+
+        return SSL_get_selected_srtp_profile(self._ssl.value)
+
+    def export_keying_material(self, label, length, context=None):
+        """Export keying material (RFC 5705)
+
+        Derive keying material from the connection's master secret, which
+        both peers obtain identically. DTLS-SRTP applications derive their
+        SRTP master keys and salts with the label "EXTRACTOR-dtls_srtp" and
+        no context (RFC 5764), and thereafter protect media packets with
+        SRTP instead of with DTLS records.
+
+        Arguments:
+        label -- string identifying the material's purpose
+        length -- number of bytes to export
+        context -- string to mix into the derivation, or None for none,
+                   which differs from the empty string
+
+        Return value:
+        string of length bytes; None if handshaking has not been completed
+        """
+
+        if not self._handshake_done:
+            return
+
+        return SSL_export_keying_material(self._ssl.value, label, length,
+                                          context)
+
+    def get_session(self):
+        """Retrieve the established session
+
+        Return an opaque session object that can be passed to the set_session
+        method of a new client-side connection to the same server peer, so
+        that the latter's handshake resumes this session instead of performing
+        a full key exchange. Return None if no session has been established.
+        """
+
+        try:
+            return _SESSION(SSL_get1_session(self._ssl.value))
+        except openssl_error():
+            return
+
+    def set_session(self, session):
+        """Offer a previously established session for resumption
+
+        This method must be called before the handshake is performed. The
+        server peer may decline the offered session, in which case a full
+        handshake occurs.
+
+        Arguments:
+        session -- a session object previously returned from get_session
+        """
+
+        SSL_set_session(self._ssl.value, session.value)
+
+    def session_reused(self):
+        """Report whether the handshake resumed an offered session
+
+        Return True if the most recent handshake was an abbreviated one
+        that resumed the session passed to set_session, False otherwise.
+        """
+
+        return SSL_session_reused(self._ssl.value)
+
     def pending(self):
         """Retrieve number of buffered bytes
 
@@ -629,7 +1652,7 @@ class SSLConnection(object):
         buffered by this connection. Return 0 if no bytes have been buffered.
         """
 
-        return SSL_pending(self._ssl.value)
+        return self._ssl.fast.pending()
 
     def get_timeout(self):
         """Retrieve the retransmission timedelta
@@ -643,7 +1666,7 @@ class SSLConnection(object):
         if no such callback is needed given the current handshake state.
         """
 
-        return DTLSv1_get_timeout(self._ssl.value)
+        return self._ssl.fast.get_timeout()
 
     def handle_timeout(self):
         """Perform datagram retransmission, if required
@@ -661,7 +1684,37 @@ class SSLConnection(object):
         Raised when retransmissions fail or too many timeouts occur.
         """
 
-        return DTLSv1_handle_timeout(self._ssl.value)
+        return self._ssl.fast.handle_timeout()
+
+
+class _UnpacedRecords(object):
+    """Record access of an SSLConnection's pacing layer
+
+    The layer reads and writes its records through this object, whose
+    try_read and try_write methods bypass the pacing that the connection's
+    own methods apply.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def try_read(self, len):
+        return self._conn._try_read(len)
+
+    def try_write(self, data):
+        return self._conn._try_write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _MuxedPeer(object):
+    """Peer of a client-side connection sharing the socket of a ClientMux"""
+
+    def __init__(self, mux, sock, address):
+        self.mux = mux
+        self.sock = sock
+        self.address = address
 
 
 class _UnwrappedSocket(socket.socket):
@@ -27,6 +27,7 @@ import dtls
 import dtls.err
 import dtls.util
 import dtls.sslconnection
+import dtls.pool
 import dtls.x509
 import dtls.openssl
 import dtls.demux
@@ -37,6 +38,7 @@ def main():
     reload(dtls.err)
     reload(dtls.util)
     reload(dtls.sslconnection)
+    reload(dtls.pool)
     reload(dtls.x509)
     reload(dtls.openssl)
     reload(dtls.demux)
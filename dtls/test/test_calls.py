@@ -0,0 +1,116 @@
+# Library call overhead microbenchmark for PyDTLS.
+
+# Copyright 2012 Ray Brown
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# The License is also distributed with this work in the file named "LICENSE."
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""PyDTLS library call microbenchmark
+
+This module measures the per-call overhead of the OpenSSL functions that are
+invoked for every datagram. Each function is timed through its general
+binding, which converts parameters through the FuncParam protocol and runs
+Python-level error checking, and through its hot-path binding, which passes
+raw pointers and preallocated argument structures.
+
+SSL_pending, SSL_get_error and the timeout control perform almost no work in
+the library, so that their timings approximate pure binding overhead.
+SSL_write and SSL_read are timed as a round trip of one record over an
+established loopback connection.
+"""
+
+import socket
+import sys
+import threading
+from argparse import ArgumentParser
+from os import path
+from timeit import timeit
+from dtls.sslconnection import SSLConnection
+import dtls.openssl as openssl
+
+CERTFILE = path.join(path.dirname(__file__), "certs", "keycert.pem")
+CALLS = 200000
+ROUND_TRIPS = 20000
+PAYLOAD = "x" * 100
+
+def connected_pair():
+    """Create a client and a server connection with completed handshakes"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    listener = SSLConnection(sock, keyfile=CERTFILE, certfile=CERTFILE,
+                             server_side=True)
+    accepted = []
+    def accept():
+        while not accepted:
+            acc_ret = listener.accept()
+            if acc_ret:
+                accepted.append(acc_ret[0])
+    thread = threading.Thread(target=accept)
+    thread.start()
+    client = SSLConnection(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    client.connect(sock.getsockname())
+    thread.join()
+    return client, accepted[0], listener
+
+def report(name, general, fast, count):
+    general_us = general * 1e6 / count
+    fast_us = fast * 1e6 / count
+    print "%-16s general: %7.3f us  hot-path: %7.3f us  saved: %5.1f%%" % (
+        name, general_us, fast_us, 100 * (general_us - fast_us) / general_us)
+
+def run(calls, round_trips):
+    print "Hot-path backend: " + openssl.BACKEND
+    client, server, listener = connected_pair()
+    ssl = client._ssl.value
+    fast = client._ssl.fast
+
+    # Bind general functions before timing them
+    openssl.SSL_pending(ssl)
+    openssl._SSL_get_error(ssl, 1)
+    SSL_pending = openssl.SSL_pending
+    _SSL_get_error = openssl._SSL_get_error
+    DTLSv1_get_timeout = openssl.DTLSv1_get_timeout
+    SSL_read = openssl.SSL_read
+    SSL_write = openssl.SSL_write
+
+    report("SSL_pending",
+           timeit(lambda: SSL_pending(ssl), number=calls),
+           timeit(fast.pending, number=calls), calls)
+    report("SSL_get_error",
+           timeit(lambda: _SSL_get_error(ssl, 1), number=calls),
+           timeit(lambda: fast.get_error(1), number=calls), calls)
+    report("get_timeout",
+           timeit(lambda: DTLSv1_get_timeout(ssl), number=calls),
+           timeit(fast.get_timeout, number=calls), calls)
+
+    server_ssl = server._ssl.value
+    server_fast = server._ssl.fast
+    def general_round_trip():
+        SSL_write(ssl, PAYLOAD)
+        SSL_read(server_ssl, 1024)
+    def fast_round_trip():
+        fast.write(PAYLOAD)
+        server_fast.read(1024)
+    report("write/read",
+           timeit(general_round_trip, number=round_trips),
+           timeit(fast_round_trip, number=round_trips), round_trips)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--calls", type=int, default=CALLS,
+                        help="number of calls per binding")
+    parser.add_argument("-r", "--round-trips", type=int, default=ROUND_TRIPS,
+                        help="number of record round trips per binding")
+    args = parser.parse_args()
+    run(args.calls, args.round_trips)
@@ -25,6 +25,13 @@ PyDTLS package. Throughput for the following transports can be compared:
     * PyDTLS datagram transport
     * PyDTLS datagram transport with thread locking callbacks disabled
     * PyDTLS datagram transport with demux type forced to routing demux
+    * PyDTLS reliable stream over the datagram transport, with a configurable
+      window size
+    * PyDTLS datagram transport with paced, rate-controlled sending, with a
+      configurable maximum rate
+    * PyDTLS datagram transport with batched writes through UDP segmentation
+      offload and reads through UDP generic receive offload, with a
+      configurable batch size
 """
 
 import socket
@@ -38,7 +45,10 @@ from timeit import timeit
 from select import select
 from multiprocessing import Process
 from multiprocessing.managers import BaseManager
-from dtls import do_patch
+from dtls import do_patch, ReliableConnection
+from dtls.reliable import WINDOW
+from dtls.pacing import MAX_RATE
+from dtls.sslconnection import DTLS_OPENSSL_VERSION_NUMBER
 
 AF_INET4_6 = socket.AF_INET
 CERTFILE = path.join(path.dirname(__file__), "certs", "keycert.pem")
@@ -46,6 +56,10 @@ CHUNK_SIZE = 1459
 CHUNKS = 150000
 CHUNKS_PER_DOT = 500
 COMM_KEY = "tronje%T577&kkjLp"
+BATCH = 64
+# As of OpenSSL 1.1.0, null ciphers require security level 0
+CIPHERS = "NULL:@SECLEVEL=0" if DTLS_OPENSSL_VERSION_NUMBER >= 0x10100000 \
+  else "NULL"
 
 #
 # Traffic handler: required for servicing the root socket if the routing demux
@@ -81,6 +95,124 @@ def handle_traffic(data_sock, listen_sock, err):
 
 fill = urandom(CHUNK_SIZE)
 
+class ReliableSocket(object):
+    """Stream socket interface to a reliable stream over a DTLS socket"""
+
+    type = socket.SOCK_STREAM
+
+    def __init__(self, ssl_sock, window):
+        self._ssl_sock = ssl_sock
+        self._stream = ReliableConnection(ssl_sock._sslobj, window=window,
+                                          timeout=30)
+
+    def send(self, data):
+        return self._stream.send(data)
+
+    def recv(self, bufsize):
+        return self._stream.recv(bufsize)
+
+    def getpeername(self):
+        return self._ssl_sock.getpeername()
+
+    def setblocking(self, flag):
+        pass  # the stream places its sockets into non-blocking mode
+
+    def shutdown(self, how):
+        self._stream.close()
+        print "Retransmitted %d of %d segments, smoothed RTT %.3f ms" % (
+            self._stream.retransmits, self._stream.segments_sent,
+            (self._stream.srtt or 0) * 1000)
+
+    def close(self):
+        self._ssl_sock.close()
+
+class PacedSocket(object):
+    """Datagram socket interface to a paced sender over a DTLS socket"""
+
+    type = socket.SOCK_DGRAM
+
+    def __init__(self, ssl_sock, max_rate):
+        self._ssl_sock = ssl_sock
+        self._conn = ssl_sock._sslobj
+        self._paced = self._conn.start_pacing(max_rate=max_rate, timeout=5)
+
+    def send(self, data):
+        return self._conn.write(data)
+
+    def recv(self, bufsize):
+        try:
+            return self._conn.read(bufsize)
+        except ssl.SSLError as err:
+            if "timed out" in str(err.args[0]):
+                return ""  # the final datagrams were lost
+            raise
+
+    def getpeername(self):
+        return self._ssl_sock.getpeername()
+
+    def setblocking(self, flag):
+        pass  # the sender places its sockets into non-blocking mode
+
+    def shutdown(self, how):
+        if self._paced.datagrams_sent:
+            print "Paced at %.1f MB/s, achieved %.1f MB/s, %d of %d lost" % (
+                self._paced.rate / 1e6, (self._paced.achieved_rate or 0) / 1e6,
+                self._paced.datagrams_lost, self._paced.datagrams_sent)
+
+    def close(self):
+        self._ssl_sock.close()
+
+class BatchedSocket(object):
+    """Datagram socket interface to batched writes over a DTLS socket"""
+
+    type = socket.SOCK_DGRAM
+
+    def __init__(self, ssl_sock, batch):
+        self._ssl_sock = ssl_sock
+        self._conn = ssl_sock._sslobj
+        self._conn.enable_gro()
+        self._batch = batch
+        self._pending = []
+        ssl_sock.settimeout(10)  # exceeds the peer's wait for lost datagrams
+
+    def send(self, data):
+        self._pending.append(data)
+        if len(self._pending) >= self._batch:
+            self._flush()
+        return len(data)
+
+    def recv(self, bufsize):
+        self._flush()  # the peer awaits the remainder of the final batch
+        try:
+            return self._ssl_sock.recv(bufsize)
+        except ssl.SSLError as err:
+            if "timed out" in str(err.args[0]):
+                return ""  # the final datagrams were lost
+            raise
+
+    def _flush(self):
+        if self._pending:
+            self._conn.write_batch(self._pending)
+            self._pending = []
+
+    def fileno(self):
+        return self._ssl_sock.fileno()
+
+    def getpeername(self):
+        return self._ssl_sock.getpeername()
+
+    def setblocking(self, flag):
+        self._ssl_sock.setblocking(flag)
+
+    def shutdown(self, how):
+        self._flush()
+
+    def close(self):
+        self._ssl_sock.close()
+
+LAYERS = {"reliable": ReliableSocket, "paced": PacedSocket,
+          "batched": BatchedSocket}
+
 def transfer_out(sock, listen_sock=None, marker=False):
     max_i_len = 10
     start_char = "t" if marker else "s"
@@ -122,7 +254,8 @@ def transfer_in(sock, listen_sock=None):
         pack = ""
         while len(pack) < CHUNK_SIZE:
             try:
-                if isinstance(sock, ssl.SSLSocket):
+                if isinstance(sock, (ssl.SSLSocket, ReliableSocket,
+                                     PacedSocket, BatchedSocket)):
                     segment = sock.recv(CHUNK_SIZE - len(pack))
                 else:
                     segment, addr = sock.recvfrom(CHUNK_SIZE - len(pack))
@@ -175,13 +308,13 @@ def transfer_in(sock, listen_sock=None):
 # Single-threaded server
 #
 
-def server(sock_type, do_wrap, listen_addr):
+def server(sock_type, do_wrap, layer, listen_addr):
     sock = socket.socket(AF_INET4_6, sock_type)
     sock.bind(listen_addr)
     if do_wrap:
         wrap = ssl.wrap_socket(sock, server_side=True, certfile=CERTFILE,
                                do_handshake_on_connect=False,
-                               ciphers="NULL")
+                               ciphers=CIPHERS)
         wrap.listen(0)
     else:
         wrap = sock
@@ -194,6 +327,8 @@ def server(sock_type, do_wrap, listen_addr):
             if acc_res:
                 break
         conn = acc_res[0]
+        if layer:
+            conn = LAYERS[layer[0]](conn, layer[1])
     else:
         conn = wrap
     wrap.setblocking(False)
@@ -205,7 +340,7 @@ def server(sock_type, do_wrap, listen_addr):
     yield in_time, InResult.drops
     out_time = timeit(lambda: transfer_out(conn, wrap), number=1)
     # Inform the client that we are done, in case it has missed the final chunk
-    if sock_type == socket.SOCK_DGRAM:
+    if sock_type == socket.SOCK_DGRAM and not layer:
         global CHUNKS, CHUNK_SIZE
         CHUNKS_sav = CHUNKS
         CHUNK_SIZE_sav = CHUNK_SIZE
@@ -238,14 +373,16 @@ def server(sock_type, do_wrap, listen_addr):
 # Client, launched into a separate process
 #
 
-def client(sock_type, do_wrap, listen_addr):
+def client(sock_type, do_wrap, layer, listen_addr):
     do_patch()  # we might be in a new process
     sock = socket.socket(AF_INET4_6, sock_type)
     if do_wrap:
-        wrap = ssl.wrap_socket(sock, ciphers="NULL")
+        wrap = ssl.wrap_socket(sock, ciphers=CIPHERS)
     else:
         wrap = sock
     wrap.connect(listen_addr)
+    if layer:
+        wrap = LAYERS[layer[0]](wrap, layer[1])
     transfer_out(wrap)
     drops = transfer_in(wrap)
     wrap.shutdown(socket.SHUT_RDWR)
@@ -398,6 +535,15 @@ if __name__ == "__main__":
                         help="fixed suite port instead of dynamic assignment")
     parser.add_argument("-c", "--client", type=endpoint, metavar="ENDPOINT",
                         help="remote server endpoint for this client")
+    parser.add_argument("-w", "--window", type=int, default=WINDOW,
+                        metavar="SEGMENTS",
+                        help="window size of the reliable stream suite")
+    parser.add_argument("-r", "--rate", type=float, default=MAX_RATE,
+                        metavar="BYTES_PER_SECOND",
+                        help="maximum sending rate of the paced suite")
+    parser.add_argument("-b", "--batch", type=int, default=BATCH,
+                        metavar="DATAGRAMS",
+                        help="batch size of the batched suite")
     args = parser.parse_args()
     if args.client:
         remote_client(args.client)
@@ -405,10 +551,15 @@ if __name__ == "__main__":
     if args.server:
         start_client_manager(args.server)
     suites = {
-        "Raw TCP": (socket.SOCK_STREAM, False),
-        "Raw UDP": (socket.SOCK_DGRAM, False),
-        "SSL (TCP)": (socket.SOCK_STREAM, True),
-        "DTLS (UDP)": (socket.SOCK_DGRAM, True),
+        "Raw TCP": (socket.SOCK_STREAM, False, None),
+        "Raw UDP": (socket.SOCK_DGRAM, False, None),
+        "SSL (TCP)": (socket.SOCK_STREAM, True, None),
+        "DTLS (UDP)": (socket.SOCK_DGRAM, True, None),
+        "DTLS reliable (UDP)": (socket.SOCK_DGRAM, True,
+                                ("reliable", args.window)),
+        "DTLS paced (UDP)": (socket.SOCK_DGRAM, True, ("paced", args.rate)),
+        "DTLS batched (UDP)": (socket.SOCK_DGRAM, True,
+                               ("batched", args.batch)),
         }
     selector = {
         0: "Exit",
@@ -416,6 +567,9 @@ if __name__ == "__main__":
         2: "Raw UDP",
         3: "SSL (TCP)",
         4: "DTLS (UDP)",
+        5: "DTLS reliable (UDP)",
+        6: "DTLS paced (UDP)",
+        7: "DTLS batched (UDP)",
         }
     do_patch()
     while True:
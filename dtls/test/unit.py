@@ -17,12 +17,22 @@ import platform
 import threading
 import time
 import datetime
+import random
 import SocketServer
+import subprocess
+import tempfile
 from SimpleHTTPServer import SimpleHTTPRequestHandler
 from collections import OrderedDict
+from Queue import Queue
 
 import ssl
+import dtls
 from dtls import do_patch, force_routing_demux, reset_default_demux
+from dtls import DTLSConnectionPool, PSKStore, MessageConnection
+from dtls import ReliableConnection, PacedConnection, ClientMux
+from dtls import PacketClassifier
+from dtls import cipherprobe, demux, gro
+from dtls.sslconnection import SSLConnection, WANT_READ, WANT_WRITE
 
 HOST = "localhost"
 CONNECTION_TIMEOUT = datetime.timedelta(seconds=30)
@@ -74,6 +84,110 @@ class BasicTests(unittest.TestCase):
                 raise
 
 
+class ImportTests(unittest.TestCase):
+
+    def test_import_time(self):
+        """Package import defers library binding and initialization"""
+        script = ("import time; start = time.time(); import dtls; "
+                  "elapsed = time.time() - start; "
+                  "from dtls import openssl, sslconnection; "
+                  "print elapsed, len(openssl._sigs), "
+                  "sslconnection._library_initialized")
+        package_parent = os.path.dirname(os.path.dirname(
+            os.path.abspath(dtls.__file__)))
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         cwd=package_parent)
+        elapsed, sigs, initialized = output.split()
+        if test_support.verbose:
+            sys.stdout.write("\nPackage import time: %.1f ms\n" %
+                             (float(elapsed) * 1000))
+        # Only the version query functions are bound during import
+        self.assertLessEqual(int(sigs), 2)
+        self.assertEqual(initialized, "False")
+
+    def test_bound_functions(self):
+        """Bound functions replace placeholders in importing modules"""
+        from dtls import openssl, sslconnection, x509
+        cipherprobe._expand_suites("kPSK")
+        for module in openssl, sslconnection, x509, cipherprobe:
+            for name, value in vars(module).items():
+                if isinstance(value, openssl._LazyFunction):
+                    self.assertIsNone(value._func,
+                                      "%s.%s" % (module.__name__, name))
+        self.assertNotIsInstance(sslconnection.SSL_CTX_new,
+                                 openssl._LazyFunction)
+
+
+class FastPathTests(unittest.TestCase):
+    """Both hot-path implementations, regardless of the selected backend"""
+
+    def implementations(self):
+        from dtls import openssl
+        impls = [openssl._CtypesFastPath]
+        try:
+            impls.append(openssl._load_cffi_backend())
+        except ImportError:
+            if test_support.verbose:
+                sys.stdout.write("\ncffi is not available\n")
+        return impls
+
+    def connect_pair(self, impl):
+        # Handshake over memory BIOs, then replace the connected SSL
+        # objects' fast paths with the implementation under test
+        from dtls.openssl import BIO_read
+        suite = cipherprobe._suites("kPSK")[0][0]
+        client, client_wbio, server, server_rbio = \
+          cipherprobe._connect_pair(suite)
+        client.fast = impl(client)
+        server.fast = impl(server)
+        return client, server, \
+          lambda: BIO_read(client_wbio.value, 65536), server_rbio
+
+    def test_transfer(self):
+        from dtls.openssl import BIO_write
+        for impl in self.implementations():
+            client, server, sent, server_rbio = self.connect_pair(impl)
+            self.assertIs(server.fast.try_read(1024), WANT_READ)
+            self.assertEqual(client.fast.write("ping"), 4)
+            BIO_write(server_rbio.value, sent())
+            self.assertEqual(server.fast.read(1024), "ping")
+            self.assertEqual(client.fast.try_write(bytearray("pong")), 4)
+            BIO_write(server_rbio.value, sent())
+            buf = bytearray(16)
+            self.assertEqual(server.fast.read_into(buf, 16), 4)
+            self.assertEqual(str(buf[:4]), "pong")
+            self.assertEqual(server.fast.pending(), 0)
+            self.assertIsNone(server.fast.try_handshake())
+
+    def test_feed(self):
+        from collections import deque
+        for impl in self.implementations():
+            client, server, sent, server_rbio = self.connect_pair(impl)
+            datagrams = deque()
+            server.fast.set_feed(server_rbio.raw, datagrams)
+            for data in "one", "two", "three":
+                client.fast.write(data)
+                datagrams.append(sent())
+            # One datagram is passed to the BIO at a time
+            server.fast.feed()
+            self.assertEqual(len(datagrams), 2)
+            server.fast.feed()
+            self.assertEqual(len(datagrams), 2)
+            self.assertEqual(server.fast.read(1024), "one")
+            self.assertEqual(server.fast.try_read(1024), "two")
+            buf = bytearray(16)
+            self.assertEqual(server.fast.read_into(buf, 16), 5)
+            self.assertEqual(str(buf[:5]), "three")
+            self.assertIs(server.fast.try_read(1024), WANT_READ)
+
+    def test_timer(self):
+        for impl in self.implementations():
+            client, server, sent, server_rbio = self.connect_pair(impl)
+            # No retransmission timer runs once the handshake has completed
+            self.assertIsNone(client.fast.get_timeout())
+            self.assertFalse(client.fast.handle_timeout())
+
+
 class BasicSocketTests(unittest.TestCase):
 
     def test_constants(self):
@@ -81,6 +195,8 @@ class BasicSocketTests(unittest.TestCase):
         ssl.PROTOCOL_SSLv3
         ssl.PROTOCOL_TLSv1
         ssl.PROTOCOL_DTLSv1  # added
+        ssl.PROTOCOL_DTLSv1_2  # added
+        ssl.PROTOCOL_DTLS  # added
         ssl.CERT_NONE
         ssl.CERT_OPTIONAL
         ssl.CERT_REQUIRED
@@ -95,22 +211,29 @@ class BasicSocketTests(unittest.TestCase):
         # Some sanity checks follow
         # >= 1.0
         self.assertGreaterEqual(n, 0x10000000)
-        # < 2.0
-        self.assertLess(n, 0x20000000)
+        # < 4.0
+        self.assertLess(n, 0x40000000)
         major, minor, fix, patch, status = t
         self.assertGreaterEqual(major, 1)
-        self.assertLess(major, 2)
+        self.assertLess(major, 4)
         self.assertGreaterEqual(minor, 0)
         self.assertLess(minor, 256)
         self.assertGreaterEqual(fix, 0)
         self.assertLess(fix, 256)
         self.assertGreaterEqual(patch, 0)
-        self.assertLessEqual(patch, 26)
+        if major < 3:
+            # Letter releases
+            self.assertLessEqual(patch, 26)
+        else:
+            self.assertLess(patch, 256)
         self.assertGreaterEqual(status, 0)
         self.assertLessEqual(status, 15)
-        # Version string as returned by OpenSSL, the format might change
+        # Version string as returned by OpenSSL, the format might change; as
+        # of OpenSSL 3.0, the patch release takes the place of the fix field
+        release = fix if major < 3 else patch
         self.assertTrue(
-            s.startswith("OpenSSL {:d}.{:d}.{:d}".format(major, minor, fix)),
+            s.startswith("OpenSSL {:d}.{:d}.{:d}".format(major, minor,
+                                                           release)),
             (s, t))
 
     def test_ciphers(self):
@@ -1043,6 +1166,17 @@ class ThreadedTests(unittest.TestCase):
         try_protocol_combo(ssl.PROTOCOL_DTLSv1, ssl.PROTOCOL_DTLSv1, True,
                            ssl.CERT_REQUIRED)
 
+    def test_protocol_dtls(self):
+        """Connecting to DTLS and DTLSv1.2 servers with various clients"""
+        if test_support.verbose:
+            sys.stdout.write("\n")
+        try_protocol_combo(ssl.PROTOCOL_DTLS, ssl.PROTOCOL_DTLS, True)
+        try_protocol_combo(ssl.PROTOCOL_DTLS, ssl.PROTOCOL_DTLSv1, True)
+        try_protocol_combo(ssl.PROTOCOL_DTLSv1, ssl.PROTOCOL_DTLS, True)
+        try_protocol_combo(ssl.PROTOCOL_DTLS, ssl.PROTOCOL_DTLSv1_2, True)
+        try_protocol_combo(ssl.PROTOCOL_DTLSv1_2, ssl.PROTOCOL_DTLS, True,
+                           ssl.CERT_REQUIRED)
+
     def test_starttls(self):
         """Switching from clear text to encrypted and back again."""
         msgs = ("msg 1", "MSG 2", "STARTTLS", "MSG 3", "msg 4", "ENDTLS",
@@ -1304,6 +1438,32 @@ class ThreadedTests(unittest.TestCase):
         finally:
             server.stop()
 
+    def test_try_nonblocking(self):
+        """Exception-free non-blocking handshake, read, and write"""
+        server = ThreadedEchoServer(CERTFILE, chatty=False)
+        flag = threading.Event()
+        server.start(flag)
+        flag.wait()
+        try:
+            sock = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+            sock.connect((HOST, server.port))
+            sock.setblocking(False)
+            conn = SSLConnection(sock, do_handshake_on_connect=False)
+            while True:
+                status = conn.try_handshake()
+                if status is None:
+                    break
+                self.assertIn(status, (WANT_READ, WANT_WRITE))
+                select.select([sock], [], [], 5)
+            self.assertIs(conn.try_read(), WANT_READ)
+            self.assertEqual(conn.try_write("ECHO"), 4)
+            select.select([sock], [], [], 5)
+            self.assertEqual(conn.try_read(), "echo")
+            conn.try_write("over\n")
+            sock.close()
+        finally:
+            server.stop()
+
     def test_handshake_timeout(self):
         # Issue #5103: SSL handshake must respect the socket timeout
         server = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
@@ -1333,6 +1493,1252 @@ class ThreadedTests(unittest.TestCase):
             server.close()
 
 
+class AcceptingServer(object):
+    """Listening SSLConnection whose accepted connections a thread serves
+
+    Entering binds a listening socket to HOST, unless one is given, and
+    starts a daemon thread that accepts count connections and keeps
+    listening afterwards: with a routing demux, accepted connections receive
+    their datagrams only while the listening connection is serviced. A
+    second daemon thread completes the handshake of each accepted connection
+    and calls handler with it. Exiting stops the listening thread and closes
+    the listening socket.
+    """
+
+    def __init__(self, handler, count=1, listening=None, **kwargs):
+        self.handler = handler
+        self.count = count
+        self.listening = listening
+        self.kwargs = kwargs
+        self.accepted = Queue()
+        self.active = False
+        self.listener = threading.Thread(target=self.listen)
+        self.listener.daemon = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+
+    @property
+    def address(self):
+        return self.listening.getsockname()[:2]
+
+    def listen(self):
+        count = self.count
+        while self.active:
+            if count:
+                acc_ret = self.server.accept()
+                if acc_ret:
+                    self.accepted.put(acc_ret[0])
+                    count -= 1
+            else:
+                self.server.listen()
+
+    def serve(self):
+        for _ in range(self.count):
+            conn = self.accepted.get()
+            conn.do_handshake()
+            self.handler(conn)
+
+    def __enter__(self):
+        if not self.listening:
+            self.listening = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+            self.listening.bind((HOST, 0))
+        self.listening.settimeout(0.05)  # lets the listener notice the exit
+        try:
+            # The listener must not block in handshakes, which it services
+            self.server = SSLConnection(self.listening, server_side=True,
+                                        do_handshake_on_connect=False,
+                                        **self.kwargs)
+        except:
+            self.listening.close()
+            raise
+        self.active = True
+        self.listener.start()
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.active = False
+        self.listener.join()
+        self.listening.close()
+
+
+class ConnectionPoolTests(unittest.TestCase):
+
+    def test_connection_reuse(self):
+        server = ThreadedEchoServer(CERTFILE, chatty=False)
+        flag = threading.Event()
+        server.start(flag)
+        flag.wait()
+        remote = (HOST, server.port)
+        pool = DTLSConnectionPool(max_per_endpoint=1, family=AF_INET4_6)
+        try:
+            with pool.connection(remote) as conn:
+                conn.write("PING")
+                self.assertEqual(conn.read(), "ping")
+            with pool.connection(remote) as reused:
+                self.assertIs(reused, conn)
+                self.assertRaisesRegexp(ssl.SSLError,
+                                        "No pooled connection",
+                                        pool.acquire, remote, 0.1)
+                reused.write("over\n")
+        finally:
+            pool.close()
+            server.stop()
+
+    def test_stale_connection(self):
+        server = ThreadedEchoServer(CERTFILE, chatty=False)
+        flag = threading.Event()
+        server.start(flag)
+        flag.wait()
+        remote = (HOST, server.port)
+        pool = DTLSConnectionPool(idle_timeout=0, family=AF_INET4_6)
+        try:
+            with pool.connection(remote) as conn:
+                conn.write("over\n")
+            time.sleep(0.1)
+            with pool.connection(remote) as fresh:
+                self.assertIsNot(fresh, conn)
+                fresh.write("PONG")
+                self.assertEqual(fresh.read(), "pong")
+                fresh.write("over\n")
+        finally:
+            pool.close()
+            server.stop()
+
+    def test_session_resumption(self):
+        def echo(conn):
+            while True:
+                data = conn.read()
+                if data == "over":
+                    break
+                conn.write(data.lower())
+
+        with AcceptingServer(echo, count=2, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            pool = DTLSConnectionPool(idle_timeout=0, family=AF_INET4_6)
+            try:
+                with pool.connection(server.address) as conn:
+                    self.assertFalse(conn.session_reused())
+                    conn.write("PING")
+                    self.assertEqual(conn.read(), "ping")
+                    conn.write("over")
+                time.sleep(0.1)
+                # The stale connection's replacement resumes its session
+                with pool.connection(server.address) as fresh:
+                    self.assertIsNot(fresh, conn)
+                    self.assertTrue(fresh.session_reused())
+                    fresh.write("PONG")
+                    self.assertEqual(fresh.read(), "pong")
+                    fresh.write("over")
+                server.thread.join(5)
+                self.assertFalse(server.thread.is_alive())
+            finally:
+                pool.close()
+
+
+class PSKTests(unittest.TestCase):
+
+    KEY = "00112233445566778899aabbccddeeff".decode("hex")
+
+    def setUp(self):
+        fd, self.key_file = tempfile.mkstemp()
+        os.write(fd, "# identity:key\n\nsensor-1:%s\n" %
+                 self.KEY.encode("hex"))
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.key_file)
+
+    def test_store(self):
+        store = PSKStore(self.key_file)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get("sensor-1"), self.KEY)
+        self.assertIsNone(store.get("sensor-2"))
+        with open(self.key_file, "a") as key_file:
+            key_file.write("sensor-2:xyz\n")
+        self.assertRaisesRegexp(ValueError, "line 4", store.load,
+                                self.key_file)
+        self.assertIn("sensor-1", store)
+
+    def test_psk_handshake(self):
+        identities = []
+        def serve(conn):
+            conn.write(conn.read().lower())
+            identities.append(conn.psk_identity())
+        with AcceptingServer(serve, psk=PSKStore(self.key_file)) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM),
+                psk=("sensor-1", self.KEY))
+            try:
+                client.connect(server.address)
+                client.write("PSK")
+                self.assertEqual(client.read(), "psk")
+                self.assertIn("PSK", client.cipher()[0])
+                server.thread.join(5)
+                self.assertEqual(identities, ["sensor-1"])
+            finally:
+                client.get_socket(False).close()
+
+
+class KeyExchangeTests(unittest.TestCase):
+
+    def handshake(self, ciphers=None, **kwargs):
+        with AcceptingServer(lambda conn: None, keyfile=CERTFILE,
+                             certfile=CERTFILE, ciphers=ciphers,
+                             **kwargs) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM), ciphers=ciphers)
+            try:
+                client.connect(server.address)
+                server.thread.join(5)
+                return client.cipher()[0]
+            finally:
+                client.get_socket(False).close()
+
+    def test_ecdhe(self):
+        self.assertTrue(self.handshake().startswith("ECDHE-"))
+
+    def test_dhe(self):
+        dh_params = os.path.join(os.path.dirname(CERTFILE), "dhparams.pem")
+        self.assertTrue(self.handshake("DHE", dh_params=dh_params)
+                        .startswith("DHE-"))
+        with self.assertRaises(ssl.SSLError) as cm:
+            self.handshake("DHE", dh_params=dh_params + ".missing")
+        self.assertIn("DH parameters", cm.exception.args[0])
+
+    def test_curves(self):
+        self.assertTrue(self.handshake(curves="P-256").startswith("ECDHE-"))
+        with self.assertRaises(ssl.SSLError) as cm:
+            self.handshake(curves="bogus")
+        self.assertIn("No elliptic curve", cm.exception.args[0])
+
+
+class SRTPTests(unittest.TestCase):
+
+    LABEL = "EXTRACTOR-dtls_srtp"
+
+    def handshake(self, server_profiles, client_profiles):
+        results = []
+        def serve(conn):
+            results.append((conn.srtp_profile(),
+                            conn.export_keying_material(self.LABEL, 60)))
+        with AcceptingServer(serve, keyfile=CERTFILE, certfile=CERTFILE,
+                             srtp_profiles=server_profiles) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM),
+                srtp_profiles=client_profiles)
+            try:
+                self.assertIsNone(
+                    client.export_keying_material(self.LABEL, 60))
+                client.connect(server.address)
+                server.thread.join(5)
+                return client, results[0]
+            finally:
+                client.get_socket(False).close()
+
+    def test_srtp(self):
+        client, (profile, material) = self.handshake(
+            "SRTP_AES128_CM_SHA1_80:SRTP_AES128_CM_SHA1_32",
+            "SRTP_AES128_CM_SHA1_32")
+        self.assertEqual(profile, "SRTP_AES128_CM_SHA1_32")
+        self.assertEqual(client.srtp_profile(), profile)
+        self.assertEqual(len(material), 60)
+        self.assertEqual(client.export_keying_material(self.LABEL, 60),
+                         material)
+        self.assertNotEqual(client.export_keying_material("other", 60),
+                            material)
+        self.assertNotEqual(client.export_keying_material(self.LABEL, 60, ""),
+                            material)
+
+    def test_no_srtp(self):
+        client, (profile, material) = self.handshake(
+            "SRTP_AES128_CM_SHA1_80", None)
+        self.assertIsNone(profile)
+        self.assertIsNone(client.srtp_profile())
+        # Keying material does not depend on SRTP
+        self.assertEqual(client.export_keying_material(self.LABEL, 60),
+                         material)
+        with self.assertRaises(ssl.SSLError) as cm:
+            self.handshake("bogus", None)
+        self.assertIn("SRTP", cm.exception.args[0])
+
+
+class CipherProbeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, "cipherprobe.json")
+        cipherprobe._results.clear()
+        cipherprobe._orders.clear()
+
+    def tearDown(self):
+        cipherprobe._results.clear()
+        cipherprobe._orders.clear()
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
+        os.rmdir(self.cache_dir)
+
+    def test_measure(self):
+        throughput = cipherprobe.measure(cache_file=self.cache_file,
+                                         duration=0.01)
+        self.assertTrue(throughput)
+        self.assertTrue(all(value > 0 for value in throughput.values()))
+        # Results are cached on disk for this host type
+        cipherprobe._results.clear()
+        measure_suite = cipherprobe._measure_suite
+        cipherprobe._measure_suite = None
+        try:
+            self.assertEqual(cipherprobe.measure(cache_file=self.cache_file),
+                             throughput)
+        finally:
+            cipherprobe._measure_suite = measure_suite
+
+    def test_order_ciphers(self):
+        throughput = cipherprobe.measure(cache_file=self.cache_file,
+                                         duration=0.01)
+        suites = cipherprobe._suites("DEFAULT")
+        ordered = cipherprobe.order_ciphers(cache_file=self.cache_file)
+        self.assertItemsEqual(ordered.split(":"),
+                              [name for name, bulk in suites])
+        measured = [throughput[bulk] for bulk in
+                    (dict(suites)[name] for name in ordered.split(":"))
+                    if bulk in throughput]
+        self.assertEqual(measured, sorted(measured, reverse=True))
+        # The order is computed once per cipher list
+        measure = cipherprobe.measure
+        cipherprobe.measure = None
+        try:
+            self.assertEqual(cipherprobe.order_ciphers(
+                cache_file=self.cache_file), ordered)
+        finally:
+            cipherprobe.measure = measure
+
+    def test_cache_files(self):
+        throughput = cipherprobe.measure(cache_file=self.cache_file,
+                                         duration=0.01)
+        # Results obtained for one cache file do not apply to another
+        other_file = os.path.join(self.cache_dir, "other.json")
+        measure_suite = cipherprobe._measure_suite
+        cipherprobe._measure_suite = lambda suite, duration, payload: 1.0
+        try:
+            other = cipherprobe.measure(cache_file=other_file)
+        finally:
+            cipherprobe._measure_suite = measure_suite
+        self.assertItemsEqual(other, throughput)
+        self.assertTrue(all(value == 1.0 for value in other.values()))
+        self.assertEqual(cipherprobe.measure(cache_file=self.cache_file),
+                         throughput)
+
+    def test_cipher_probe(self):
+        cipherprobe.measure(cache_file=self.cache_file, duration=0.01)
+        cipher = KeyExchangeTests("test_ecdhe").handshake(
+            cipher_probe=self.cache_file)
+        self.assertIn(cipher, cipherprobe.order_ciphers(
+            cache_file=self.cache_file).split(":"))
+        # The connection's order was computed from the given cache file
+        self.assertEqual(set(key[1] for key in cipherprobe._orders),
+                         set([self.cache_file]))
+
+
+class PathMTUTests(unittest.TestCase):
+
+    def test_record_payload(self):
+        from dtls.sslconnection import _record_payload
+        self.assertEqual(_record_payload(
+            1400, "AES128-GCM-SHA256 TLSv1.2 Kx=RSA Au=RSA "
+            "Enc=AESGCM(128) Mac=AEAD"), 1363)
+        self.assertEqual(_record_payload(
+            1400, "AES256-SHA256 TLSv1.2 Kx=RSA Au=RSA "
+            "Enc=AES(256) Mac=SHA256"), 1327)
+        # Conservative for CBC suites whose MAC length is not a multiple of
+        # the block length
+        self.assertEqual(_record_payload(
+            1400, "AES128-SHA SSLv3 Kx=RSA Au=RSA Enc=AES(128) Mac=SHA1"),
+            1339)
+
+    def test_max_payload(self):
+        def serve(conn):
+            conn.write(conn.read(65536))
+        with AcceptingServer(serve, keyfile=CERTFILE, certfile=CERTFILE,
+                             pmtu_discovery=True) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM),
+                pmtu_discovery=True)
+            try:
+                self.assertIsNone(client.max_payload())
+                client.connect(server.address)
+                payload = client.max_payload()
+                self.assertTrue(0 < payload <= 16384)
+                client.write("x" * payload)
+                self.assertEqual(len(client.read(65536)), payload)
+                server.thread.join(5)
+            finally:
+                client.get_socket(False).close()
+
+
+class _RecordFeed(object):
+    """Record transport between MessageConnection instances, in memory"""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(str(record))
+
+    def read_into(self, buffer):
+        record = self.records.pop(0)
+        buffer[:len(record)] = record
+        return len(record)
+
+    def max_payload(self):
+        return None
+
+
+class MessageTests(unittest.TestCase):
+
+    def test_reassembly(self):
+        feed = _RecordFeed()
+        sender = MessageConnection(feed, fragment_size=4)
+        receiver = MessageConnection(feed)
+        self.assertEqual(sender.send(""), 1)
+        self.assertEqual(receiver.recv(), "")
+        self.assertEqual(sender.send("0123456789"), 3)
+        feed.records.reverse()
+        self.assertEqual(receiver.recv(), "0123456789")
+        self.assertRaises(ValueError, MessageConnection(
+            feed, max_message_size=8).send, "0123456789")
+
+    def test_bounds(self):
+        feed = _RecordFeed()
+        sender = MessageConnection(feed, fragment_size=4)
+        receiver = MessageConnection(feed, max_pending=1,
+                                     reassembly_timeout=0.05)
+        # A newer message displaces an incomplete one
+        sender.send("incomplete")
+        del feed.records[-1]
+        sender.send("complete")
+        self.assertEqual(receiver.recv(), "complete")
+        self.assertEqual(receiver.discarded, 1)
+        # Incomplete messages time out
+        sender.send("incomplete")
+        del feed.records[-1]
+        self.assertRaises(IndexError, receiver.recv)
+        time.sleep(0.1)
+        sender.send("x")
+        self.assertEqual(receiver.recv(), "x")
+        self.assertEqual(receiver.discarded, 2)
+
+    def test_messages(self):
+        sizes = 0, 1, 5000, 60000
+        def serve(conn):
+            # A burst of records smaller than the client's must not overrun
+            # its socket buffer: the routing demux's connections report a
+            # conservative MTU
+            messages = MessageConnection(conn, fragment_size=1000)
+            for _ in sizes:
+                messages.send(messages.recv())
+        with AcceptingServer(serve, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                messages = MessageConnection(client, fragment_size=1000)
+                for size in sizes:
+                    message = os.urandom(size)
+                    messages.send(message)
+                    self.assertEqual(messages.recv(), message)
+                server.thread.join(5)
+            finally:
+                client.get_socket(False).close()
+
+
+class _LossyConnection(object):
+    """SSLConnection wrapper that drops a fraction of written records"""
+
+    def __init__(self, conn, loss, seed):
+        self.conn = conn
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.dropped = 0
+
+    def try_write(self, data):
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return len(data)
+        return self.conn.try_write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class ReliableTests(unittest.TestCase):
+
+    def _transfer(self, data, loss, window):
+        received = []
+        def serve(conn):
+            stream = ReliableConnection(_LossyConnection(conn, loss, 1),
+                                        window=window, timeout=10)
+            while True:
+                chunk = stream.recv(65536)
+                if not chunk:
+                    break
+                received.append(chunk)
+            stream.send(str(len("".join(received))))
+            stream.close()
+        with AcceptingServer(serve, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                lossy = _LossyConnection(client, loss, 2)
+                stream = ReliableConnection(lossy, window=window, timeout=10)
+                for offset in xrange(0, len(data), 50000):
+                    self.assertEqual(
+                        stream.send(data[offset:offset + 50000]),
+                        len(data[offset:offset + 50000]))
+                stream.close()
+                self.assertEqual(stream.recv(100), str(len(data)))
+                self.assertEqual(stream.recv(100), "")
+                # Acknowledge retransmissions until the server's close
+                # completes
+                while server.thread.is_alive():
+                    stream.service()
+                    server.thread.join(0.01)
+                self.assertEqual("".join(received), data)
+                self.assertIsNotNone(stream.srtt)
+                return stream
+            finally:
+                client.get_socket(False).close()
+
+    def test_unwrap(self):
+        from dtls.reliable import _unwrap
+        self.assertEqual(_unwrap(5, 0), 5)
+        self.assertEqual(_unwrap(2, 0xFFFFFFFE), 0x100000002)
+        self.assertEqual(_unwrap(0xFFFFFFFF, 0x100000001), 0xFFFFFFFF)
+
+    def test_stream(self):
+        stream = self._transfer(os.urandom(300000), 0, 32)
+        self.assertLess(stream.retransmits, stream.segments_sent)
+
+    def test_lossy_stream(self):
+        stream = self._transfer(os.urandom(300000), 0.1, 16)
+        self.assertGreater(stream.retransmits, 0)
+
+
+class PacingTests(unittest.TestCase):
+
+    def _transfer(self, count, loss, **kwargs):
+        received = []
+        def serve(conn):
+            paced = PacedConnection(conn, timeout=0.5)
+            try:
+                while True:
+                    received.append(paced.recv(2000))
+            except ssl.SSLError:
+                pass
+        with AcceptingServer(serve, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                lossy = _LossyConnection(client, loss, 3)
+                paced = PacedConnection(lossy, **kwargs)
+                datagram = os.urandom(1000)
+                start = time.time()
+                for _ in range(count):
+                    self.assertEqual(paced.send(datagram), len(datagram))
+                elapsed = time.time() - start
+                # Collect the final reports
+                while time.time() < start + elapsed + 0.1:
+                    paced.service()
+                    time.sleep(0.005)
+                server.thread.join(5)
+                self.assertEqual(len(received), count - lossy.dropped)
+                self.assertIsNotNone(paced.srtt)
+                self.assertIsNotNone(paced.achieved_rate)
+                return paced, lossy, elapsed
+            finally:
+                client.get_socket(False).close()
+
+    def test_rate(self):
+        paced, lossy, elapsed = self._transfer(300, 0, initial_rate=1e6,
+                                               max_rate=1e6)
+        self.assertGreaterEqual(elapsed, 0.25)
+        self.assertEqual(paced.datagrams_sent, 300)
+        self.assertEqual(paced.datagrams_lost, 0)
+        self.assertEqual(paced.loss, 0)
+        self.assertLessEqual(paced.rate, 1e6)
+
+    def test_loss(self):
+        paced, lossy, elapsed = self._transfer(300, 0.2, initial_rate=1e6,
+                                               max_rate=4e6)
+        self.assertGreater(paced.datagrams_lost, 0)
+        self.assertLessEqual(paced.datagrams_lost, lossy.dropped)
+        self.assertGreater(paced.loss, 0)
+        self.assertLess(paced.rate, 4e6)
+
+    def test_connection_mode(self):
+        received = []
+        def serve(conn):
+            conn.start_pacing(timeout=0.5)
+            try:
+                while True:
+                    received.append(conn.read(2000))
+            except ssl.SSLError:
+                pass
+        with AcceptingServer(serve, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                paced = client.start_pacing(initial_rate=1e6, max_rate=1e6)
+                self.assertIs(client.start_pacing(), paced)
+                datagrams = ["datagram %d" % i for i in range(50)]
+                for datagram in datagrams:
+                    self.assertEqual(client.write(datagram), len(datagram))
+                deadline = time.time() + 0.1
+                while time.time() < deadline:
+                    paced.service()
+                    time.sleep(0.005)
+                server.thread.join(5)
+                self.assertEqual(received, datagrams)
+                self.assertEqual(paced.datagrams_sent, len(datagrams))
+                self.assertIsNotNone(paced.achieved_rate)
+            finally:
+                client.get_socket(False).close()
+
+    def test_connection_mode_try(self):
+        datagrams = ["datagram %d" % i for i in range(40)]
+        received = []
+        def serve(conn):
+            conn.start_pacing()
+            deadline = time.time() + 5
+            while len(received) < len(datagrams) and time.time() < deadline:
+                data = conn.try_read(2000)
+                if data is WANT_READ:
+                    time.sleep(0.001)
+                else:
+                    received.append(data)
+        with AcceptingServer(serve, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                paced = client.start_pacing(initial_rate=1e5)
+                self.assertEqual(client.write_batch(datagrams[:20]), 20)
+                waited = False
+                for datagram in datagrams[20:]:
+                    while True:
+                        status = client.try_write(datagram)
+                        if status is not WANT_WRITE:
+                            break
+                        waited = True
+                        time.sleep(0.001)
+                    self.assertEqual(status, len(datagram))
+                self.assertTrue(waited)
+                self.assertIs(client.try_read(), WANT_READ)
+                server.thread.join(5)
+                # The peer received the datagrams without the layer's headers
+                self.assertEqual(received, datagrams)
+                self.assertEqual(paced.datagrams_sent, len(datagrams))
+            finally:
+                client.get_socket(False).close()
+
+
+def _receive_all(received):
+    # Accepted connection handler that reads until a second passes idle
+    def serve(conn):
+        conn.get_socket(True).settimeout(1)
+        try:
+            while True:
+                received.append(conn.read(2000))
+        except ssl.SSLError:
+            pass
+    return serve
+
+
+class WriteBatchTests(unittest.TestCase):
+
+    def _write_batch(self):
+        received = []
+        with AcceptingServer(_receive_all(received), keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                datagrams = [os.urandom(1000) for _ in range(70)] + \
+                  ["short"] + [os.urandom(500) for _ in range(3)]
+                self.assertEqual(client.write_batch(datagrams),
+                                 len(datagrams))
+                server.thread.join(5)
+                self.assertEqual(received, datagrams)
+                return client
+            finally:
+                client.get_socket(False).close()
+
+    def test_write_batch(self):
+        self._write_batch()
+
+    def test_unsupported(self):
+        # Segmentation offload fails with an unknown option
+        udp_segment = dtls.sslconnection._UDP_SEGMENT
+        dtls.sslconnection._UDP_SEGMENT = 0xFFFF
+        try:
+            self.assertFalse(self._write_batch()._gso)
+        finally:
+            dtls.sslconnection._UDP_SEGMENT = udp_segment
+
+
+class GROTests(unittest.TestCase):
+
+    def test_receiver(self):
+        receiving = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        receiving.bind((HOST, 0))
+        sending = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        try:
+            try:
+                receiver = gro.GROReceiver(receiving)
+            except socket.error:
+                self.skipTest("UDP generic receive offload unavailable")
+            sending.connect(receiving.getsockname())
+            # Segmentation offload yields a coalescable buffer on loopback
+            sending.setsockopt(17, 103, 400)  # SOL_UDP, UDP_SEGMENT
+            sending.send("a" * 1200 + "b" * 100)
+            sending.setsockopt(17, 103, 0)
+            sending.send("c" * 50)
+            datagrams, address = receiver.recvfrom()
+            self.assertEqual(address, sending.getsockname())
+            self.assertEqual(datagrams, ["a" * 400] * 3 + ["b" * 100])
+            self.assertEqual(receiver.recvfrom()[0], ["c" * 50])
+            receiving.settimeout(0.1)
+            self.assertRaises(socket.timeout, receiver.recvfrom)
+        finally:
+            sending.close()
+            receiving.close()
+
+    def test_routing_demux(self):
+        from dtls.demux.router import UDPDemux
+        root = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        root.bind(("127.0.0.1", 0))
+        sending = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sending.connect(root.getsockname())
+        try:
+            udp_demux = UDPDemux(root, gro=True)
+            if not udp_demux._gro:
+                self.skipTest("UDP generic receive offload unavailable")
+            conn = udp_demux.get_connection(sending.getsockname())
+            sending.setsockopt(17, 103, 300)  # SOL_UDP, UDP_SEGMENT
+            sending.send("d" * 1500)
+            self.assertIsNone(udp_demux.service())
+            conn.settimeout(1)
+            self.assertEqual([conn.recv(2000) for _ in range(5)],
+                             ["d" * 300] * 5)
+        finally:
+            sending.close()
+            root.close()
+
+    def test_read(self):
+        received = []
+        with AcceptingServer(_receive_all(received), keyfile=CERTFILE,
+                             certfile=CERTFILE, gro=True) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                datagrams = [os.urandom(1000) for _ in range(70)] + \
+                  ["short"] + [os.urandom(500) for _ in range(3)]
+                client.write_batch(datagrams)
+                server.thread.join(5)
+                self.assertEqual(received, datagrams)
+            finally:
+                client.get_socket(False).close()
+
+    def test_enable_gro(self):
+        from dtls import sslconnection
+        from dtls.demux.osnet import UDPDemux
+        received = []
+        receive_all = _receive_all(received)
+        accepted = []
+
+        def serve(conn):
+            conn.enable_gro()
+            accepted.append(conn)
+            receive_all(conn)
+
+        with AcceptingServer(serve, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            client = SSLConnection(
+                socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+            try:
+                client.connect(server.address)
+                datagrams = [os.urandom(1000) for _ in range(20)]
+                client.write_batch(datagrams)
+                server.thread.join(5)
+                self.assertEqual(received, datagrams)
+            finally:
+                client.get_socket(False).close()
+        # Routing demux connections share the server's socket
+        if sslconnection._UDP_GRO and demux.UDPDemux is UDPDemux:
+            self.assertIsNotNone(accepted[0]._gro_receiver)
+
+
+class ListenManyTests(unittest.TestCase):
+
+    def test_listen_many(self):
+        listening = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        listening.bind((HOST, 0))
+        server = SSLConnection(listening, keyfile=CERTFILE, certfile=CERTFILE,
+                               server_side=True,
+                               do_handshake_on_connect=False)
+        clients = [SSLConnection(socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+                   for _ in range(3)]
+        threads = [threading.Thread(target=client.connect,
+                                    args=(listening.getsockname()[:2],))
+                   for client in clients]
+        try:
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            peers = []
+            deadline = time.time() + 10
+            while len(peers) < len(clients) and time.time() < deadline:
+                verified = server.listen_many(2)
+                self.assertLessEqual(len(verified), 2)
+                peers += verified
+            self.assertEqual(
+                sorted(peers),
+                sorted(client.get_socket(False).getsockname()
+                       for client in clients))
+            accepted = [server.accept() for _ in clients]
+            self.assertEqual([acc_ret[1] for acc_ret in accepted], peers)
+            # Handshakes proceed while listen forwards to accepted peers
+            handshakes = threading.Thread(
+                target=lambda: [acc_ret[0].do_handshake()
+                                for acc_ret in accepted])
+            handshakes.daemon = True
+            handshakes.start()
+            listening.settimeout(0.1)
+            deadline = time.time() + 10
+            while handshakes.is_alive() and time.time() < deadline:
+                server.listen()
+            for thread in threads:
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+            connections = dict((peer, conn) for conn, peer in accepted)
+            for client in clients:
+                client.write("x")
+                conn = connections[client.get_socket(False).getsockname()]
+                conn.get_socket(True).settimeout(0.1)
+                deadline = time.time() + 5
+                while True:
+                    try:
+                        self.assertEqual(conn.read(), "x")
+                        break
+                    except ssl.SSLError:
+                        if time.time() > deadline:
+                            raise
+                        server.listen()
+        finally:
+            for client in clients:
+                client.get_socket(False).close()
+            listening.close()
+
+    def test_retransmitted_hello(self):
+        listening = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        listening.bind((HOST, 0))
+        server = SSLConnection(listening, keyfile=CERTFILE, certfile=CERTFILE,
+                               server_side=True,
+                               do_handshake_on_connect=False)
+        client = SSLConnection(socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+        thread = threading.Thread(target=client.connect,
+                                  args=(listening.getsockname()[:2],))
+        thread.daemon = True
+        try:
+            thread.start()
+            peers = []
+            deadline = time.time() + 10
+            while not peers and time.time() < deadline:
+                peers = server.listen_many()
+            # Unanswered, the client retransmits its ClientHello along with
+            # the cookie after a second
+            deadline = time.time() + 1.5
+            while time.time() < deadline:
+                self.assertEqual(server.listen_many(), [])
+                time.sleep(0.01)
+            listening_ssl = server._ssl
+            conn, peer = server.accept()
+            self.assertEqual(peer, peers[0])
+            self.assertIs(server._ssl, listening_ssl)
+            self.assertFalse(server._verified_peers)
+            handshake = threading.Thread(target=conn.do_handshake)
+            handshake.daemon = True
+            handshake.start()
+            listening.settimeout(0.1)
+            deadline = time.time() + 10
+            while handshake.is_alive() and time.time() < deadline:
+                server.listen()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        finally:
+            client.get_socket(False).close()
+            listening.close()
+
+
+class DemuxBufferTests(unittest.TestCase):
+
+    def test_drops(self):
+        root = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        root.bind((HOST, 0))
+        sender = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        try:
+            udp_demux = demux.UDPDemux(root, rcvbuf=4096, max_rcvbuf=1 << 20)
+            if udp_demux.drops is None:
+                self.skipTest("The platform does not report drops")
+            self.assertEqual(udp_demux.drops, 0)
+            size = root.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            for _ in range(100):
+                sender.sendto("x" * 1000, root.getsockname()[:2])
+            self.assertGreater(udp_demux.drops, 0)
+            udp_demux.service()
+            self.assertGreater(
+                root.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), size)
+        finally:
+            sender.close()
+            root.close()
+
+    def test_pending(self):
+        from dtls.demux.router import UDPDemux
+        root = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        root.bind(("127.0.0.1", 0))
+        root.settimeout(1)
+        senders = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                   for _ in range(3)]
+        try:
+            for sender in senders:
+                sender.bind(("127.0.0.1", 0))
+            udp_demux = UDPDemux(root, max_pending=2)
+            default = udp_demux.get_connection(None)
+            for i, sender in enumerate(senders):
+                sender.sendto(str(i), root.getsockname())
+            first = senders[0].getsockname()
+            # New peers' datagrams are held until forwarded
+            for _ in range(3):
+                self.assertEqual(udp_demux.service(), first)
+            self.assertEqual(udp_demux.pending, 2)
+            self.assertEqual(udp_demux.pending_drops, 1)
+            self.assertEqual(udp_demux.payload, "0")
+            udp_demux.forward()
+            self.assertEqual(udp_demux.payload_peer_address,
+                             senders[1].getsockname())
+            # Held datagrams go to connections created in the meantime
+            conn = udp_demux.get_connection(senders[1].getsockname())
+            root.setblocking(False)
+            self.assertIsNone(udp_demux.service())
+            self.assertEqual(udp_demux.pending, 0)
+            conn.settimeout(1)
+            self.assertEqual(default.recv(10), "0")
+            self.assertEqual(conn.recv(10), "1")
+        finally:
+            for sender in senders:
+                sender.close()
+            root.close()
+
+
+class DemuxPumpTests(unittest.TestCase):
+
+    def test_blocking_read(self):
+        listening = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        listening.bind((HOST, 0))
+        server = SSLConnection(listening, keyfile=CERTFILE, certfile=CERTFILE,
+                               server_side=True)
+        client = SSLConnection(socket.socket(AF_INET4_6, socket.SOCK_DGRAM))
+        def connect():
+            client.connect(listening.getsockname()[:2])
+            client.write("ping")
+        thread = threading.Thread(target=connect)
+        thread.daemon = True
+        server.start_pump()
+        try:
+            thread.start()
+            listening.settimeout(5)
+            acc_ret = None
+            while not acc_ret:
+                acc_ret = server.accept()
+            conn = acc_ret[0]
+            conn.get_socket(True).settimeout(5)
+            # Without the pump, reads would not be serviced
+            self.assertEqual(conn.read(), "ping")
+            thread.join(5)
+        finally:
+            server.stop_pump()
+            client.get_socket(False).close()
+            listening.close()
+
+    def test_close(self):
+        from dtls.demux.router import UDPDemux
+        root = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        root.bind(("127.0.0.1", 0))
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.bind(("127.0.0.1", 0))
+        udp_demux = UDPDemux(root)
+        try:
+            conn = udp_demux.get_connection(sender.getsockname())
+            conn.settimeout(1)
+            udp_demux.start_pump()
+            pump = udp_demux._pump
+            sender.sendto("known", root.getsockname())
+            self.assertEqual(conn.recv(10), "known")
+            other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            other.bind(("127.0.0.1", 0))
+            other.sendto("new", root.getsockname())
+            root.settimeout(1)
+            self.assertEqual(udp_demux.service(), other.getsockname())
+            self.assertEqual(udp_demux.payload, "new")
+            other.close()
+        finally:
+            sender.close()
+            root.close()
+        pump.join(2)
+        self.assertFalse(pump.is_alive())
+        self.assertIsNone(udp_demux._pump)
+
+
+class ClientMuxTests(unittest.TestCase):
+
+    def setUp(self):
+        self._servers = []
+
+    def tearDown(self):
+        for server in self._servers:
+            server.__exit__(None, None, None)
+
+    def _echo_server(self):
+        def serve(conn):
+            conn.get_socket(True).settimeout(5)
+            try:
+                while True:
+                    conn.write(conn.read())
+            except ssl.SSLError:
+                pass
+            try:
+                conn.shutdown()
+            except ssl.SSLError:
+                pass
+        server = AcceptingServer(serve, keyfile=CERTFILE, certfile=CERTFILE)
+        self._servers.append(server.__enter__())
+        return server.address
+
+    def test_blocking(self):
+        mux = ClientMux(family=AF_INET4_6, timeout=5)
+        try:
+            addresses = [self._echo_server() for _ in range(3)]
+            conns = [mux.connect(address) for address in addresses]
+            self.assertEqual(len(set(conn.get_socket(False) for conn in conns)),
+                             1)
+            self.assertRaises(ValueError, mux.connect, addresses[0])
+            for i, conn in enumerate(conns):
+                conn.write("ping %d" % i)
+            # Replies for the other connections are queued while reading
+            for i in reversed(range(len(conns))):
+                self.assertEqual(conns[i].read(), "ping %d" % i)
+            # The shared socket remains open for the other connections
+            conns[0].shutdown()
+            conns[1].write("pong")
+            self.assertEqual(conns[1].read(), "pong")
+        finally:
+            mux.close()
+
+    def test_service(self):
+        mux = ClientMux(family=AF_INET4_6, timeout=0,
+                        do_handshake_on_connect=False)
+        try:
+            conns = [mux.connect(self._echo_server()) for _ in range(3)]
+            deadline = time.time() + 10
+            handshaking = set(conns)
+            while handshaking and time.time() < deadline:
+                for conn in list(handshaking):
+                    if not conn.try_handshake():
+                        handshaking.remove(conn)
+                mux.service(0.1)
+            self.assertFalse(handshaking)
+            for conn in conns:
+                conn.write("x")
+            replies = {}
+            while len(replies) < len(conns) and time.time() < deadline:
+                for conn in mux.service(1):
+                    replies[conn] = conn.try_read()
+            self.assertEqual(replies, dict((conn, "x") for conn in conns))
+        finally:
+            mux.close()
+
+
+class ClassifierTests(unittest.TestCase):
+
+    def test_classify(self):
+        from dtls.demux.classify import classify, DTLS, STUN, RTP
+        for first, protocol in ((0, STUN), (3, STUN), (20, DTLS), (63, DTLS),
+                                (128, RTP), (191, RTP), (4, None),
+                                (16, None), (64, None), (192, None)):
+            self.assertEqual(classify(chr(first) + "payload"), protocol)
+        self.assertIsNone(classify(""))
+
+    def test_routing_demux(self):
+        from dtls.demux.router import UDPDemux
+        received = []
+        classifier = PacketClassifier(
+            stun=lambda data, peer: received.append(("stun", data, peer)),
+            rtp=lambda data, peer: received.append(("rtp", data, peer)))
+        root = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        root.bind((HOST, 0))
+        root.settimeout(2)
+        sender = socket.socket(AF_INET4_6, socket.SOCK_DGRAM)
+        sender.bind((HOST, 0))
+        try:
+            udp_demux = UDPDemux(root, classifier=classifier)
+            for data in "\x00stun", "\x80rtp", "\x10zrtp", "\x16dtls":
+                sender.sendto(data, root.getsockname())
+            peer = None
+            for _ in range(4):
+                peer = udp_demux.service()
+            self.assertEqual(peer, sender.getsockname())
+            self.assertEqual(udp_demux.payload, "\x16dtls")
+            self.assertEqual(received,
+                             [("stun", "\x00stun", peer),
+                              ("rtp", "\x80rtp", peer)])
+            self.assertEqual(classifier.drops, 1)
+        finally:
+            sender.close()
+            root.close()
+
+    def test_connections(self):
+        received = []
+        classifier = PacketClassifier(
+            stun=lambda data, peer: received.append(data),
+            rtp=lambda data, peer: received.append(data))
+        def serve(conn):
+            conn.get_socket(True).settimeout(5)
+            conn.write(conn.read())
+        with AcceptingServer(serve, keyfile=CERTFILE, certfile=CERTFILE,
+                             classifier=classifier) as server:
+            address = server.address
+            mux = ClientMux(family=AF_INET4_6, timeout=5,
+                            classifier=classifier)
+            try:
+                # Media of the same peers precedes and follows the handshake
+                mux_sock = mux._sock
+                mux_sock.sendto("\x01binding request", address)
+                conn = mux.connect(address)
+                mux_sock.sendto("\x80media", address)
+                conn.write("dtls")
+                self.assertEqual(conn.read(), "dtls")
+                server.listening.sendto("\x01binding response",
+                                        mux_sock.getsockname())
+                mux.service(1)
+                deadline = time.time() + 5
+                while len(received) < 3 and time.time() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(sorted(received),
+                                 ["\x01binding request",
+                                  "\x01binding response", "\x80media"])
+            finally:
+                mux.close()
+
+
+class PacketInfoTests(unittest.TestCase):
+
+    def _wildcard_socket(self):
+        # A dual-stack socket where IPv6 is available
+        if socket.has_ipv6:
+            try:
+                sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+                sock.bind(("::", 0))
+                return sock
+            except socket.error:
+                pass
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("0.0.0.0", 0))
+        return sock
+
+    def test_addresses(self):
+        from ctypes import addressof, create_string_buffer
+        from dtls.msghdr import encode_address, decode_address
+        for family, address in (
+                (socket.AF_INET, ("192.0.2.1", 4433)),
+                (socket.AF_INET6, ("2001:db8::1", 4433, 0, 2))):
+            name = create_string_buffer(encode_address(family, address))
+            self.assertEqual(decode_address(addressof(name), len(name.raw)),
+                             address)
+
+    def test_socket(self):
+        from dtls.pktinfo import PacketInfoSocket
+        wildcard = self._wildcard_socket()
+        wildcard.settimeout(2)
+        sending = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sending.settimeout(2)
+        try:
+            try:
+                pktinfo = PacketInfoSocket(wildcard)
+            except socket.error:
+                self.skipTest("Packet information unavailable")
+            # Replies through the routing table would leave from 127.0.0.1
+            sending.connect(("127.0.0.2", wildcard.getsockname()[1]))
+            sending.send("ping")
+            data, peer, local = pktinfo.recvfrom()
+            self.assertEqual(data, "ping")
+            self.assertTrue(peer[0].endswith(sending.getsockname()[0]))
+            self.assertTrue(local[0].endswith("127.0.0.2"))
+            self.assertEqual(local[1], wildcard.getsockname()[1])
+            pktinfo.sendto("pong", peer, local)
+            self.assertEqual(sending.recv(100), "pong")
+        finally:
+            sending.close()
+            wildcard.close()
+
+    def test_connections(self):
+        from dtls.demux.osnet import UDPDemux
+        if demux.UDPDemux is not UDPDemux:
+            self.skipTest("The routing demux sends from the addresses that "
+                          "the routing table selects")
+        from dtls.pktinfo import PacketInfoSocket
+        listening = self._wildcard_socket()
+        try:
+            PacketInfoSocket(listening)
+        except socket.error:
+            listening.close()
+            self.skipTest("Packet information unavailable")
+        port = listening.getsockname()[1]
+        endpoints = [(socket.AF_INET, "127.0.0.1"),
+                     (socket.AF_INET, "127.0.0.2")]
+        if listening.family == socket.AF_INET6:
+            endpoints.append((socket.AF_INET6, "::1"))
+        with AcceptingServer(lambda conn: conn.write(conn.read()),
+                             len(endpoints), listening, keyfile=CERTFILE,
+                             certfile=CERTFILE) as server:
+            self.assertTrue(server.server._udp_demux.pktinfo)
+            clients = []
+            try:
+                for family, host in endpoints:
+                    sock = socket.socket(family, socket.SOCK_DGRAM)
+                    sock.settimeout(5)
+                    client = SSLConnection(sock)
+                    clients.append(client)
+                    client.connect((host, port))
+                    client.write(host)
+                    self.assertEqual(client.read(), host)
+                server.thread.join(5)
+                self.assertFalse(server.thread.is_alive())
+            finally:
+                for client in clients:
+                    client.get_socket(False).close()
+
+
 def hostname_for_protocol(protocol):
     global HOST
     # We can't quite predict the content of the hosts file, but we prefer names
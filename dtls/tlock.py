@@ -38,6 +38,8 @@ DO_DEBUG_LOG = False
 def tlock_init():
     if not globals().has_key("threading"):
         return  # nothing to configure
+    if OPENSSL_1_1_API:
+        return  # the library performs its own locking
     # The standard library ssl module's lock implementation is more efficient;
     # do not override it if it has been established
     if CRYPTO_get_id_callback():
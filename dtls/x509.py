@@ -101,11 +101,11 @@ def _create_tuple_for_X509_NAME(xname):
     level = -1
     for ind in range(X509_NAME_entry_count(xname)):
         name_entry_ptr = X509_NAME_get_entry(xname, ind)
-        name_entry = name_entry_ptr.contents
-        if level >= 0 and level != name_entry.set:
+        name_entry_set = X509_NAME_ENTRY_set(name_entry_ptr)
+        if level >= 0 and level != name_entry_set:
             distinguished_name.append(tuple(relative_distinguished_name))
             relative_distinguished_name = []
-        level = name_entry.set
+        level = name_entry_set
         asn1_object = X509_NAME_ENTRY_get_object(name_entry_ptr)
         asn1_string = X509_NAME_ENTRY_get_data(name_entry_ptr)
         attribute_tuple = _create_tuple_for_attribute(asn1_object, asn1_string)
@@ -126,8 +126,9 @@ def _get_peer_alt_names(cert):
             ret_list = []
         ext_ptr = X509_get_ext(cert.value, ext_index)
         method_ptr = X509V3_EXT_get(ext_ptr)
+        ext_data = X509_EXTENSION_get_data(ext_ptr)
         general_names = _STACK(ASN1_item_d2i(method_ptr.contents,
-                                             ext_ptr.contents.value.contents))
+                                             ext_data.contents))
         for name_index in range(sk_num(general_names.value)):
             name_ptr = sk_value(general_names.value, name_index)
             if name_ptr.contents.type == GEN_DIRNAME: